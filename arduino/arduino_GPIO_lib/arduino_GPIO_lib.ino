@@ -20,7 +20,23 @@ bool use_update = true; // use pin update function
 int update_val = 0;  // carry for update
 unsigned long previousMillis = 0;
 const long interval = 10;
-#define analog_tolerance 10
+#define analog_tolerance 10  // default deadband of analog inputs
+
+// Binary wire protocol (M110 S1), see px_device_interfaces/wire_protocol.py
+// Frame: [0x80 | opcode << 3 | length][pin][value, length bytes little endian][crc8], ack: 0x80
+bool use_binary = false;
+#define FRAME_FLAG 0x80
+#define OP_DIGITAL_READ 1
+#define OP_DIGITAL_WRITE 2
+#define OP_ANALOG_READ 3
+#define OP_ANALOG_WRITE 4
+#define OP_SERVO_WRITE 5
+#define OP_DIGITAL_WRITE_MANY 6  // pin: bank, value: mask | bits << 16
+#define OP_DIGITAL_REPORT 8
+#define OP_ANALOG_REPORT 9
+uint8_t frame[10];  // binary frame being received
+int frame_len = 0;
+int frame_need = 0;
 Servo servos[8];
 //LiquidCrystal_I2C lcd(0x27, 20, 4, 3, 4);
 LiquidCrystal_I2C lcd(0x27, 20, 4);
@@ -39,6 +55,9 @@ void setup() {
   sofar=0;
   for(int i = 0; i < io_pins; i++) {
     input_array[i][1] = 0;
+    analog_deadband[i] = analog_tolerance;
+    report_interval[i] = 0;
+    last_report[i] = 0;
   }
   Serial.println(">");
   Serial1.println(">");
@@ -46,6 +65,63 @@ void setup() {
 }
 
 
+HardwareSerial& reply_port() {
+  switch(msg_from_port) {
+    case 1: return Serial1;
+    case 2: return Serial2;
+    default: return Serial;
+  }
+}
+
+
+uint8_t crc8(const uint8_t *data, int len) {  // CRC-8, poly 0x07
+  uint8_t crc = 0;
+  for (int i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (int b = 0; b < 8; b++) {
+      if (crc & 0x80) crc = (crc << 1) ^ 0x07;
+      else crc = crc << 1;
+    }
+  }
+  return crc;
+}
+
+
+void send_frame(uint8_t op, uint8_t pin, int value, uint8_t len) {
+  uint8_t out[10];
+  out[0] = FRAME_FLAG | (op << 3) | len;
+  out[1] = pin;
+  for (int i = 0; i < len; i++) {
+    out[2 + i] = (value >> (8 * i)) & 0xFF;
+  }
+  out[2 + len] = crc8(out, 2 + len);
+  reply_port().write(out, 3 + len);
+}
+
+
+void send_ack() {
+  if (use_binary) reply_port().write((uint8_t)FRAME_FLAG);
+  else reply_port().println(">");
+}
+
+
+void report_input(char kind, int pin, int value) {  // kind: 'd' digital, 'a' analog
+  if (use_binary) {
+    if (kind == 'd') send_frame(OP_DIGITAL_REPORT, pin, value, 1);
+    else send_frame(OP_ANALOG_REPORT, pin, value, 2);
+  } else {
+    reply_port().println(String(kind) + ":" + String(pin) + ":" + String(value));
+  }
+}
+
+
+void set_protocol(int binary) {
+  use_binary = (binary == 1);
+  if (use_binary) reply_port().println("bin:1");
+  else reply_port().println("bin:0");
+}
+
+
 void setup_data(int mode) {
   switch(mode) {
     case 0: use_update != use_update; break;
@@ -80,6 +156,17 @@ void set_input_pullup(int pin_num){
   }
 }
 
+void set_report(int pin_num, int deadband, int interval_ms){  // M7, -1 keeps the value
+  if (pin_num >= 0 && pin_num < io_pins) {
+    if (deadband >= 0) analog_deadband[pin_num] = deadband;
+    if (interval_ms >= 0) report_interval[pin_num] = interval_ms;
+  }
+}
+
+bool report_due(int pin_num, unsigned long now){  // min report interval elapsed
+  return now - last_report[pin_num] >= report_interval[pin_num];
+}
+
 void set_servo(int pin_num, int servo_index){
   if (pin_num > 0) {
     servos[servo_index].attach(pin_num);
@@ -88,6 +175,10 @@ void set_servo(int pin_num, int servo_index){
 
 void digital_read(int pin_num){
   if (pin_num > 0) {
+    if (use_binary) {
+      send_frame(OP_DIGITAL_REPORT, pin_num, digitalRead(pin_num) == HIGH, 1);
+      return;
+    }
     String send_val = "";
     if (digitalRead(pin_num) == HIGH)
       send_val = "1";
@@ -113,8 +204,19 @@ void digital_write(int pin_num, int set_val){
 }
 
 
+void digital_write_bank(int bank, unsigned int mask, unsigned int bits){  // P7, pins bank*16 .. bank*16+15
+  for (int i = 0; i < 16; i++) {
+    if ((mask & (1U << i)) && bank * 16 + i < io_pins) digital_write(bank * 16 + i, (bits >> i) & 1);
+  }
+}
+
+
 void analog_read(int pin_num){
   if (pin_num > 0) {
+    if (use_binary) {
+      send_frame(OP_ANALOG_REPORT, pin_num, analogRead(pin_num), 2);
+      return;
+    }
     switch(msg_from_port) {
       case 0: Serial.println(analogRead(pin_num)); break;
       case 1: Serial1.println(analogRead(pin_num)); break;
@@ -143,19 +245,19 @@ void lcd_system(){
     case 1: 
         switch(msg_from_port) {
           case 0: 
-              Serial.println(">");
+              send_ack();
               while(Serial.available() == 0){}// until something is available
               while(Serial.available() > 0){
                 char lcd_text=Serial.read(); 
                 if (lcd_text!='\n'){lcd.print(lcd_text);}else{break;}}  break;
           case 1: 
-              Serial1.println(">");
+              send_ack();
               while(Serial1.available() == 0){}// until something is available
               while(Serial1.available() > 0){
                 char lcd_text=Serial1.read(); 
                 if (lcd_text!='\n'){lcd.print(lcd_text);}else{break;}}  break;
           case 2: 
-              Serial2.println(">");
+              send_ack();
               while(Serial2.available() == 0){}// until something is available
               while(Serial2.available() > 0){
                 char lcd_text=Serial2.read(); 
@@ -184,6 +286,47 @@ void firmware_callback() {
 }
 
 
+void process_frame() {
+  if (crc8(frame, frame_len - 1) != frame[frame_len - 1]) {
+    reply_port().println("ERROR: crc");
+    return;
+  }
+  uint8_t op = (frame[0] >> 3) & 0x0F;
+  int pin = frame[1];
+  unsigned long value = 0;
+  for (int i = frame_len - 2; i > 1; i--) {  // little endian
+    value = (value << 8) | frame[i];
+  }
+  switch(op) {
+    case OP_DIGITAL_READ: digital_read(pin); break;
+    case OP_DIGITAL_WRITE: digital_write(pin, value); break;
+    case OP_ANALOG_READ: analog_read(pin); break;
+    case OP_ANALOG_WRITE: analog_write(pin, value); break;
+    case OP_SERVO_WRITE: servo_write(pin, value); break;
+    case OP_DIGITAL_WRITE_MANY: digital_write_bank(pin, value & 0xFFFF, value >> 16); break;
+    default: break;
+  }
+}
+
+
+// Collect a binary frame, returns true if c belongs to one
+bool read_frame(char c, int port) {
+  uint8_t b = (uint8_t)c;
+  if (frame_len == 0) {
+    if (!use_binary || sofar > 0 || !(b & FRAME_FLAG)) return false;
+    frame_need = 3 + (b & 0x07);
+  }
+  frame[frame_len++] = b;
+  if (frame_len == frame_need) {
+    msg_from_port = port;
+    process_frame();
+    frame_len = 0;
+    send_ack();
+  }
+  return true;
+}
+
+
 float parsenumber(char code,float val) {
   char *ptr=buffer;  // start at the beginning of buffer
   while((long)ptr > 1 && (*ptr) && (long)ptr < (long)buffer+sofar) {  // walk to the end
@@ -207,7 +350,9 @@ void processCommand(){
     case 3: set_input_pullup(parsenumber('N',-1)); break;
     case 4: set_input_analog(parsenumber('N',-1)); break;
     case 5: set_servo(parsenumber('N',-1),parsenumber('A',-1)); break;
+    case 7: set_report(parsenumber('N',-1),parsenumber('D',-1),parsenumber('T',-1)); break;
     case 100: firmware_callback(); break;
+    case 110: set_protocol(parsenumber('S',0)); break;
     case 999: Serial.println("#RESET#"); Serial1.println("#RESET#"); Serial2.println("#RESET#"); break;   // RESET WiFi
     default: break;
   }
@@ -221,6 +366,8 @@ void processCommand(){
     case 4: analog_write(parsenumber('N',-1), parsenumber('V',-1)); break;
     case 5: servo_write(parsenumber('N',-1), parsenumber('V',-1)); break;
     case 6: lcd_system(); break;
+    // P7 B<bank> K<mask> V<bits>, the mask must not be an 'M' word (read as command above)
+    case 7: digital_write_bank(parsenumber('B',-1), (unsigned int)parsenumber('K',0), (unsigned int)parsenumber('V',0)); break;
     default: break;
   }
   
@@ -243,28 +390,20 @@ void loop() {
           case 1: 
             //Serial.println(digitalRead(i)); 
             if(digitalRead(i) == HIGH) {update_val = 0;}else{update_val = 1;}
-            if(update_val != input_array[i][1]) {  // Digital read, if val dif => update array and send to serial
+            if(update_val != input_array[i][1] && report_due(i, currentMillis)) {  // Digital read, if val dif => update array and send to serial
               input_array[i][1] = update_val;
-              switch(msg_from_port) {
-                case 0: Serial.println("d:" + String(i) + ":" + String(update_val));continue;
-                case 1: Serial1.println("d:" + String(i) + ":" + String(update_val));continue;
-                case 2: Serial2.println("d:" + String(i) + ":" + String(update_val));continue;
-                default: continue;
-              } 
+              last_report[i] = currentMillis;
+              report_input('d', i, update_val);
             }
             continue;
           case 2: 
             update_val = analogRead(i);
-            if ((update_val > input_array[i][1] + analog_tolerance) or
-              (update_val < input_array[i][1] - analog_tolerance)) {  // Analog read, if val dif => update array and send to serial
+            if (((update_val > input_array[i][1] + analog_deadband[i]) or
+              (update_val < input_array[i][1] - analog_deadband[i])) && report_due(i, currentMillis)) {  // Analog read, if val dif => update array and send to serial
               //if(update_val != input_array[i][1])
               input_array[i][1] = update_val;
-              switch(msg_from_port) {
-                case 0: Serial.println("a:" + String(i) + ":" + String(update_val));continue;
-                case 1: Serial1.println("a:" + String(i) + ":" + String(update_val));continue;
-                case 2: Serial2.println("a:" + String(i) + ":" + String(update_val));continue;
-                default: continue;
-              } 
+              last_report[i] = currentMillis;
+              report_input('a', i, update_val);
             }
             continue;
           default: 
@@ -281,6 +420,7 @@ void loop() {
 
   while(Serial.available() > 0) {  // if something is available
     char c=Serial.read();  // get it
+    if(read_frame(c, 0)) continue;  // binary protocol frame
     //Serial.print(c);  // repeat it back so I know you got the message
     if(sofar<MAX_BUF-1) buffer[sofar++]=c;  // store it
     if((c=='\n') || (c == '\r')|| (c == ';')) {
@@ -290,12 +430,13 @@ void loop() {
       msg_from_port=0;
       processCommand();  // do something with the command
       sofar=0;
-      Serial.println(">");
+      send_ack();
     }
   }
 
   while(Serial1.available() > 0) {  // if something is available
     char c=Serial1.read();  // get it
+    if(read_frame(c, 1)) continue;  // binary protocol frame
     //Serial.print(c);  // repeat it back so I know you got the message
     if(sofar<MAX_BUF-1) buffer[sofar++]=c;  // store it
     if((c=='\n') || (c == '\r')|| (c == ';')) {
@@ -305,12 +446,13 @@ void loop() {
       msg_from_port=1;
       processCommand();  // do something with the command
       sofar=0;
-      Serial1.println(">");
+      send_ack();
     }
   }
 
   while(Serial2.available() > 0) {  // if something is available
     char c=Serial2.read();  // get it
+    if(read_frame(c, 2)) continue;  // binary protocol frame
     Serial.print(c);  // repeat it back so I know you got the message
     if(sofar<MAX_BUF-1) buffer[sofar++]=c;  // store it
     if((c=='\n') || (c == ';')) {
@@ -320,7 +462,7 @@ void loop() {
       msg_from_port=2;
       processCommand();  // do something with the command
       sofar=0;
-      Serial2.println(">");
+      send_ack();
     }
   }
 
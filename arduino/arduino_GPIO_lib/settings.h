@@ -13,6 +13,11 @@ int input_array[io_pins][2]; // list to check pin update
   [1] Val: Digital 0/1, Analog 0-1024
 */
 
+// Report by exception (M7 N{pin} D{deadband} T{interval_ms})
+int analog_deadband[io_pins];          // analog change needed for a report
+unsigned int report_interval[io_pins];  // min ms between two reports of a pin
+unsigned long last_report[io_pins];     // millis() of the last report
+
 void set_input_array(int mode, int pin) {
   input_array[pin][0] = mode;
 }
\ No newline at end of file
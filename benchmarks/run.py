@@ -0,0 +1,219 @@
+"""
+Transport benchmarks of px_device_interfaces against local stand-ins (see standins.py).
+
+    python benchmarks/run.py --samples 1000 --output result.json
+
+Measures per transport:
+    round_trip              send() until the ">" ack came back (send_window 1)
+    throughput              sustained commands per second with a send window
+    report_to_digital_read  input change on the board until GPIOlib.digital_read() sees it
+    request_from_device     OPC-UA read of one node, request_many of all modules
+Latencies are reported as p50/p99/mean/max in microseconds, the result is one JSON document.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import px_device_interfaces
+from px_device_interfaces import ArduinoGPIOlib, ConnectionOrganiser
+from px_device_interfaces.simulator import Simulator
+
+from standins import OPCStandIn, SerialStandIn, TCPStandIn
+
+COMMAND = "P2 N13 V1"
+INPUT_PIN = 22
+OPC_MODULES = [f'K{number}' for number in range(16)]
+
+
+def percentile(ordered: list, fraction: float) -> int:
+    """
+    Nearest rank percentile of a sorted list
+    """
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def latency_summary(samples_ns: list) -> dict:
+    ordered = sorted(samples_ns)
+    return {
+        "samples": len(ordered),
+        "p50_us": round(percentile(ordered, 0.50) / 1000, 1),
+        "p99_us": round(percentile(ordered, 0.99) / 1000, 1),
+        "mean_us": round(sum(ordered) / len(ordered) / 1000, 1),
+        "max_us": round(ordered[-1] / 1000, 1),
+    }
+
+
+def write_settings(name: str, settings: dict):
+    os.makedirs("sys_files/Connection_Organiser", exist_ok=True)
+    with open(f'sys_files/Connection_Organiser/{name}.data', "w") as file:
+        file.write("".join(f'{key}:{value}\n' for key, value in settings.items()))
+
+
+def bench_round_trip(device: ConnectionOrganiser, samples: int) -> dict:
+    device.send_window = 1
+    results = []
+    for _ in range(samples):
+        start = time.perf_counter_ns()
+        device.send(COMMAND)
+        if not device.flush(5):
+            return {"error": "ack timeout"}
+        results.append(time.perf_counter_ns() - start)
+    return latency_summary(results)
+
+
+def bench_throughput(device: ConnectionOrganiser, samples: int, send_window: int) -> dict:
+    device.send_window = send_window
+    start = time.perf_counter_ns()
+    for _ in range(samples):
+        device.send(COMMAND)
+    if not device.flush(60):
+        return {"error": "ack timeout"}
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    return {"commands": samples, "send_window": send_window, "seconds": round(elapsed, 4),
+            "commands_per_s": round(samples / elapsed, 1)}
+
+
+def bench_report(gpio: ArduinoGPIOlib, board, samples: int) -> dict:
+    results = []
+    for index in range(samples):
+        value = (index + 1) % 2
+        start = time.perf_counter_ns()
+        board.set_input(INPUT_PIN, value)
+        if not gpio.wait_for_input(INPUT_PIN, bool(value), timeout=5):
+            return {"error": "report timeout"}
+        results.append(time.perf_counter_ns() - start)
+    assert gpio.digital_read(INPUT_PIN) == bool(value)
+    return latency_summary(results)
+
+
+def bench_gpio(name: str, settings: dict, board_of, samples: int, send_window: int) -> dict:
+    """
+    All GPIO benchmarks on one connection, board_of() returns the emulated board after connect
+    """
+    write_settings(name, settings)
+    os.makedirs("sys_files/GPIO_Lib", exist_ok=True)
+    with open(f'sys_files/GPIO_Lib/{name}.data', "w") as file:
+        file.write(f'>output 13 led\n>input_pullup {INPUT_PIN} button\n')
+    gpio = ArduinoGPIOlib(name, firmware="GPIO_lib_mega", init_connect=True)
+    if not gpio.connected:
+        return {"error": "connect failed"}
+    try:
+        gpio.flush(5)
+        return {
+            "round_trip": bench_round_trip(gpio, samples),
+            "throughput": bench_throughput(gpio, samples, send_window),
+            "report_to_digital_read": bench_report(gpio, board_of(), samples),
+        }
+    finally:
+        gpio.disconnect()
+
+
+def bench_usb(simulator: Simulator, args) -> dict:
+    try:
+        stand_in = SerialStandIn(simulator, latency=args.latency, baud=args.baud)
+    except ImportError as e:
+        return {"skipped": f'no pty: {e}'}
+    try:
+        return bench_gpio("bench_usb", {"type": "USB", "usb_port": stand_in.port, "usb_baud": 115200},
+                          lambda: stand_in.board, args.samples, args.send_window)
+    finally:
+        stand_in.close()
+
+
+def bench_wifi(simulator: Simulator, args) -> dict:
+    stand_in = TCPStandIn(simulator, latency=args.latency, baud=args.baud)
+    try:
+        return bench_gpio("bench_wifi", {"type": "WIFI", "wifi_host": stand_in.host, "wifi_port": stand_in.port},
+                          lambda: stand_in.board, args.samples, args.send_window)
+    finally:
+        stand_in.close()
+
+
+def bench_opc(args) -> dict:
+    stand_in = OPCStandIn(OPC_MODULES)
+    try:
+        write_settings("bench_opc", {"type": "OPC", "opc_client_address": stand_in.address})
+        device = ConnectionOrganiser("bench_opc", init_connect=True)
+        if not device.connected:
+            return {"error": "connect failed"}
+        try:
+            node_ids = [f'ns=3;s="{module}"."Array"' for module in OPC_MODULES]
+            device.request_from_device(node_ids[0])  # Registers the node
+            single = []
+            for _ in range(args.samples):
+                start = time.perf_counter_ns()
+                device.request_from_device(node_ids[0])
+                single.append(time.perf_counter_ns() - start)
+            many = []
+            for _ in range(max(1, args.samples // 10)):
+                start = time.perf_counter_ns()
+                device.request_many(node_ids)
+                many.append(time.perf_counter_ns() - start)
+            return {
+                "request_from_device": latency_summary(single),
+                "request_many": dict(latency_summary(many), nodes=len(node_ids)),
+            }
+        finally:
+            device.disconnect()
+    finally:
+        stand_in.close()
+
+
+def main(argv: list = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=1000, help="measurements per benchmark")
+    parser.add_argument("--send-window", type=int, default=8, help="send window of the throughput benchmark")
+    parser.add_argument("--latency", type=float, default=0, help="reply latency of the emulated boards (s)")
+    parser.add_argument("--baud", type=int, default=0, help="line speed of the emulated boards, 0 is unlimited")
+    parser.add_argument("--transports", default="usb,wifi,opc", help="comma separated subset of usb,wifi,opc")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+
+    result = {
+        "package_version": px_device_interfaces.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {"samples": args.samples, "send_window": args.send_window,
+                   "latency_s": args.latency, "baud": args.baud},
+        "results": {},
+    }
+    transports = [transport.strip() for transport in args.transports.split(",") if transport.strip()]
+    simulator = Simulator()
+    cwd = os.getcwd()
+    # Settings files go to a scratch directory, library output to stderr to keep stdout JSON only
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(sys.stderr):
+        os.chdir(workdir)
+        try:
+            for transport in transports:
+                if transport == "usb":
+                    result["results"]["usb"] = bench_usb(simulator, args)
+                elif transport == "wifi":
+                    result["results"]["wifi"] = bench_wifi(simulator, args)
+                elif transport == "opc":
+                    result["results"]["opc"] = bench_opc(args)
+                else:
+                    parser.error(f'unknown transport {transport!r}')
+        finally:
+            os.chdir(cwd)
+            simulator.close()
+
+    text = json.dumps(result, indent=2)
+    if output:
+        with open(output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Local stand-ins for the transports of ConnectionOrganiser, no hardware needed.
+
+USB:  a pty pair, the firmware emulation of px_device_interfaces.simulator runs on the master end
+WIFI: a localhost TCP server, every accepted connection gets its own emulated board
+OPC:  an opcua.Server with "<module>"."Array" nodes (16 bytes) in namespace 3 like the SPS
+"""
+import os
+import socket
+import threading
+
+from opcua import Server, ua
+
+from px_device_interfaces.simulator import Simulator
+
+
+class PtyEnd:
+    def __init__(self, fd: int):
+        """
+        Socket like wrapper of a pty master for Simulator.attach()
+        :type fd: int
+        """
+        self.fd = fd
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def setblocking(self, blocking: bool):
+        os.set_blocking(self.fd, blocking)
+
+    def send(self, data: bytes) -> int:
+        return os.write(self.fd, data)
+
+    def recv(self, size: int) -> bytes:
+        return os.read(self.fd, size)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SerialStandIn:
+    def __init__(self, simulator: Simulator, firmware: str = "GPIO_lib_mega", **board_options):
+        """
+        Emulated board behind a pty, connect to port with type USB.\n
+        Not available on Windows (no pty module).
+        :type simulator: Simulator
+        :type firmware: str
+        """
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.slave = slave  # Kept open, the master reads EIO while no side has the port open
+        self.port = os.ttyname(slave)
+        self.board = simulator.attach(PtyEnd(master), firmware, **board_options)
+
+    def close(self):
+        self.board.simulator.remove(self.board)
+        os.close(self.slave)
+
+
+class TCPStandIn:
+    def __init__(self, simulator: Simulator, firmware: str = "GPIO_lib_mega", **board_options):
+        """
+        Localhost TCP server like the Wi-Fi bridge of the board, connect to host:port with type WIFI.\n
+        board is the emulated board of the latest connection.
+        :type simulator: Simulator
+        :type firmware: str
+        """
+        self.simulator = simulator
+        self.firmware = firmware
+        self.board_options = board_options
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.host, self.port = self.server.getsockname()
+        self.board = None
+        self.connected = threading.Event()
+        self.thread = threading.Thread(target=self.__accept, daemon=True)
+        self.thread.start()
+
+    def __accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.board = self.simulator.attach(connection, self.firmware, **self.board_options)
+            self.connected.set()
+
+    def close(self):
+        self.server.close()
+
+
+class OPCStandIn:
+    def __init__(self, modules: list):
+        """
+        opcua.Server with one writable Byte[16] node ns=3;s="<module>"."Array" per module
+        :type modules: list
+        """
+        self.server = Server()
+        with socket.create_server(("127.0.0.1", 0)) as probe:
+            port = probe.getsockname()[1]
+        self.address = f'opc.tcp://127.0.0.1:{port}/'
+        self.server.set_endpoint(self.address)
+        # ns=3 like the SPS
+        self.server.register_namespace("px_device_interfaces")
+        namespace = self.server.register_namespace("px_device_interfaces.benchmarks")
+        objects = self.server.get_objects_node()
+        self.nodes: dict = {}
+        for module in modules:
+            node = objects.add_variable(ua.NodeId(f'"{module}"."Array"', namespace), module,
+                                        ua.Variant([0] * 16, ua.VariantType.Byte))
+            node.set_writable()
+            self.nodes[module] = node
+        self.server.start()
+
+    def close(self):
+        self.server.stop()
@@ -1,13 +1,25 @@
 __version__ = "0.0.1"
 
 from .arduino_GPIO_lib import GPIOlib as ArduinoGPIOlib
+from .async_connection_organiser import AsyncConnectionOrganiser
+from .async_GPIO_lib import GPIOlib as AsyncGPIOlib
 from .connection_organiser_with_opc import ConnectionOrganiser
+from .debug_monitor import DebugMonitor
+from .device_pool import DevicePool
+from .metrics import MetricsServer
 from .opc_GPIO_lib import GPIOlib as OPCGPIOlib
+from .pin_history import PinHistory
 from .timer import Timer
 
 __all__ = [
     "ArduinoGPIOlib",
+    "AsyncConnectionOrganiser",
+    "AsyncGPIOlib",
     "ConnectionOrganiser",
+    "DebugMonitor",
+    "DevicePool",
+    "MetricsServer",
     "OPCGPIOlib",
+    "PinHistory",
     "Timer",
 ]
@@ -1,27 +1,263 @@
 from . import connection_organiser_with_opc as conorg
+from . import wire_protocol
+from .wire_protocol import BOARD_IO_PINS, DEFAULT_IO_PINS, board_io_pins
+from .pin_history import PinHistory
+from array import array
 import os
+import queue
+import threading
 import time
 
 
 # TODO remove self.use_update, no manual retrieve
 
+EDGES = ("both", "rising", "falling")
+
+
+def pin_image(io_pins: int) -> array:
+    """
+    Zeroed pin state image, one int per pin
+    :type io_pins: int
+    :rtype: array
+    """
+    return array("i", bytes(array("i").itemsize * io_pins))
+
+
+def read_io_config(configure_io_file_path: str, debug: bool = False):
+    """
+    Yield (use, pin_num, name, report) for every ">" line of an IO config file (sys_files/GPIO_Lib/<name>.data).\n
+    report is the optional 4th column "deadband[:interval_ms]" of inputs, else None.\n
+    Invalid lines are reported and yield (None, None, None, None).
+    :type configure_io_file_path: str
+    :type debug: bool
+    """
+    with open(configure_io_file_path) as configure_io_file:
+        configure_io_line = configure_io_file.readline().strip("\n")
+        while configure_io_line:
+            if debug:
+                print(f'Config Line: {configure_io_line}')
+            if configure_io_line.startswith(">"):
+                configure_io_line = configure_io_line.replace(">", "")
+                try:
+                    use, pin_num, name, *report = configure_io_line.split(" ")
+                    report, = report or [None]
+                    if debug:
+                        print(f'USE: {use}, PIN_NUM: {pin_num}, NAME: {name}, REPORT: {report}')
+                except ValueError:
+                    use = None
+                    pin_num = None
+                    name = None
+                    report = None
+                    print(f'[GPIO_Lib] INVALID Line: "{configure_io_line}"')
+                yield use, pin_num, name, report
+            configure_io_line = configure_io_file.readline().strip("\n")
+
+
+def report_command(pin: int | str, deadband: int = -1, interval: int = -1) -> str:
+    """
+    M7 command: inputs are only reported when an analog value moves more than deadband
+    and at most once per interval ms, -1 keeps the current setting
+    :type pin: int | str
+    :type deadband: int
+    :type interval: int
+    :rtype: str
+    """
+    return f'M7 N{pin} D{int(deadband)} T{int(interval)}'
+
+
+def io_config_commands(use: str, pin_num: str, name: str, report: str = None) -> list:
+    """
+    Firmware commands to configure one line of the IO config file.\n
+    report "deadband[:interval_ms]" of inputs adds an M7 command.
+    :type use: str
+    :type pin_num: str
+    :type name: str
+    :type report: str
+    :rtype: list
+    """
+    # Send pin configuration
+    # M1 input_digital
+    # M2 output, output_analog
+    # M3 input_pullup
+    # M4 input_analog
+    # M5 servo
+    # M6 LCD NOT USED WIP
+    # M7 report deadband/interval of an input
+
+    if use in ("input_digital", "input_pullup", "input_analog") and report:
+        try:
+            deadband, _, interval = report.partition(":")
+            report_commands = [report_command(pin_num, deadband or -1, interval or -1)]
+        except ValueError:
+            print(f'[GPIO_Lib] INVALID Line: "{use} {pin_num} {name} {report}"')
+            report_commands = []
+    else:
+        report_commands = []
+
+    if use == "input_digital":
+        return [f'M1 N{pin_num}'] + report_commands
+    elif use in ("output", "output_analog"):
+        return [f'M2 N{pin_num}']
+    elif use == "input_pullup":
+        return [f'M3 N{pin_num}'] + report_commands
+    elif use == "input_analog":
+        return [f'M4 N{pin_num}'] + report_commands
+    elif use == "servo":
+        return [f'M5 N{pin_num} A{name}']
+    elif use == "lcd":
+        try:
+            w, h = pin_num.split(":")
+            return [f'M6 W{w} H{h}']
+        except ValueError:
+            print(f'[GPIO_Lib] INVALID Line: "{use} {pin_num} {name}"')
+    return []
+
+
+def parse_input(update_input: (str, tuple)) -> (tuple, None):
+    """
+    Decode an input report of the firmware.\n
+    Text "d:{pin}:{val}" / "a:{pin}:{val}" or binary protocol (kind, pin, value).\n
+    Returns (kind, pin, value), None for every other line.
+    Raises ValueError on broken reports.
+    :rtype: tuple
+    """
+    if isinstance(update_input, tuple):
+        return update_input
+    if update_input.startswith("d:") or update_input.startswith("a:"):
+        kind, pin, val = update_input.split(":")
+        return kind, int(pin), int(val)
+    return None
+
+
+def is_input_report(message: (str, tuple)) -> bool:
+    """
+    Cheap check for an input report without decoding it, see parse_input()
+    :rtype: bool
+    """
+    return isinstance(message, tuple) or message.startswith("d:") or message.startswith("a:")
+
+
+def digital_bank_commands(changes: dict, binary: bool = False) -> list:
+    """
+    Fewest commands to set {pin: 0/1}: one P7 (bitmask of a bank of 16 pins) per bank,
+    a plain P2 for a bank with a single pin.\n
+    P7 B<bank> K<mask> V<bits>: the mask is no M word, the firmware would run it as M command first.\n
+    Returns [(data_to_send, type_of_data), ...] for send().
+    :type changes: dict
+    :type binary: bool
+    :rtype: list
+    """
+    banks = {}
+    for pin, val in changes.items():
+        bank, bit = divmod(pin, 16)
+        mask, bits = banks.get(bank, (0, 0))
+        banks[bank] = mask | 1 << bit, bits | val << bit
+
+    commands = []
+    for bank, (mask, bits) in banks.items():
+        if mask & (mask - 1) == 0:
+            pin = bank * 16 + mask.bit_length() - 1
+            val = 1 if bits else 0
+            if binary:
+                commands.append((wire_protocol.encode(wire_protocol.OP_DIGITAL_WRITE, pin, val), "bin"))
+            else:
+                commands.append((f'P2 N{pin} V{val}', "str"))
+        elif binary:
+            commands.append((wire_protocol.encode(wire_protocol.OP_DIGITAL_WRITE_MANY, bank, mask | bits << 16), "bin"))
+        else:
+            commands.append((f'P7 B{bank} K{mask} V{bits}', "str"))
+    return commands
+
+
+def index_pin(gpio, use: str, pin_num: str, name: str):
+    """
+    Add one line of the IO config file to pin_index and pin_modes of gpio
+    """
+    try:
+        pin = int(pin_num)
+    except (TypeError, ValueError):
+        # lcd "W:H" and invalid lines have no pin
+        return
+    gpio.pin_index[name] = pin
+    gpio.pin_modes[pin] = use
+
+
+class PinHandle:
+    __slots__ = ("gpio", "pin", "mode", "digital_commands", "digital_frames", "analog_prefix")
+
+    def __init__(self, gpio: "GPIOlib", pin: int, mode: str = None):
+        """
+        Resolved pin of a GPIOlib, see GPIOlib.pin().\n
+        The digital commands are encoded for both protocols up front, analog writes only append the value.
+        :type pin: int
+        :type mode: str
+        """
+        attach = gpio.send_attach.encode()
+        self.gpio = gpio
+        self.pin = pin
+        self.mode = mode
+        self.digital_commands = tuple(f'P2 N{pin} V{val}'.encode() + attach for val in (0, 1))
+        self.digital_frames = tuple(wire_protocol.encode(wire_protocol.OP_DIGITAL_WRITE, pin, val) for val in (0, 1))
+        self.analog_prefix = f'P4 N{pin} V'.encode()
+
+    def __repr__(self):
+        return f'PinHandle(pin={self.pin}, mode={self.mode})'
+
+    def read(self) -> int:
+        """
+        Last reported value of the pin
+        :rtype: int
+        """
+        return self.gpio.input_array[self.pin]
+
+    def digital_read(self) -> bool:
+        return self.gpio.input_array[self.pin] != 0
+
+    def digital_write(self, val=False):
+        gpio = self.gpio
+        if gpio.configured:
+            val = 1 if val else 0
+            if gpio.output_array[self.pin] != val:
+                gpio.output_array[self.pin] = val
+                if gpio.binary_active:
+                    gpio.send(self.digital_frames[val], "bin")
+                else:
+                    gpio.send(self.digital_commands[val], "bin")
+
+    def analog_write(self, val: int):
+        gpio = self.gpio
+        if gpio.configured:
+            val = int(val)
+            if gpio.output_array[self.pin] != val:
+                gpio.output_array[self.pin] = val
+                if gpio.binary_active:
+                    gpio.send(wire_protocol.encode(wire_protocol.OP_ANALOG_WRITE, self.pin, val), "bin")
+                else:
+                    gpio.send(self.analog_prefix + str(val).encode() + gpio.send_attach.encode(), "bin")
+
 
 class GPIOlib(conorg.ConnectionOrganiser):
     def __init__(self, device_name, firmware=None, **kwargs):
         self.configured = False
         self.auto_io = False
+        # Dispatcher mode: input reports are applied by the receive worker as they arrive
+        self.input_dispatch = False
+        self.input_cond = threading.Condition()  # Notified on every input change and on disconnect
+        self.input_callbacks: dict = {}  # pin -> [(callback, edge), ...]
+        self.input_history: dict = {}  # pin -> PinHistory of every report
         self.pins = []
         self.names = []
+        self.pin_index: dict = {}  # name -> pin
+        self.pin_modes: dict = {}  # pin -> use of the IO config file
         self.reset_output_pins = []
-        self.input_array = []
-        self.output_array = []
+        # Pin state images, input_array[pin] is the last reported value, output_array[pin] the last written one
+        self.io_pins = board_io_pins(firmware, kwargs.get("io_pins"))
+        self.input_array = pin_image(self.io_pins)
+        self.output_array = pin_image(self.io_pins)
         self.name = device_name
         self.program_name_GPIOlib = "GPIO_Lib"
         self.configure_io_file_path = "sys_files/" + self.program_name_GPIOlib + "/" + self.name + ".data"
         super().__init__(device_name=device_name, firmware=firmware, **kwargs)
-        self.input_array = [[0, 0] for _ in range(0, 70)]
-        self.output_array = [[0, 0] for _ in range(0, 70)]
-        # print(len(self.input_array))
 
         self.configure_io()
 
@@ -43,6 +279,39 @@ class GPIOlib(conorg.ConnectionOrganiser):
         self.lcd_write("GPIO_Lib disconnect")
         self.configured = False
         super().disconnect()
+        # Wake up wait_for_input()
+        with self.input_cond:
+            self.input_cond.notify_all()
+
+    def connection_lost(self):
+        # configure_io() runs again on reconnect, output_array is kept for resync()
+        self.configured = False
+        with self.input_cond:
+            self.input_cond.notify_all()
+        super().connection_lost()
+
+    def resync(self):
+        """
+        Push the whole output image after a reconnect: output pins as bank bitmasks,
+        output_analog pins with P4, whatever value they hold
+        """
+        if not self.configured:
+            return
+        digital = {}
+        for pin, use in self.pin_modes.items():
+            val = self.output_array[pin]
+            if use == "output":
+                digital[pin] = 1 if val else 0
+            elif use != "output_analog":
+                continue
+            elif self.binary_active:
+                self.send(wire_protocol.encode(wire_protocol.OP_ANALOG_WRITE, pin, val), "bin")
+            else:
+                self.send(f'P4 N{pin} V{val}')
+        for data_to_send, type_of_data in digital_bank_commands(digital, self.binary_active):
+            self.send(data_to_send, type_of_data)
+        if self.debug:
+            self.trace(f'resync: {len(digital)} digital outputs [{self.name}]')
 
     def configure_io(self):
         if self.connected:
@@ -50,65 +319,31 @@ class GPIOlib(conorg.ConnectionOrganiser):
                 return
             self.pins.clear()
             self.names.clear()
+            self.pin_index.clear()
+            self.pin_modes.clear()
+            self.reset_output_pins.clear()
             self.lcd_clear()
             self.lcd_write("I/O Config...")
             self.send("")
             if os.path.isfile(self.configure_io_file_path):
-                with open(self.configure_io_file_path) as configure_io_file:
-                    configure_io_line = configure_io_file.readline().strip("\n")
-                    while configure_io_line:
-                        if self.debug:
-                            print(f'Config Line: {configure_io_line}')
-                        if configure_io_line.startswith(">"):
-                            configure_io_line = configure_io_line.replace(">", "")
-                            try:
-                                use, pin_num, name = configure_io_line.split(" ")
-                                if self.debug:
-                                    print(f'USE: {use}, PIN_NUM: {pin_num}, NAME: {name}')
-                            except ValueError:
-                                use = None
-                                pin_num = None
-                                name = None
-                                print(f'[{self.program_name_GPIOlib}] INVALID Line: "{configure_io_line}"')
-
-                            # Send pin configuration
-                            # M1 input_digital
-                            # M2 output
-                            # M3 input_pullup
-                            # M4 input_analog
-                            # M5 servo
-                            # M6 LCD NOT USED WIP
-
-                            if use == "input_digital":
-                                self.send(f'M1 N{pin_num}')
-                            elif use == "output":
-                                self.send(f'M2 N{pin_num}')
-                                self.reset_output_pins.append(name)
-                            elif use == "input_pullup":
-                                self.send(f'M3 N{pin_num}')
-                            elif use == "input_analog":
-                                self.send(f'M4 N{pin_num}')
-                            elif use == "servo":
-                                name = name.replace("Servo", "").replace("servo", "")
-                                self.send(f'M5 N{pin_num} A{name}')
-                            elif use == "lcd":
-                                try:
-                                    w, h = pin_num.split(":")
-                                    self.send(f'M6 W{w} H{h}')
-                                except:
-                                    print(f'[{self.program_name_GPIOlib}] INVALID Line: "{configure_io_line}"')
-
-                            self.pins.append(pin_num)
-                            self.names.append(name)
-                        configure_io_line = configure_io_file.readline().strip("\n")
-
-                    # clear buffer
-                    super().clear_send()
-                    self.lcd_clear()
-                    self.lcd_write("I/O Config done")
-                    self.configured = True
-                    if self.debug:
-                        print(f'Lists: {self.pins}, {self.names}')
+                for use, pin_num, name, report in read_io_config(self.configure_io_file_path, self.debug):
+                    if use == "servo":
+                        name = name.replace("Servo", "").replace("servo", "")
+                    for command in io_config_commands(use, pin_num, name, report):
+                        self.send(command)
+                    if use in ("output", "output_analog"):
+                        self.reset_output_pins.append(name)
+                    self.pins.append(pin_num)
+                    self.names.append(name)
+                    index_pin(self, use, pin_num, name)
+
+                # clear buffer
+                super().clear_send()
+                self.lcd_clear()
+                self.lcd_write("I/O Config done")
+                self.configured = True
+                if self.debug:
+                    self.trace(f'Lists: {self.pins}, {self.names}')
             # If no File -> Create one
             else:
                 print(f'[{self.program_name_GPIOlib}] Create system file: {self.configure_io_file_path}')
@@ -126,16 +361,26 @@ class GPIOlib(conorg.ConnectionOrganiser):
 
     # Used to call pin from name instead of number
     def get_pin_from_name(self, name: int | str) -> int:
-        pin = name
-        if type(name).__name__ == "str":
-            try:
-                pin = self.pins[self.names.index(name)]
-            except Exception as e:
-                print(
-                    f'Error GPIO Lib: Pin name [{name}] not defined\n'
-                    f'{e}'
-                )
-        return int(pin)
+        if type(name) is int:
+            return name
+        try:
+            return self.pin_index[name]
+        except KeyError as e:
+            print(
+                f'Error GPIO Lib: Pin name [{name}] not defined\n'
+                f'{e}'
+            )
+        return int(name)
+
+    def pin(self, name: int | str) -> "PinHandle":
+        """
+        Handle of a pin with the pin number and its commands resolved once,
+        for loops that read or write the same pin again and again
+        :type name: int | str
+        :rtype: PinHandle
+        """
+        pin = self.get_pin_from_name(name)
+        return PinHandle(self, pin, self.pin_modes.get(pin))
 
     # P1 digital_read
     # P2 digital_write
@@ -143,6 +388,7 @@ class GPIOlib(conorg.ConnectionOrganiser):
     # P4 analog_write
     # P5 servo_write
     # P6 LCD commands
+    # P7 digital_write_many (bank bitmask)
 
     def digital_read(self, pin: int | str) -> bool:
         if not pin:
@@ -151,7 +397,7 @@ class GPIOlib(conorg.ConnectionOrganiser):
         if self.configured:
             if pin:
                 pin = self.get_pin_from_name(pin)
-                if self.input_array[pin][1] == 0:
+                if self.input_array[pin] == 0:
                     return False
                 else:
                     return True
@@ -164,91 +410,305 @@ class GPIOlib(conorg.ConnectionOrganiser):
                 val = 0
             if pin:
                 pin = self.get_pin_from_name(pin)
-                if not self.output_array[int(pin)][1] == val:
-                    self.output_array[pin][1] = int(val)
-                    pin = self.get_pin_from_name(pin)
-                    self.send(f'P2 N{pin} V{val}')
+                if not self.output_array[pin] == val:
+                    self.output_array[pin] = int(val)
+                    if self.binary_active:
+                        self.send(wire_protocol.encode(wire_protocol.OP_DIGITAL_WRITE, pin, val), "bin")
+                    else:
+                        self.send(f'P2 N{pin} V{val}')
                     if self.debug:
-                        print(f'digital_write: Update pin {pin}')
-                        print(f'digital_write: P2 N{pin} V{val}')
+                        self.trace(f'digital_write: Update pin {pin}')
+                        self.trace(f'digital_write: P2 N{pin} V{val}')
+
+    def digital_write_many(self, values: dict):
+        """
+        Write many outputs at once {pin or name: value, ...}.\n
+        Changed pins go out as one bitmask command per bank of 16 pins.
+        :type values: dict
+        """
+        if self.configured:
+            changes = {}
+            for pin, val in values.items():
+                pin = self.get_pin_from_name(pin)
+                val = 1 if val else 0
+                if not self.output_array[pin] == val:
+                    self.output_array[pin] = val
+                    changes[pin] = val
+            for data_to_send, type_of_data in digital_bank_commands(changes, self.binary_active):
+                self.send(data_to_send, type_of_data)
+                if self.debug:
+                    self.trace(f'digital_write_many: {data_to_send}')
 
     def analog_read(self, pin) -> int:
         if self.configured:
             if pin:
                 pin = self.get_pin_from_name(pin)
-                return self.input_array[pin][1]
+                return self.input_array[pin]
 
     def analog_write(self, pin: int | str, val: int):
         if self.configured:
             if pin:
                 pin = self.get_pin_from_name(pin)
 
-                if not self.output_array[int(pin)][1] == val:
-                    self.output_array[pin][1] = int(val)
-                    pin = self.get_pin_from_name(pin)
-                    self.send(f'P4 N{pin} V{val}')
+                if not self.output_array[pin] == val:
+                    self.output_array[pin] = int(val)
+                    if self.binary_active:
+                        self.send(wire_protocol.encode(wire_protocol.OP_ANALOG_WRITE, pin, val), "bin")
+                    else:
+                        self.send(f'P4 N{pin} V{val}')
                     if self.debug:
-                        print(f'digital_write: Update pin {pin}')
-                        print(f'analog_write: P4 N{pin} V{val}')
+                        self.trace(f'digital_write: Update pin {pin}')
+                        self.trace(f'analog_write: P4 N{pin} V{val}')
 
     def servo_write(self, index, val):
         if self.configured:
-            self.send(f'P5 N{index} V{val}')
+            if self.binary_active:
+                self.send(wire_protocol.encode(wire_protocol.OP_SERVO_WRITE, index, val), "bin")
+            else:
+                self.send(f'P5 N{index} V{val}')
             if self.debug:
-                print(f'P5 N{index} V{val}')
+                self.trace(f'P5 N{index} V{val}')
+
+    def set_report(self, pin: int | str, deadband: int = -1, interval: int = -1):
+        """
+        Report by exception of an input: the firmware only reports analog changes bigger than deadband
+        and at most one report every interval ms. -1 keeps the current setting.
+        :type pin: int | str
+        :type deadband: int
+        :type interval: int
+        """
+        if self.connected:
+            command = report_command(self.get_pin_from_name(pin), deadband, interval)
+            self.send(command)
+            if self.debug:
+                self.trace(f'set_report: {command}')
 
     def lcd_write(self, val=" "):
         if self.connected:
             self.send(f'P6 A4')
             self.send(val)
             if self.debug:
-                print(f'lcd_write: P6 A4')
-                print(f'lcd_write: {val}')
+                self.trace(f'lcd_write: P6 A4')
+                self.trace(f'lcd_write: {val}')
 
     def lcd_set_cursor(self, x, y):
         if self.connected:
             self.send(f'P6 A2 X{x} Y{y}')
             if self.debug:
-                print(f'lcd_set_cursor: P6 A2 X{x} Y{y}')
+                self.trace(f'lcd_set_cursor: P6 A2 X{x} Y{y}')
 
     def lcd_clear(self):
         if self.connected:
             self.send(f'P6 A3')
             if self.debug:
-                print(f'lcd_clear: P6 A3')
+                self.trace(f'lcd_clear: P6 A3')
+
+    def handle_message(self, message: (str, tuple)):
+        """
+        With input_dispatch input reports are applied to input_array by the receive worker,
+        all other lines go to the receive_q. In polling mode input reports stay in the receive_q as they are,
+        the history gets them here with their receive time.
+        """
+        if not self.input_dispatch:
+            with self.input_cond:
+                # __enable_dispatch() switches under input_cond: a report is either queued before its drain
+                # or applied here after it, never left behind in the receive_q
+                if not self.input_dispatch:
+                    if self.input_history and is_input_report(message):
+                        self.__record_history(message, time.monotonic_ns())
+                    super().handle_message(message)
+                    return
+        if self.apply_input(message, time.monotonic_ns()):
+            return
+        super().handle_message(message)
+
+    def __record_history(self, update_input: (str, tuple), received_ns: int):
+        """
+        Private function.\n
+        Add a queued input report to the history of its pin, broken reports are counted by apply_input() later
+        """
+        try:
+            kind, pin, val = parse_input(update_input)
+        except (TypeError, ValueError):
+            return
+        pin_history = self.input_history.get(pin)
+        if pin_history is not None:
+            pin_history.append(received_ns, val)
+
+    def apply_input(self, update_input: (str, tuple), received_ns: int = None) -> bool:
+        """
+        Apply one input report to input_array and add it to the history with its receive time received_ns.\n
+        Without received_ns the report is already in the history (queued in polling mode).\n
+        Returns False if update_input is no input report.
+        :type received_ns: int
+        :rtype: bool
+        """
+        if self.debug:
+            self.trace(f'Update Input Line: {update_input}')
+        try:
+            report = parse_input(update_input)
+            if report:
+                kind, pin, val = report
+                with self.input_cond:
+                    old = self.input_array[pin]
+                    self.input_array[pin] = val
+                    if old != val:
+                        self.input_cond.notify_all()
+                if received_ns is not None and pin in self.input_history:
+                    self.input_history[pin].append(received_ns, val)
+                if self.debug:
+                    self.trace(f'{"Digital" if kind == "d" else "Analog"}: pin={pin}, val={val}')
+                if old != val and pin in self.input_callbacks:
+                    self.__fire_callbacks(pin, old, val)
+                return True
+        except Exception as e:
+            self.stats.count("parse_errors")
+            if self.debug:
+                self.trace(f'ERROR [{e}]: GPIO_Lib [update_input()]')
+            return True
+        return False
+
+    def __fire_callbacks(self, pin: int, old: int, val: int):
+        """
+        Private function.\n
+        Call every on_change() callback of pin that matches the edge
+        """
+        for callback, edge in self.input_callbacks.get(pin, ()):
+            if edge == "rising" and not (old == 0 and val != 0):
+                continue
+            if edge == "falling" and not (old != 0 and val == 0):
+                continue
+            try:
+                callback(pin, val)
+            except Exception as e:
+                print(f'ERROR [{e}]: GPIO_Lib on_change callback [{callback}, pin {pin}]')
+
+    def __enable_dispatch(self):
+        """
+        Private function.\n
+        Switch to input_dispatch, reports still waiting in the receive_q are applied first
+        """
+        with self.input_cond:
+            if self.input_dispatch:
+                return
+            self.input_dispatch = True
+            self.__apply_queued()
+
+    def on_change(self, pin: int | str, callback, edge: str = "both"):
+        """
+        Call callback(pin, value) from the receive worker when the input changes.\n
+        edge: "both" for every change, "rising" for 0 -> not 0, "falling" for not 0 -> 0.\n
+        Enables input_dispatch.
+        :type pin: int | str
+        :type edge: str
+        """
+        if edge not in EDGES:
+            raise ValueError(f'edge must be one of {EDGES}, not {edge!r}')
+        pin = self.get_pin_from_name(pin)
+        callbacks = self.input_callbacks.get(pin, [])
+        # Replace the list, the receive worker may be iterating the old one
+        self.input_callbacks[pin] = callbacks + [(callback, edge)]
+        self.__enable_dispatch()
+
+    def remove_on_change(self, pin: int | str, callback=None):
+        """
+        Remove callback (all callbacks if None) of pin
+        :type pin: int | str
+        """
+        pin = self.get_pin_from_name(pin)
+        callbacks = [entry for entry in self.input_callbacks.get(pin, []) if callback and entry[0] != callback]
+        if callbacks:
+            self.input_callbacks[pin] = callbacks
+        else:
+            self.input_callbacks.pop(pin, None)
+
+    def wait_for_input(self, pin: int | str, value: bool | int = True, timeout: float = None) -> bool:
+        """
+        Block until the input has value without polling.\n
+        bool values compare like digital_read(), int values like analog_read().\n
+        Returns False on timeout or disconnect. Enables input_dispatch.
+        :type pin: int | str
+        :type value: bool | int
+        :type timeout: float
+        :rtype: bool
+        """
+        pin = self.get_pin_from_name(pin)
+        self.__enable_dispatch()
+        if isinstance(value, bool):
+            def reached():
+                return (self.input_array[pin] != 0) == value
+        else:
+            def reached():
+                return self.input_array[pin] == value
+
+        with self.input_cond:
+            self.input_cond.wait_for(lambda: reached() or not self.connected, timeout)
+            return reached()
+
+    def enable_history(self, pin: int | str, size: int = 1024):
+        """
+        Keep the last size reports of pin with their time.monotonic_ns() receive time, see history().\n
+        The time is taken by the receive worker, also in polling mode (update_input()).
+        Reports that were already queued before enable_history() are not in the history.\n
+        Enabling it again resizes and clears the buffer.
+        :type pin: int | str
+        :type size: int
+        """
+        self.input_history[self.get_pin_from_name(pin)] = PinHistory(size)
+
+    def disable_history(self, pin: int | str):
+        self.input_history.pop(self.get_pin_from_name(pin), None)
+
+    def history(self, pin: int | str) -> tuple:
+        """
+        (times, values) of the reports of pin oldest first, empty before enable_history().\n
+        NumPy arrays if NumPy is installed (views without copy until the buffer wraps), else array.
+        :type pin: int | str
+        :rtype: tuple
+        """
+        pin_history = self.input_history.get(self.get_pin_from_name(pin))
+        if pin_history is None:
+            return PinHistory(1).samples()
+        return pin_history.samples()
+
+    def snapshot_inputs(self) -> array:
+        """
+        Copy of the whole input image (array of int, index == pin)
+        :rtype: array
+        """
+        return self.input_array[:]
+
+    def snapshot_outputs(self) -> array:
+        """
+        Copy of the whole output image (array of int, index == pin)
+        :rtype: array
+        """
+        return self.output_array[:]
 
     def update_input(self):
+        """
+        Polling mode: apply every input report received since the last call.\n
+        Not needed with input_dispatch, input_array is always current then.
+        """
         if not self.connected:
             self.configured = False
-        update_input = None
-        if self.receive_q.qsize() > 0:
-            update_input = self.receive_q.get()
-        # self.debug = True
-        if update_input:
-            if self.debug:
-                print(f'Update Input Line: {update_input}')
-            if update_input.startswith("d"):
-                try:
-                    pin, val = update_input.replace("d:", "").split(":")
-                    self.input_array[int(pin)][1] = int(val)
-                    if self.debug:
-                        print(f'Digital: pin={pin}, val={val}')
-                except Exception as e:
-                    if self.debug:
-                        print(f'ERROR [{e}]: GPIO_Lib [update_input()]')
-
-            if update_input.startswith("a"):
-                try:
-                    pin, val = update_input.replace("a:", "").split(":")
-                    self.input_array[int(pin)][1] = int(val)
-                    if self.debug:
-                        print(f'Analog: pin={pin}, val={val}')
-                except Exception as e:
-                    if self.debug:
-                        print(f'ERROR [{e}]: GPIO_Lib [update_input()]')
+        if self.input_dispatch:
+            return
+        self.__apply_queued()
+
+    def __apply_queued(self):
+        """
+        Private function.\n
+        Apply every input report waiting in the receive_q
+        """
+        while True:
+            try:
+                update_input = self.receive_q.get_nowait()
+            except queue.Empty:
+                break
+            if update_input:
+                self.apply_input(update_input)
             self.receive_q.task_done()
-
-        # self.debug = False
     #
 #
 #
@@ -295,14 +755,8 @@ if __name__ == "__main__":
     if test == 1:
         if temp.connected:
             temp.digital_write("P15", True)
-            while not temp.digital_read("S15") and temp.connected:
-                temp.update_input()
-                # temp1.analog_write("PWM", map_val(temp1.analog_read("analog"), 0, 1024, 0, 255))
-
-                if temp.digital_read("S0"):
-                    temp.digital_write("P0", True)
-                else:
-                    temp.digital_write("P0")
+            temp.on_change("S0", lambda pin, val: temp.digital_write("P0", val))
+            temp.wait_for_input("S15", True)
 
     if test == 2:
         if temp.connected:
@@ -342,12 +796,16 @@ if __name__ == "__main__":
             delay = .0
             test_list = temp.reset_output_pins
             for t in range(0, 10):
-                for i in test_list:
-                    temp.digital_write(i, True)
-                    time.sleep(delay)
-                for i in test_list:
-                    temp.digital_write(i, False)
-                    time.sleep(delay)
+                if delay:
+                    for i in test_list:
+                        temp.digital_write(i, True)
+                        time.sleep(delay)
+                    for i in test_list:
+                        temp.digital_write(i, False)
+                        time.sleep(delay)
+                else:
+                    temp.digital_write_many(dict.fromkeys(test_list, True))
+                    temp.digital_write_many(dict.fromkeys(test_list, False))
                 test_list.reverse()
 
     if test == 6:
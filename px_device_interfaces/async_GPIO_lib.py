@@ -0,0 +1,207 @@
+import asyncio
+import os
+import time
+
+from . import arduino_GPIO_lib
+from . import wire_protocol
+from .arduino_GPIO_lib import read_io_config, io_config_commands, parse_input, board_io_pins, pin_image, index_pin
+from .arduino_GPIO_lib import report_command, digital_bank_commands
+from .async_connection_organiser import AsyncConnectionOrganiser
+
+
+class GPIOlib(AsyncConnectionOrganiser):
+    def __init__(self, device_name: str, firmware: str = None, **kwargs):
+        """
+        asyncio version of arduino_GPIO_lib.GPIOlib.\n
+        Input reports are applied to input_array as soon as they arrive,
+        there is no update_input(). Use "async for kind, pin, value in gpio.inputs()" to follow them.
+
+        :type device_name: str
+        :type firmware: str
+        """
+        self.configured = False
+        self.pins = []
+        self.names = []
+        self.pin_index = {}
+        self.pin_modes = {}
+        self.reset_output_pins = []
+        self.io_pins = board_io_pins(firmware, kwargs.get("io_pins"))
+        self.input_array = pin_image(self.io_pins)
+        self.output_array = pin_image(self.io_pins)
+        self.input_listeners = []
+        self.input_history = {}
+        self.name = device_name
+        self.program_name_GPIOlib = "GPIO_Lib"
+        self.configure_io_file_path = "sys_files/" + self.program_name_GPIOlib + "/" + self.name + ".data"
+        super().__init__(device_name=device_name, firmware=firmware, **kwargs)
+
+    async def connect(self):
+        await super().connect()
+        await self.configure_io()
+
+    async def disconnect(self):
+        if self.connected:
+            await self.lcd_clear()
+            for reset_pin in self.reset_output_pins:
+                await self.digital_write(reset_pin)
+            await self.lcd_write("GPIO_Lib disconnect")
+        self.configured = False
+        await super().disconnect()
+        for listener in self.input_listeners:
+            listener.put_nowait(None)
+
+    async def configure_io(self):
+        if not self.connected:
+            print(f'ERROR: No {self.name} Connection')
+            return
+        if self.configured:
+            return
+        self.pins.clear()
+        self.names.clear()
+        self.pin_index.clear()
+        self.pin_modes.clear()
+        self.reset_output_pins.clear()
+        await self.lcd_clear()
+        await self.lcd_write("I/O Config...")
+        await self.send("")
+        if not os.path.isfile(self.configure_io_file_path):
+            print(f'[{self.program_name_GPIOlib}] Create system file: {self.configure_io_file_path}')
+            os.makedirs("sys_files/" + self.program_name_GPIOlib, exist_ok=True)
+            open(self.configure_io_file_path, "w").close()
+            return
+
+        for use, pin_num, name, report in read_io_config(self.configure_io_file_path, self.debug):
+            if use == "servo":
+                name = name.replace("Servo", "").replace("servo", "")
+            for command in io_config_commands(use, pin_num, name, report):
+                await self.send(command)
+            if use in ("output", "output_analog"):
+                self.reset_output_pins.append(name)
+            self.pins.append(pin_num)
+            self.names.append(name)
+            index_pin(self, use, pin_num, name)
+
+        await self.lcd_clear()
+        await self.lcd_write("I/O Config done")
+        self.configured = True
+        if self.debug:
+            self.trace(f'Lists: {self.pins}, {self.names}')
+
+    # Used to call pin from name instead of number
+    get_pin_from_name = arduino_GPIO_lib.GPIOlib.get_pin_from_name
+
+    def handle_message(self, message: (str, tuple)):
+        """
+        Apply input reports to input_array and hand them to every inputs() iterator,
+        all other lines go to the receive_q
+        """
+        try:
+            report = parse_input(message)
+        except ValueError as e:
+            self.stats.parse_errors += 1
+            if self.debug:
+                self.trace(f'ERROR [{e}]: GPIO_Lib [handle_message()]')
+            return
+        if report is None:
+            super().handle_message(message)
+            return
+        kind, pin, val = report
+        try:
+            self.input_array[pin] = val
+            if pin in self.input_history:
+                self.input_history[pin].append(time.monotonic_ns(), val)
+        except IndexError as e:
+            self.stats.parse_errors += 1
+            if self.debug:
+                self.trace(f'ERROR [{e}]: GPIO_Lib [handle_message()]')
+            return
+        for listener in self.input_listeners:
+            listener.put_nowait(report)
+
+    async def inputs(self):
+        """
+        Async iterate (kind, pin, value) of every input report until disconnect
+        """
+        listener = asyncio.Queue()
+        self.input_listeners.append(listener)
+        try:
+            while self.connected:
+                report = await listener.get()
+                if report is None:
+                    break
+                yield report
+        finally:
+            self.input_listeners.remove(listener)
+
+    enable_history = arduino_GPIO_lib.GPIOlib.enable_history
+    disable_history = arduino_GPIO_lib.GPIOlib.disable_history
+    history = arduino_GPIO_lib.GPIOlib.history
+    snapshot_inputs = arduino_GPIO_lib.GPIOlib.snapshot_inputs
+    snapshot_outputs = arduino_GPIO_lib.GPIOlib.snapshot_outputs
+
+    async def digital_read(self, pin: int | str) -> bool:
+        if self.configured and pin:
+            pin = self.get_pin_from_name(pin)
+            return not self.input_array[pin] == 0
+
+    async def digital_write(self, pin: int | str, val=False):
+        if self.configured and pin:
+            val = 1 if val else 0
+            pin = self.get_pin_from_name(pin)
+            if not self.output_array[pin] == val:
+                self.output_array[pin] = val
+                if self.binary_active:
+                    await self.send(wire_protocol.encode(wire_protocol.OP_DIGITAL_WRITE, pin, val), "bin")
+                else:
+                    await self.send(f'P2 N{pin} V{val}')
+
+    async def digital_write_many(self, values: dict):
+        if self.configured:
+            changes = {}
+            for pin, val in values.items():
+                pin = self.get_pin_from_name(pin)
+                val = 1 if val else 0
+                if not self.output_array[pin] == val:
+                    self.output_array[pin] = val
+                    changes[pin] = val
+            for data_to_send, type_of_data in digital_bank_commands(changes, self.binary_active):
+                await self.send(data_to_send, type_of_data)
+
+    async def analog_read(self, pin: int | str) -> int:
+        if self.configured and pin:
+            pin = self.get_pin_from_name(pin)
+            return self.input_array[pin]
+
+    async def analog_write(self, pin: int | str, val: int):
+        if self.configured and pin:
+            pin = self.get_pin_from_name(pin)
+            if not self.output_array[pin] == val:
+                self.output_array[pin] = int(val)
+                if self.binary_active:
+                    await self.send(wire_protocol.encode(wire_protocol.OP_ANALOG_WRITE, pin, val), "bin")
+                else:
+                    await self.send(f'P4 N{pin} V{val}')
+
+    async def servo_write(self, index: int, val: int):
+        if self.configured:
+            if self.binary_active:
+                await self.send(wire_protocol.encode(wire_protocol.OP_SERVO_WRITE, index, val), "bin")
+            else:
+                await self.send(f'P5 N{index} V{val}')
+
+    async def set_report(self, pin: int | str, deadband: int = -1, interval: int = -1):
+        if self.connected:
+            await self.send(report_command(self.get_pin_from_name(pin), deadband, interval))
+
+    async def lcd_write(self, val=" "):
+        if self.connected:
+            await self.send(f'P6 A4')
+            await self.send(val)
+
+    async def lcd_set_cursor(self, x, y):
+        if self.connected:
+            await self.send(f'P6 A2 X{x} Y{y}')
+
+    async def lcd_clear(self):
+        if self.connected:
+            await self.send(f'P6 A3')
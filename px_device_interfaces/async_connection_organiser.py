@@ -0,0 +1,691 @@
+import asyncio
+import collections
+import time
+import serial
+from opcua import ua
+
+from . import wire_protocol
+from .debug_monitor import DebugMonitor, TerminalViewer, TkViewer
+from .metrics import DeviceMetrics
+from . import port_discovery
+from . import simulator
+from .connection_organiser_with_opc import load_settings, save_settings
+from .opc_session import OPCSession
+
+
+class SerialStream:
+    def __init__(self, connection_usb: serial.Serial, poll_interval: float = 0.005):
+        """
+        Non-blocking asyncio adapter for an open pyserial port (timeout=0, write_timeout=0).\n
+        Offers read/write/drain/close like the asyncio streams used for Wi-Fi.\n
+        Waits for data with loop.add_reader where the port has a file descriptor (POSIX),
+        everywhere else (Windows) it polls every poll_interval.
+
+        :type connection_usb: serial.Serial
+        :type poll_interval: float
+        """
+        self.connection_usb = connection_usb
+        self.poll_interval = poll_interval
+        self.loop = asyncio.get_running_loop()
+        self.out_buffer = bytearray()
+        try:
+            self.fd = connection_usb.fileno()
+        except Exception:
+            self.fd = None
+
+    async def read(self, n: int) -> bytes:
+        """
+        Read up to n bytes, wait if nothing is available.\n
+        Returns b"" when the port is closed.
+        :type n: int
+        :rtype: bytes
+        """
+        while self.connection_usb.is_open:
+            data = self.connection_usb.read(n)
+            if data:
+                return data
+            await self.__wait_readable()
+        return b""
+
+    async def __wait_readable(self):
+        if self.fd is None:
+            await asyncio.sleep(self.poll_interval)
+            return
+        readable = self.loop.create_future()
+        self.loop.add_reader(self.fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            self.loop.remove_reader(self.fd)
+
+    def write(self, data: bytes):
+        self.out_buffer += data
+        self.__write_pending()
+
+    def __write_pending(self):
+        if self.out_buffer:
+            written = self.connection_usb.write(self.out_buffer) or 0
+            del self.out_buffer[:written]
+
+    async def drain(self):
+        while self.out_buffer and self.connection_usb.is_open:
+            await asyncio.sleep(self.poll_interval)
+            self.__write_pending()
+
+    def close(self):
+        self.connection_usb.close()
+
+
+class AsyncConnectionOrganiser:
+    def __init__(self, device_name: str, firmware: str = None, **kwargs):
+        """
+        asyncio version of ConnectionOrganiser.\n
+        Same settings files and protocol, but no threads: one event loop drives any number of devices.\n
+        USB runs through SerialStream, Wi-Fi through asyncio streams, OPC-UA calls run in the default executor.\n
+        connect() has to be awaited, there is no init_connect.
+
+        :type device_name: str          # Define the name of the device. Name of config files
+        :type firmware: str             # Define a firmware to ensure connecting the correct device
+        """
+        # region Variable declaration
+        self.name = device_name
+        self.program_name = "Connection_Organiser"
+        self.settings_file_path = "sys_files/" + self.program_name + "/" + self.name + ".data"
+        self.connected = False
+        self.firmware = firmware
+        self.firmware_timeout: float = 2
+        # Readiness probe after connect, see ConnectionOrganiser.wait_ready()
+        self.boot_time: float = 2.2
+        self.ready_timeout: float = 1
+        self.probe_interval: float = 0.05
+        self.ready_event: (asyncio.Event, None) = None
+        self.debug = False
+        # Debug output into the trace ring buffer of a DebugMonitor, see ConnectionOrganiser
+        self.debug_viewer = ""  # "" headless, "tk" or "terminal"
+        self.debug_interval: float = 0.1
+        self.debug_trace_size: int = 4096
+        self.debug_monitor: (DebugMonitor, None) = None
+        self.disable_dsrdtr = True
+        self.send_attach = "\n"
+        # Send window, see ConnectionOrganiser
+        self.send_window: int = 1
+        self.send_window_bytes: int = 60
+        self.ack_timeout: float = 10
+        # Wire protocol (text/binary)
+        self.protocol: str = "text"
+        self.protocol_timeout: float = 1
+        self.binary_active = False
+        self.receive_buffer_size: int = 4096
+
+        # type (USB/WIFI/OPC/SIM)
+        self.type: (str, None) = None
+        self.usb_port = ""
+        self.usb_baud = ""
+        self.wifi_host = ""
+        self.wifi_port = ""
+        # Simulated board, see ConnectionOrganiser
+        self.sim_firmware = ""
+        self.sim_io_pins = 0
+        self.sim_latency: float = 0
+        self.sim_jitter: float = 0
+        self.sim_baud: int = 0
+        self.sim_board: (simulator.SimulatedBoard, None) = None
+        self.opc_client_address = ""
+        self.connection_opc_client = None
+        self.opc_share_session = True
+        self.opc_session: (OPCSession, None) = None
+
+        self.stream_reader = None
+        self.stream_writer = None
+        self.receive_task = None
+        self.in_flight = collections.deque()  # (size, send time) of every command waiting for its ack
+        self.in_flight_bytes: int = 0
+        # Created in connect() inside the running event loop
+        self.send_window_cond: (asyncio.Condition, None) = None
+        self.receive_q: (asyncio.Queue, None) = None
+        self.frame_reader: (wire_protocol.FrameReader, None) = None
+        # Counters and latency histograms, see metrics()
+        self.stats = DeviceMetrics()
+        # endregion
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        load_settings(self)
+
+        if self.debug:
+            self.start_debug_monitor()
+
+    def save_settings(self):
+        """
+        Write the current connection settings to the settings file
+        """
+        save_settings(self)
+
+    async def discover_port(self, ports: list = None) -> (str, None):
+        """
+        Find the serial port of this device by its firmware, see ConnectionOrganiser.discover_port().\n
+        The probes run in the default executor, the event loop keeps running.
+        :type ports: list
+        :rtype: (str, None)
+        """
+        located = await asyncio.get_running_loop().run_in_executor(None, port_discovery.locate, [self], ports)
+        return located.get(self.name)
+
+    async def connect(self):
+        """
+        Connect a device based on the configuration.\n
+        Supported are USB, Wi-Fi, OPC-UA and SIM (simulated board)
+        """
+        if self.debug_monitor is not None:
+            self.debug_monitor.start()
+        self.send_window = max(1, int(self.send_window))
+        self.send_window_bytes = int(self.send_window_bytes)
+        self.ack_timeout = float(self.ack_timeout)
+        self.send_window_cond = asyncio.Condition()
+        self.ready_event = asyncio.Event()
+        # Fresh queue per connection, the None of the last disconnect() must not end this one
+        self.receive_q = asyncio.Queue()
+        self.in_flight.clear()
+        self.in_flight_bytes = 0
+        loop = asyncio.get_running_loop()
+
+        if self.type == "USB":
+            connection_usb = serial.Serial()
+            connection_usb.port = self.usb_port
+            connection_usb.baudrate = self.usb_baud
+            connection_usb.timeout = 0
+            connection_usb.write_timeout = 0
+            connection_usb.exclusive = True  # See ConnectionOrganiser
+
+            if self.disable_dsrdtr:
+                connection_usb.dsrdtr = None
+                connection_usb.setRTS(False)
+                connection_usb.setDTR(False)
+
+            try:
+                connection_usb.open()
+                self.stream_reader = self.stream_writer = SerialStream(connection_usb)
+                if self.debug:
+                    self.trace(f'Info: Connection [Type: {self.type}, Object:{connection_usb}] [{self.name}]')
+                self.connected = True
+            except Exception:
+                if self.debug:
+                    self.trace(f'ERROR: Connection Failed USB [{self.name}]')
+                self.connected = False
+        #
+        #
+        #
+        elif self.type == "WIFI":
+            try:
+                self.stream_reader, self.stream_writer = await asyncio.open_connection(
+                    self.wifi_host, int(self.wifi_port))
+                if self.debug:
+                    self.trace(f'Info: Connection [Type: {self.type}, Object:{self.stream_writer}] [{self.name}]')
+                self.connected = True
+            except Exception:
+                if self.debug:
+                    self.trace(f'ERROR: Connection Failed WiFi [{self.name}]')
+                self.connected = False
+        #
+        #
+        #
+        elif self.type == "SIM":
+            try:
+                connection_sim, self.sim_board = simulator.Simulator.shared().open(
+                    self.sim_firmware or self.firmware, int(self.sim_io_pins or 0) or None,
+                    float(self.sim_latency or 0), float(self.sim_jitter or 0), int(self.sim_baud or 0))
+                self.stream_reader, self.stream_writer = await asyncio.open_connection(sock=connection_sim)
+                if self.debug:
+                    self.trace(f'Info: Connection [Type: {self.type}, Object:{self.sim_board}] [{self.name}]')
+                self.connected = True
+            except Exception:
+                if self.debug:
+                    self.trace(f'ERROR: Connection Failed SIM [{self.name}]')
+                self.connected = False
+        #
+        #
+        #
+        elif self.type == "OPC":
+            try:
+                self.opc_session = await loop.run_in_executor(
+                    None, OPCSession.acquire, self.opc_client_address, self.opc_share_session)
+                self.connection_opc_client = self.opc_session.client
+                if self.debug:
+                    self.trace(f'Info: Connected to client: {self.opc_client_address} [{self.name}]')
+                self.connected = True
+            except Exception:
+                if self.debug:
+                    self.trace(f'ERROR: Connection Failed OPC-UA [{self.name}]')
+                self.connected = False
+        #
+        #
+        #
+        else:
+            if self.debug:
+                self.trace(f'ERROR: Connection Failed, no type Set [{self.name}]')
+            self.connected = False
+
+        if self.connected:
+            self.stats.connects += 1
+        if self.connected and self.type != "OPC":
+            self.receive_task = asyncio.ensure_future(self.__receive_worker())
+            if not await self.wait_ready():
+                await self.disconnect()
+                return
+            await self.check_firmware()
+            if self.connected and self.protocol == "binary":
+                await self.negotiate_protocol()
+
+    async def disconnect(self):
+        """
+        Disconnect a device
+        """
+        if self.debug_monitor is not None:
+            self.debug_monitor.close()
+        if not self.connected:
+            return
+        self.connected = False
+        self.binary_active = False
+        async with self.send_window_cond:
+            self.in_flight.clear()
+            self.in_flight_bytes = 0
+            self.send_window_cond.notify_all()
+        if self.receive_task and self.receive_task is not asyncio.current_task():
+            self.receive_task.cancel()
+        # Ends receive() and async iteration
+        self.receive_q.put_nowait(None)
+
+        if self.type == "USB" or self.type == "WIFI" or self.type == "SIM":
+            if self.debug:
+                self.trace(f'Info: Disconnect [Object:{self.stream_writer}] [{self.name}]')
+            try:
+                self.stream_writer.close()
+            except Exception:
+                if self.debug:
+                    self.trace(f'ERROR: Disconnect Failed [{self.name}]')
+        #
+        #
+        #
+        elif self.type == "OPC":
+            try:
+                if self.debug:
+                    self.trace(f'Info: Disconnect [Object:{self.connection_opc_client}] [{self.name}]')
+                opc_session, self.opc_session = self.opc_session, None
+                self.connection_opc_client = None
+                await asyncio.get_running_loop().run_in_executor(None, opc_session.release)
+            except Exception:
+                if self.debug:
+                    self.trace(f'ERROR: Disconnect Failed [{self.name}]')
+
+    def __encode(self, data_to_send: (str, bytes)) -> (bytes, None):
+        """
+        Private function.\n
+        Encode a str command or binary frame for USB and Wi-Fi
+        :rtype: bytes
+        """
+        if isinstance(data_to_send, bytes):
+            return data_to_send
+        if isinstance(data_to_send, str):
+            return (data_to_send.replace("\n", "") + self.send_attach).encode()
+        return None
+
+    async def send(self, data_to_send: (str, bytes, list), type_of_data: str = "str"):
+        """
+        Send data to the device.\n
+        Returns as soon as the command is written and a slot of the send window is taken,
+        await flush() to wait for the acks.\n\n
+        with OPC-UA:\n
+        data_to_send["node_id", (str, int, bytes, list)]
+
+        :type type_of_data: str
+        :param data_to_send: (str, bytes, list)
+        """
+        if not self.connected:
+            return
+        if self.type == "OPC":
+            await self.__opc_write(data_to_send, type_of_data)
+            return
+
+        payload = self.__encode(data_to_send)
+        if payload is None:
+            if self.debug:
+                self.trace(f'ERROR: Send param invalid: {data_to_send} [{self.name}]')
+            return
+        # Writing while holding the condition keeps the order of concurrent senders
+        async with self.send_window_cond:
+            await self.__wait_for_window(len(payload))
+            self.in_flight.append((len(payload), time.monotonic()))
+            self.in_flight_bytes += len(payload)
+            self.stats.commands_sent += 1
+            self.stats.bytes_out += len(payload)
+            if len(self.in_flight) > self.stats.in_flight_max:
+                self.stats.in_flight_max = len(self.in_flight)
+            if self.debug:
+                self.trace(f'Info: Send [{payload}] [{self.name}]')
+            self.stream_writer.write(payload)
+        try:
+            await self.stream_writer.drain()
+        except Exception as e:
+            print(f'ERROR [{e}]: Connection Organiser send() [{self.name}]')
+            self.stats.send_errors += 1
+            self.stats.connections_lost += 1
+            await self.disconnect()
+
+    async def __wait_for_window(self, size: int):
+        """
+        Private function, call with send_window_cond held.\n
+        Wait until a command of size bytes fits into the send window, lost acks leave after ack_timeout.
+        :type size: int
+        """
+        while self.connected and self.in_flight:
+            if (len(self.in_flight) < self.send_window and
+                    self.in_flight_bytes + size <= self.send_window_bytes):
+                return
+            if not await self.__wait_for_ack():
+                return
+
+    async def __wait_for_ack(self) -> bool:
+        """
+        Private function, call with send_window_cond held.\n
+        Wait for the next ack or drop the oldest command once its ack_timeout passed.
+        :rtype: bool
+        """
+        remaining = self.in_flight[0][1] + self.ack_timeout - time.monotonic()
+        if remaining <= 0:
+            lost_size, _ = self.in_flight.popleft()
+            self.in_flight_bytes -= lost_size
+            self.stats.ack_timeouts += 1
+            if self.debug:
+                self.trace(f'ERROR: Ack timeout, {len(self.in_flight)} still in flight [{self.name}]')
+            return True
+        try:
+            await asyncio.wait_for(self.send_window_cond.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+        return self.connected
+
+    async def __reset_window(self):
+        async with self.send_window_cond:
+            self.in_flight.clear()
+            self.in_flight_bytes = 0
+            self.send_window_cond.notify_all()
+
+    async def wait_ready(self) -> bool:
+        """
+        Wait until the firmware answers, see ConnectionOrganiser.wait_ready()
+        :rtype: bool
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        boot_time = float(self.boot_time) if self.type == "USB" and not self.disable_dsrdtr else 0.0
+        deadline = start + boot_time + float(self.ready_timeout)
+        while self.connected:
+            if loop.time() - start >= boot_time:
+                # A lost probe must not block the send window
+                await self.__reset_window()
+                await self.send("")
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.ready_event.wait(), min(float(self.probe_interval), remaining))
+            except asyncio.TimeoutError:
+                continue
+            # Let the ack of the last probe arrive before real commands use the window
+            await self.flush(float(self.probe_interval))
+            await self.__reset_window()
+            if self.debug:
+                self.trace(f'Info: Device ready after {loop.time() - start:.3f} s [{self.name}]')
+            return True
+        print(f'ERROR: Device not ready within {boot_time + float(self.ready_timeout)} s [{self.name}]')
+        return False
+
+    async def __acknowledge(self, count: int):
+        now = time.monotonic()
+        async with self.send_window_cond:
+            for _ in range(count):
+                # Acks without a command in flight (e.g. the startup ">") are ignored
+                if not self.in_flight:
+                    break
+                size, sent = self.in_flight.popleft()
+                self.in_flight_bytes -= size
+                self.stats.acks += 1
+                self.stats.ack_rtt.record(int((now - sent) * 1e9))
+            self.send_window_cond.notify_all()
+
+    async def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until every command sent so far is acknowledged by the device.\n
+        Returns False on timeout or lost connection.
+        :type timeout: float
+        :rtype: bool
+        """
+        async def drained():
+            async with self.send_window_cond:
+                while self.connected and self.in_flight:
+                    await self.__wait_for_ack()
+            return self.connected
+
+        try:
+            return await asyncio.wait_for(drained(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def __receive_worker(self):
+        """
+        Private function.\n
+        Task reading USB or Wi-Fi into a FrameReader, acks release the send window,
+        everything else goes to handle_message().
+        """
+        if self.frame_reader is not None:
+            self.stats.parse_errors += self.frame_reader.crc_errors + self.frame_reader.overflows
+        reader = self.frame_reader = wire_protocol.FrameReader(self.receive_buffer_size)
+        while self.connected:
+            try:
+                data = await self.stream_reader.read(len(reader.free()))
+                if not data:
+                    raise ConnectionError("Connection closed by device")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.debug:
+                    self.trace(f'ERROR [{e}]: Connection Organiser [receive()] [{self.name}]')
+                if self.connected:
+                    self.stats.connections_lost += 1
+                await self.disconnect()
+                break
+
+            reader.feed(data)
+            self.ready_event.set()
+            self.stats.bytes_in += len(data)
+            acks = 0
+            for frame in reader.frames():
+                message = wire_protocol.decode(frame, reader.binary)
+                if message == ">":
+                    acks += 1
+                    continue
+                if self.debug:
+                    self.trace(f'ADD to receive_q: {message} [{self.name}]')
+                self.stats.messages_in += 1
+                self.handle_message(message)
+            if acks:
+                await self.__acknowledge(acks)
+
+    def handle_message(self, message: (str, tuple)):
+        """
+        Called for every received line or binary report, puts it into the receive_q.\n
+        Subclasses can take messages out before.
+        :type message: (str, tuple)
+        """
+        self.receive_q.put_nowait(message)
+        self.stats.high_water("receive_q_max", self.receive_q.qsize())
+
+    def metrics(self) -> dict:
+        """
+        Runtime metrics of this device, see ConnectionOrganiser.metrics().\n
+        send_q is always 0, commands are written by send() directly.
+        :rtype: dict
+        """
+        metrics = self.stats.snapshot()
+        if self.frame_reader is not None:
+            metrics["parse_errors"] += self.frame_reader.crc_errors + self.frame_reader.overflows
+        metrics["name"] = self.name
+        metrics["type"] = self.type
+        metrics["connected"] = self.connected
+        metrics["send_q"] = 0
+        metrics["receive_q"] = self.receive_q.qsize() if self.receive_q is not None else 0
+        metrics["in_flight"] = len(self.in_flight)
+        return metrics
+
+    def start_debug_monitor(self, viewer: str = None) -> DebugMonitor:
+        """
+        Start the DebugMonitor of this device, see ConnectionOrganiser.start_debug_monitor().\n
+        It samples from its own thread and never touches the event loop.
+        :type viewer: str
+        :rtype: DebugMonitor
+        """
+        if self.debug_monitor is None:
+            self.debug_monitor = DebugMonitor(self, self.debug_interval, self.debug_trace_size)
+        self.debug = True
+        viewer = self.debug_viewer if viewer is None else viewer
+        if viewer == "tk":
+            TkViewer(self.debug_monitor)
+        elif viewer == "terminal":
+            TerminalViewer(self.debug_monitor)
+        return self.debug_monitor
+
+    def stop_debug_monitor(self):
+        """
+        Drop the DebugMonitor, disconnect() only pauses its sampler
+        """
+        if self.debug_monitor is not None:
+            self.debug_monitor.close()
+            self.debug_monitor = None
+
+    def trace(self, message: str):
+        """
+        Debug output: into the trace of the DebugMonitor, printed without one
+        :type message: str
+        """
+        monitor = self.debug_monitor
+        if monitor is None:
+            print(message)
+        else:
+            monitor.trace(message)
+
+    async def receive(self) -> (str, tuple, None):
+        """
+        Next message from the device, None once disconnected
+        :rtype: (str, tuple, None)
+        """
+        if not self.connected and self.receive_q.empty():
+            return None
+        return await self.receive_q.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> (str, tuple):
+        message = await self.receive()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def __receive_line(self, timeout: float) -> (str, tuple, None):
+        try:
+            return await asyncio.wait_for(self.receive_q.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def check_firmware(self):
+        """
+        If firmware is defined ask the device for it (M100) and disconnect on a wrong or missing answer
+        """
+        if not self.firmware:
+            return
+        await self.send("M100")
+        deadline = time.monotonic() + float(self.firmware_timeout)
+        while self.connected:
+            get_firmware = await self.__receive_line(deadline - time.monotonic())
+            if get_firmware is None:
+                break
+            if get_firmware == self.firmware:
+                if self.debug:
+                    self.trace(f'Info: Connection [Firmware: {get_firmware}]')
+                    self.trace(f'Settings: Connected [{self.name}]')
+                return
+            if self.debug:
+                self.trace(f'ERROR: Connection Firmware is: {get_firmware}, but need to be: {self.firmware}')
+        if self.debug:
+            self.trace(f'ERROR: Connection Firmware could not retrieved')
+        await self.disconnect()
+
+    async def negotiate_protocol(self) -> bool:
+        """
+        Switch the device to the binary wire protocol with "M110 S1",
+        stays on text commands without "bin:1" answer
+        :rtype: bool
+        """
+        self.binary_active = False
+        await self.send("M110 S1")
+        deadline = time.monotonic() + float(self.protocol_timeout)
+        skipped = []
+        while self.connected:
+            line = await self.__receive_line(deadline - time.monotonic())
+            if line is None:
+                break
+            if line == "bin:1":
+                self.binary_active = True
+                break
+            skipped.append(line)
+        for line in skipped:
+            self.receive_q.put_nowait(line)
+        if self.debug:
+            self.trace(f'Info: Protocol [{"binary" if self.binary_active else "text"}] [{self.name}]')
+        return self.binary_active
+
+    async def __opc_write(self, data_to_send: list, type_of_data: str):
+        try:
+            node_id, value = data_to_send[0], data_to_send[1]
+        except Exception:
+            if self.debug:
+                self.trace(f'ERROR: Send param invalid: node_id [{self.name}]')
+            return
+
+        # TODO Add missing data types
+        if type_of_data != "byte":
+            if self.debug:
+                self.trace(f'ERROR: Send param invalid: type_of_data [{self.name}]')
+            return
+
+        client_node_dv = ua.DataValue(ua.Variant(value, ua.VariantType.Byte))
+        try:
+            client_node = self.connection_opc_client.get_node(node_id)
+            self.stats.opc_calls += 1
+            with self.stats.timer.section("opc_write"):
+                await asyncio.get_running_loop().run_in_executor(None, client_node.set_value, client_node_dv)
+        except Exception as e:
+            print(f'ERROR [{e}]: Connection Organiser send() [{self.name}]')
+            self.stats.opc_errors += 1
+            await self.disconnect()
+
+    async def request_from_device(self, node_id: str):
+        """
+        OPC function to read a Node
+        :type node_id: str
+        """
+        if not self.connected or self.type != "OPC":
+            return
+        try:
+            client_node = self.connection_opc_client.get_node(node_id)
+            self.stats.opc_calls += 1
+            with self.stats.timer.section("opc_read"):
+                client_node_value = await asyncio.get_running_loop().run_in_executor(None, client_node.get_value)
+            if self.debug:
+                self.trace(f'Value of Node [{client_node}]: {client_node_value}')
+            return client_node_value
+        except Exception as e:
+            print(f'ERROR [{e}]: Connection Organiser request_from_device() [{self.name}, {node_id}]')
+            self.stats.opc_errors += 1
+            await self.disconnect()
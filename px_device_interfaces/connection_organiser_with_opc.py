@@ -1,4 +1,5 @@
 import tkinter as tk
+import collections
 import os
 import socket
 import time
@@ -8,6 +9,111 @@ import serial
 import opcua
 from opcua import ua
 
+from . import port_discovery
+from .debug_monitor import DebugMonitor, TerminalViewer, TkViewer
+from .metrics import DeviceMetrics
+from . import simulator
+from . import wire_protocol
+from .opc_session import OPCSession
+
+
+# type_of_data of send() -> VariantType for OPC-UA, "auto" uses the DataType of the node
+OPC_VARIANT_TYPES = {
+    "bool": ua.VariantType.Boolean,
+    "byte": ua.VariantType.Byte,
+    "sbyte": ua.VariantType.SByte,
+    "int16": ua.VariantType.Int16,
+    "uint16": ua.VariantType.UInt16,
+    "int": ua.VariantType.Int32,
+    "int32": ua.VariantType.Int32,
+    "uint32": ua.VariantType.UInt32,
+    "int64": ua.VariantType.Int64,
+    "float": ua.VariantType.Float,
+    "double": ua.VariantType.Double,
+    "string": ua.VariantType.String,
+}
+
+
+def parse_bool(value: (str, bool, int)) -> bool:
+    """
+    Boolean setting from the settings file: 1/0/true/false (any case), bools and ints pass through.\n
+    Raises ValueError for everything else.
+    :rtype: bool
+    """
+    if isinstance(value, (bool, int)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in ("1", "true"):
+        return True
+    if text in ("0", "false"):
+        return False
+    raise ValueError(f'not a boolean: {value!r}')
+
+
+def load_settings(obj):
+    """
+    Read the settings file (sys_files/Connection_Organiser/<name>.data) into the attributes of obj.\n
+    Settings whose attribute is a bool (auto_reconnect, opc_share_session, ...) are parsed with parse_bool().\n
+    Creates a default file if there is none.\n
+    Shared by ConnectionOrganiser and AsyncConnectionOrganiser.
+    """
+    if os.path.isfile(obj.settings_file_path):
+        print(os.path.abspath(obj.settings_file_path))
+        with open(obj.settings_file_path) as settings_file:
+            settings_line = settings_file.readline().strip("\n")
+            while settings_line:
+                key, value = settings_line.split(":", 1)
+                if obj.debug:
+                    print(f'INFO: Settings [key:{key}, value:{value}] [{obj.name}]')
+                if isinstance(getattr(obj, key, None), bool):
+                    try:
+                        value = parse_bool(value)
+                    except ValueError as e:
+                        print(f'ERROR [{e}]: Settings [key:{key}] kept {getattr(obj, key)} [{obj.name}]')
+                        value = getattr(obj, key)
+                setattr(obj, key, value)
+                settings_line = settings_file.readline().strip("\n")
+    else:
+        print(f'[{obj.program_name}] Create system file: {obj.settings_file_path} [{obj.name}]')
+        try:
+            os.makedirs("sys_files/" + obj.program_name)
+        except:
+            pass
+        with open(obj.settings_file_path, "w") as file:
+            file.write(
+                f'type:N/A\n'
+                f'usb_port:COM3\n'
+                f'usb_baud:115200\n'
+                f'wifi_host:0.0.0.0\n'
+                f'wifi_port:0000\n'
+                f'opc_client_address:N/A'
+                )
+        # self.open_config_window()
+
+
+# Written by save_settings(), every other line of the settings file is kept
+CONNECTION_SETTINGS = ("type", "usb_port", "usb_baud", "wifi_host", "wifi_port", "opc_client_address")
+
+
+def save_settings(obj):
+    """
+    Write the connection attributes of obj to its settings file, the counterpart of load_settings().\n
+    Only the CONNECTION_SETTINGS lines are updated, all other settings in the file stay as they are.
+    """
+    lines = []
+    if os.path.isfile(obj.settings_file_path):
+        with open(obj.settings_file_path) as settings_file:
+            lines = settings_file.read().splitlines()
+    values = {key: f'{key}:{getattr(obj, key)}' for key in CONNECTION_SETTINGS}
+    for index, line in enumerate(lines):
+        key = line.split(":", 1)[0]
+        if key in values:
+            lines[index] = values.pop(key)
+    lines += values.values()
+    os.makedirs(os.path.dirname(obj.settings_file_path), exist_ok=True)
+    with open(obj.settings_file_path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
 
 class ConnectionOrganiser:
     def __init__(self, device_name: str, firmware: str = None, init_connect: bool = False, **kwargs):
@@ -30,14 +136,51 @@ class ConnectionOrganiser:
         self.connected = False
         self.firmware = firmware
         self.debug = False
+        # debug=True starts a DebugMonitor: debug output goes into its trace ring buffer instead of stdout.
+        # debug_viewer: "" headless, "tk" window, "terminal" prints the trace to stderr
+        self.debug_viewer = ""
+        self.debug_interval: float = 0.1  # s between samples of workers and queues
+        self.debug_trace_size: int = 4096
+        self.debug_monitor: (DebugMonitor, None) = None
         self.disable_dsrdtr = True
         self.send_worker_phase: int = 0
         self.rec_worker_phase: int = 0
         self.send_attach = "\n"
+        # Send window: commands (and bytes) allowed on the wire before their ">" ack came back.
+        # send_window = 1 is stop and wait, raise it for throughput. Order of commands is always kept.
+        self.send_window: int = 1
+        self.send_window_bytes: int = 60  # Serial RX buffer of the firmware is 64 bytes
+        self.ack_timeout: float = 10
+        # Readiness probe after connect, see wait_ready()
+        self.boot_time: float = 2.2  # Max startup time of a board that resets on connect (USB with DTR)
+        self.ready_timeout: float = 1
+        self.probe_interval: float = 0.05
+        self.firmware_timeout: float = 2
+        self.ready_event = threading.Event()  # Set by the first data received on a connection
+        # Batching: queued commands are packed into one write of at most send_batch_bytes.
+        # send_batch_delay (s) waits for more commands before writing, 0 only takes what is queued.
+        self.send_batch_bytes: int = 60
+        self.send_batch_delay: float = 0
+        # Wire protocol (text/binary), binary is negotiated on connect and falls back to text
+        self.protocol: str = "text"
+        self.protocol_timeout: float = 1
+        self.binary_active = False
+        self.receive_buffer_size: int = 4096
+        self.frame_reader: (wire_protocol.FrameReader, None) = None
+        # DevicePool that runs the send and receive of this device, None: own threads
+        self.pool = None
+        # Reconnect with exponential backoff (reconnect_delay doubled up to reconnect_max_delay) on a lost connection
+        self.auto_reconnect = False
+        self.reconnect_delay: float = 0.1
+        self.reconnect_max_delay: float = 10
+        self.reconnecting = False
+        self.reconnect_thread: (threading.Thread, None) = None
+        self.connection_count: int = 0  # Incremented by every connect(), workers of older connections stop
+        self.send_carry: (list, None) = None  # Request taken from send_q that did not fit into the last batch
         #
 
         # type (USB/WIFI/Bluetooth/OPC)
-        self.type: (str, None) = None  # USB/WIFI/BLUETOOTH/OPC
+        self.type: (str, None) = None  # USB/WIFI/BLUETOOTH/OPC/SIM
         # USB Var
         self.usb_port = ""
         self.usb_baud = ""
@@ -51,16 +194,37 @@ class ConnectionOrganiser:
         #
         #
 
+        # SIM Var: simulated board in the shared simulator.Simulator, no hardware needed
+        self.sim_firmware = ""  # "" answers M100 with firmware
+        self.sim_io_pins = 0  # 0: pin count of the firmware
+        self.sim_latency: float = 0  # s added to every reply
+        self.sim_jitter: float = 0  # s, random 0..sim_jitter on top of sim_latency
+        self.sim_baud: int = 0  # Line speed to emulate, 0 is unlimited
+        self.connection_sim: (socket.socket, None) = None
+        self.sim_board: (simulator.SimulatedBoard, None) = None
+
         # OPC Var
         #
         #
         self.opc_client_address = ""
         self.connection_opc_client = None
+        # Share one session with every device of the same opc_client_address
+        self.opc_share_session = True
+        self.opc_session: (OPCSession, None) = None
+        self.opc_register_nodes = True  # Use the RegisterNodes service for the cached nodes
+        # Node cache of the session, see OPCSession
+        self.opc_nodes: dict = {}  # node_id -> registered Node
+        self.opc_variant_types: dict = {}  # node_id -> VariantType of its DataType
+        self.opc_nodes_lock = threading.Lock()
         self.send_q = queue.Queue()
-        self.event_send_block = threading.Event()
+        self.send_window_cond = threading.Condition()
+        self.in_flight = collections.deque()  # (size, send time) of every command waiting for its ack
+        self.in_flight_bytes: int = 0
 
         #
         self.receive_q = queue.Queue()
+        # Counters and latency histograms, see metrics()
+        self.stats = DeviceMetrics()
 
         #
         # endregion
@@ -73,36 +237,11 @@ class ConnectionOrganiser:
 
         self.do_save = False
         # get settings file with name, read it and connect to device
-        if os.path.isfile(self.settings_file_path):
-            print(os.path.abspath(self.settings_file_path))
-            with open(self.settings_file_path) as settings_file:
-                settings_line = settings_file.readline().strip("\n")
-                while settings_line:
-                    key, value = settings_line.split(":", 1)
-                    if self.debug:
-                        print(f'INFO: Settings [key:{key}, value:{value}] [{self.name}]')
-                    setattr(self, key, value)
-                    settings_line = settings_file.readline().strip("\n")
-        else:
-            print(f'[{self.program_name}] Create system file: {self.settings_file_path} [{self.name}]')
-            try:
-                os.makedirs("sys_files/" + self.program_name)
-            except:
-                pass
-            with open(self.settings_file_path, "w") as file:
-                file.write(
-                    f'type:N/A\n'
-                    f'usb_port:COM3\n'
-                    f'usb_baud:115200\n'
-                    f'wifi_host:0.0.0.0\n'
-                    f'wifi_port:0000\n'
-                    f'opc_client_address:N/A'
-                    )
-            # self.open_config_window()
+        load_settings(self)
 
         #
         if self.debug:
-            Debug(self)
+            self.start_debug_monitor()
 
         # init connection
         if init_connect:
@@ -132,17 +271,40 @@ class ConnectionOrganiser:
         #
         #
 
+    def save_settings(self):
+        """
+        Write the current connection settings to the settings file
+        """
+        save_settings(self)
+
+    def discover_port(self, ports: list = None) -> (str, None):
+        """
+        Find the serial port of this device by its firmware and store it in the settings file.\n
+        All ports are probed in parallel, see port_discovery.locate(). Use port_discovery.locate(devices)
+        to find a whole rack of boards with one scan.
+        :type ports: list
+        :rtype: (str, None)
+        """
+        return port_discovery.locate([self], ports).get(self.name)
+
     def connect(self):
         """
         Connect a device based on the configuration.\n
-        currently supported is USB, Wi-Fi, OPC-UA
+        currently supported is USB, Wi-Fi, OPC-UA and SIM (simulated board)
         Under development Bluetooth
         """
+        if self.debug_monitor is not None:
+            self.debug_monitor.start()
         while self.send_q.qsize() > 0:
             print(f'CON: Q_SEND = {self.send_q.qsize()} [{self.name}]')
             self.send_q.get()
             self.send_q.task_done()
-        self.event_send_block.set()
+        self.send_window = max(1, int(self.send_window))
+        self.send_window_bytes = int(self.send_window_bytes)
+        self.ack_timeout = float(self.ack_timeout)
+        self.send_batch_bytes = int(self.send_batch_bytes)
+        self.send_batch_delay = float(self.send_batch_delay)
+        self.__reset_window()
 
         #
         #
@@ -153,6 +315,8 @@ class ConnectionOrganiser:
             self.connection_usb.port = self.usb_port
             self.connection_usb.baudrate = self.usb_baud
             self.connection_usb.timeout = 1
+            # Locked (POSIX), port_discovery does not probe a port in use
+            self.connection_usb.exclusive = True
 
             if self.disable_dsrdtr:
                 self.connection_usb.dsrdtr = None
@@ -162,13 +326,12 @@ class ConnectionOrganiser:
             try:
                 self.connection_usb.open()
                 if self.debug:
-                    print(f'Info: Connection [Type: {self.type}, Object:{self.connection_usb}] [{self.name}]')
+                    self.trace(f'Info: Connection [Type: {self.type}, Object:{self.connection_usb}] [{self.name}]')
                 self.connected = True
             except:
                 if self.debug:
-                    print(f'ERROR: Connection Failed USB [{self.name}]')
+                    self.trace(f'ERROR: Connection Failed USB [{self.name}]')
                 self.connected = False
-            time.sleep(2.2)
         #
         #
         #
@@ -178,13 +341,12 @@ class ConnectionOrganiser:
                 self.connection_wifi.connect((self.wifi_host, int(self.wifi_port)))
                 # self.connection_wifi.setblocking(False)
                 if self.debug:
-                    print(f'Info: Connection [Type: {self.type}, Object:{self.connection_wifi}] [{self.name}]')
+                    self.trace(f'Info: Connection [Type: {self.type}, Object:{self.connection_wifi}] [{self.name}]')
                 self.connected = True
             except:
                 if self.debug:
-                    print(f'ERROR: Connection Failed WiFi [{self.name}]')
+                    self.trace(f'ERROR: Connection Failed WiFi [{self.name}]')
                 self.connected = False
-            time.sleep(1)
         #
         #
         #
@@ -196,69 +358,131 @@ class ConnectionOrganiser:
         #
         #
         #
+        elif self.type == "SIM":
+            try:
+                self.connection_sim, self.sim_board = simulator.Simulator.shared().open(
+                    self.sim_firmware or self.firmware, int(self.sim_io_pins or 0) or None,
+                    float(self.sim_latency or 0), float(self.sim_jitter or 0), int(self.sim_baud or 0))
+                if self.debug:
+                    self.trace(f'Info: Connection [Type: {self.type}, Object:{self.sim_board}] [{self.name}]')
+                self.connected = True
+            except:
+                if self.debug:
+                    self.trace(f'ERROR: Connection Failed SIM [{self.name}]')
+                self.connected = False
+        #
+        #
+        #
         elif self.type == "OPC":
-            if not self.connection_opc_client:
-                self.connection_opc_client = opcua.Client(self.opc_client_address)
             try:
-                self.connection_opc_client.session_timeout = 30000
-                self.connection_opc_client.connect()
+                self.opc_session = OPCSession.acquire(self.opc_client_address, self.opc_share_session)
+                self.connection_opc_client = self.opc_session.client
+                # Registered handles are only valid in their session
+                self.opc_nodes = self.opc_session.nodes
+                self.opc_variant_types = self.opc_session.variant_types
+                self.opc_nodes_lock = self.opc_session.lock
                 if self.debug:
-                    print(f'Info: Connection [Type: {self.type}, Object:{self.connection_opc_client}] [{self.name}]')
-                    print(f'Info: Connected to client: {self.opc_client_address} [{self.name}]')
-                    print(f'Info: Object root node: {self.connection_opc_client.get_root_node()} [{self.name}]')
+                    self.trace(f'Info: {self.opc_session} [{self.name}]')
+                    self.trace(f'Info: Connection [Type: {self.type}, Object:{self.connection_opc_client}] [{self.name}]')
+                    self.trace(f'Info: Connected to client: {self.opc_client_address} [{self.name}]')
+                    self.trace(f'Info: Object root node: {self.connection_opc_client.get_root_node()} [{self.name}]')
                 self.connected = True
             except:
                 if self.debug:
-                    print(f'ERROR: Connection Failed OPC-UA [{self.name}]')
+                    self.trace(f'ERROR: Connection Failed OPC-UA [{self.name}]')
                 self.connected = False
         #
         #
         #
         else:
             if self.debug:
-                print(f'ERROR: Connection Failed, no type Set [{self.name}]')
+                self.trace(f'ERROR: Connection Failed, no type Set [{self.name}]')
             self.connected = False
 
         if self.connected:
-            self.send_thread = threading.Thread(target=self.__send_worker, daemon=True)
-            self.send_thread.start()
+            self.connection_count += 1
+            self.stats.count("connects")
+            if self.frame_reader is not None:
+                self.stats.count("parse_errors", self.frame_reader.crc_errors + self.frame_reader.overflows)
+            self.ready_event.clear()
+            self.send_carry = None
+            self.frame_reader = wire_protocol.FrameReader(self.receive_buffer_size)
+            if self.pool is None or not self.pool.attach(self):
+                self.send_thread = threading.Thread(target=self.__send_worker, daemon=True)
+                self.send_thread.start()
+                if (
+                        self.type == "USB" or
+                        self.type == "WIFI" or
+                        self.type == "BLUETOOTH" or
+                        self.type == "SIM"
+                ):
+                    self.receive_thread = threading.Thread(target=self.receive_worker, daemon=True)
+                    self.receive_thread.start()
             if (
-                    self.type == "USB" or
-                    self.type == "WIFI" or
-                    self.type == "BLUETOOTH"
+                    (self.type == "USB" or self.type == "WIFI" or self.type == "SIM") and
+                    not self.wait_ready()
             ):
-                self.receive_thread = threading.Thread(target=self.receive_worker, daemon=True)
-                self.receive_thread.start()
+                self.disconnect()
+                return
             self.check_firmware()
+            if self.connected and self.protocol == "binary":
+                self.negotiate_protocol()
 
     def disconnect(self):
         """
         Disconnect a device
         """
+        if self.debug_monitor is not None:
+            self.debug_monitor.close()
         if not self.connected:
             return
         self.connected = False
+        self.reconnecting = False
+        self.binary_active = False
+        if self.pool is not None:
+            self.pool.detach(self)
         # self.clear_send()
-        self.event_send_block.set()
+        self.__reset_window()
         if self.type == "USB":
             if self.debug:
-                print(f'Info: Disconnect [Object:{self.connection_usb}] [{self.name}]')
+                self.trace(f'Info: Disconnect [Object:{self.connection_usb}] [{self.name}]')
             try:
                 self.connection_usb.close()
             except:
                 if self.debug:
-                    print(f'ERROR: Disconnect Failed [{self.name}]')
+                    self.trace(f'ERROR: Disconnect Failed [{self.name}]')
         #
         #
         #
         elif self.type == "WIFI":
             if self.debug:
-                print(f'Info: Disconnect [Object:{self.connection_wifi}] [{self.name}]')
+                self.trace(f'Info: Disconnect [Object:{self.connection_wifi}] [{self.name}]')
+            try:
+                # Wakes up a receive worker blocked in recv_into()
+                self.connection_wifi.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             try:
                 self.connection_wifi.close()
             except:
                 if self.debug:
-                    print(f'ERROR: Disconnect Failed [{self.name}]')
+                    self.trace(f'ERROR: Disconnect Failed [{self.name}]')
+        #
+        #
+        #
+        elif self.type == "SIM":
+            if self.debug:
+                self.trace(f'Info: Disconnect [Object:{self.sim_board}] [{self.name}]')
+            try:
+                # The simulator removes the board when its connection closes
+                self.connection_sim.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                self.connection_sim.close()
+            except:
+                if self.debug:
+                    self.trace(f'ERROR: Disconnect Failed [{self.name}]')
         #
         #
         #
@@ -267,18 +491,75 @@ class ConnectionOrganiser:
                 pass
             except:
                 if self.debug:
-                    print(f'ERROR: Disconnect Failed [{self.name}]')
+                    self.trace(f'ERROR: Disconnect Failed [{self.name}]')
 
         elif self.type == "OPC":
             try:
                 if self.debug:
-                    print(f'Info: Disconnect [Object:{self.connection_opc_client}] [{self.name}]')
-                self.connection_opc_client.disconnect()
-                del self.connection_opc_client
+                    self.trace(f'Info: Disconnect [Object:{self.connection_opc_client}] [{self.name}]')
+                opc_session, self.opc_session = self.opc_session, None
                 self.connection_opc_client = None
+                self.opc_nodes = {}
+                self.opc_variant_types = {}
+                # The last device of a shared session closes it
+                opc_session.release()
             except:
                 if self.debug:
-                    print(f'ERROR: Disconnect Failed [{self.name}]')
+                    self.trace(f'ERROR: Disconnect Failed [{self.name}]')
+
+    def __connection_lost(self):
+        """
+        Private function.\n
+        Close a broken connection. Only the transport is closed, subclasses keep their state
+        (e.g. the output image) for resync(), nothing is sent to the device.
+        """
+        if not self.connected:
+            return
+        self.stats.count("connections_lost")
+        if self.opc_session:
+            # Nobody may pick up the broken session again
+            self.opc_session.discard()
+        ConnectionOrganiser.disconnect(self)
+        self.connection_lost()
+
+    def connection_lost(self):
+        """
+        Called after the connection broke down (not on disconnect()).\n
+        Starts the reconnect supervisor with auto_reconnect. Subclasses extend it to reset their state.
+        """
+        print(f'ERROR: Connection lost [{self.name}]')
+        if self.auto_reconnect and not (self.reconnect_thread and self.reconnect_thread.is_alive()):
+            self.reconnecting = True
+            self.reconnect_thread = threading.Thread(target=self.__reconnect_worker, daemon=True)
+            self.reconnect_thread.start()
+
+    def __reconnect_worker(self):
+        """
+        Private function.\n
+        Thread to reconnect with exponential backoff until connected or disconnect() is called,
+        then resync() the device.
+        """
+        delay = float(self.reconnect_delay)
+        while self.reconnecting and not self.connected:
+            time.sleep(delay)
+            if not self.reconnecting:
+                break
+            if self.debug:
+                self.trace(f'Info: Reconnect [{self.name}]')
+            self.connect()
+            if self.connected:
+                self.stats.count("reconnects")
+                print(f'Info: Reconnected [{self.name}]')
+                self.resync()
+                break
+            delay = min(delay * 2, float(self.reconnect_max_delay))
+        self.reconnecting = False
+
+    def resync(self):
+        """
+        Called after an automatic reconnect, subclasses push their last known state to the device again
+        """
+        pass
 
     def clear_send(self):
         """
@@ -294,15 +575,15 @@ class ConnectionOrganiser:
                     print(e)
                 self.send_q.task_done()
             if self.debug:
-                print(f'###Clearing Send Q Done### [{self.name}] Disconnected')
+                self.trace(f'###Clearing Send Q Done### [{self.name}] Disconnected')
             return
         if self.debug:
-            print(f'###Clearing Send Q### [{self.name}]')
-            print("Q size: ", self.send_q.qsize())
+            self.trace(f'###Clearing Send Q### [{self.name}]')
+            self.trace(f'Q size: {self.send_q.qsize()} [{self.name}]')
         # while self.send_q.qsize() > 0:
         #     time.sleep(0.01)
         if self.debug:
-            print(f'###Clearing Send Q Done### [{self.name}]')
+            self.trace(f'###Clearing Send Q Done### [{self.name}]')
 
     def send(self, data_to_send: (str, bytes, list, int), type_of_data: str = "str"):
         """
@@ -316,8 +597,23 @@ class ConnectionOrganiser:
         if self.connected:
             data_to_send = [type_of_data, data_to_send]
             self.send_q.put(data_to_send)
+            self.stats.high_water("send_q_max", self.send_q.qsize())
+            if self.pool is not None:
+                self.pool.wake()
             if self.debug:
-                print(f'send_queue add: {data_to_send} length: {self.send_q.qsize()} [{self.name}]')
+                self.trace(f'send_queue add: {data_to_send} length: {self.send_q.qsize()} [{self.name}]')
+
+    def send_many(self, data_to_send: list, type_of_data: str = "byte"):
+        """
+        OPC-UA only: add a write of many nodes to the send Buffer.\n
+        All nodes go out together with one Write service call.\n
+        data_to_send[["node_id", (str, int, bytes, list)], ...]
+
+        :type data_to_send: list
+        :type type_of_data: str
+        """
+        if data_to_send:
+            self.send([list(item) for item in data_to_send], type_of_data)
 
     def send_to_device(self, data_to_send: str):
         """
@@ -329,37 +625,324 @@ class ConnectionOrganiser:
     def __send_worker(self):
         """
         Private function
-        Thread to catch send requests from the buffer and send it to the device
+        Thread to catch send requests from the buffer and send it to the device.\n
+        Commands for USB, WIFI and Bluetooth that are already queued get packed into one write,
+        limited by the send window and send_batch_bytes.
         """
         if self.debug:
-            print(f'Start Send Worker [{self.name}]')
-        while self.connected:
-            try:
-                self.send_worker_phase = 1
-                data_to_send: (list, None) = self.send_q.get(True, 1)
-            except:
-                if self.debug:
-                    pass
-                    # print(f'Send Worker Q MT [{self.name}]')
-                data_to_send = None
+            self.trace(f'Start Send Worker [{self.name}]')
+        connection_count = self.connection_count
+        while self.connected and connection_count == self.connection_count:
+            if self.send_carry:
+                data_to_send, self.send_carry = self.send_carry, None
+            else:
+                try:
+                    self.send_worker_phase = 1
+                    data_to_send: (list, None) = self.send_q.get(True, 1)
+                except:
+                    if self.debug:
+                        pass
+                        # print(f'Send Worker Q MT [{self.name}]')
+                    data_to_send = None
             if data_to_send:
                 if self.debug:
-                    print(f'Get from Q: {data_to_send} [{self.send_q.qsize()}] [{self.name}]')
-                self.event_send_block.clear()
-                self.__send_to_device(data_to_send)
-                self.send_worker_phase = 2
-                self.event_send_block.wait(timeout=10)
+                    self.trace(f'Get from Q: {data_to_send} [{self.send_q.qsize()}] [{self.name}]')
+                payload = self.__encode(data_to_send)
+                if payload is None:
+                    self.__send_to_device(data_to_send)
+                    done = 1
+                else:
+                    done = self.__send_batch(payload)
                 if self.debug:
-                    print("Send Task done")
+                    self.trace("Send Task done")
 
-                try:
-                    self.send_q.task_done()
-                except Exception as e:
-                    print(e)
+                if not self.__send_done(done):
                     break
         self.send_worker_phase = 3
         print(f'END Send Worker [{self.name}]')
 
+    def __send_done(self, done: int) -> bool:
+        """
+        Private function.\n
+        Mark done requests of the send_q as finished and wake up flush()
+        :type done: int
+        :rtype: bool
+        """
+        try:
+            for _ in range(done):
+                self.send_q.task_done()
+        except Exception as e:
+            print(e)
+            return False
+        with self.send_window_cond:
+            self.send_window_cond.notify_all()
+        return True
+
+    def send_step(self) -> bool:
+        """
+        One non-blocking step of the send worker for DevicePool:
+        write everything queued that fits into the send window as one batch.\n
+        Returns True if something was sent.
+        :rtype: bool
+        """
+        if not self.connected:
+            return False
+        room, room_bytes = self.__window_room()
+        if room <= 0:
+            return False
+        if self.send_carry:
+            data_to_send, self.send_carry = self.send_carry, None
+        else:
+            try:
+                data_to_send = self.send_q.get(False)
+            except queue.Empty:
+                return False
+        payload = self.__encode(data_to_send)
+        if payload is None:
+            # Nothing a stream device can send
+            return self.__send_done(1)
+        if len(payload) > room_bytes and self.in_flight:
+            self.send_carry = data_to_send
+            return False
+        return self.__send_done(self.__write_batch(payload, room, room_bytes, 0))
+
+    def send_timeout(self) -> (float, None):
+        """
+        Seconds until the oldest ack of a blocked send window times out, for the DevicePool select() timeout.\n
+        None if nothing waits for the window.
+        :rtype: float
+        """
+        with self.send_window_cond:
+            if not self.in_flight or (not self.send_carry and self.send_q.empty()):
+                return None
+            return max(0.0, self.in_flight[0][1] + self.ack_timeout - time.monotonic())
+
+    def __encode(self, data_list_to_send: list) -> (bytes, None):
+        """
+        Private function.\n
+        Encode a send request (str command or binary frame) for USB, WIFI and Bluetooth.\n
+        Returns None if the request has to go through __send_to_device (OPC-UA or unsupported data)
+        :type data_list_to_send: list
+        :rtype: bytes
+        """
+        data_to_send = data_list_to_send[1]
+        if (isinstance(data_to_send, (str, bytes)) and
+                (
+                        self.type == "USB" or
+                        self.type == "WIFI" or
+                        self.type == "BLUETOOTH" or
+                        self.type == "SIM"
+                )):
+            # bytes are binary protocol frames and go out unchanged
+            if isinstance(data_to_send, bytes):
+                return data_to_send
+            return (data_to_send.replace("\n", "") + self.send_attach).encode()
+        return None
+
+    def __send_batch(self, payload: bytes) -> (list, int):
+        """
+        Private function.\n
+        Send payload together with everything queued behind it in a single transport write.\n
+        Waits up to send_batch_delay for more commands while the window has room.\n
+        A request that did not fit is kept in send_carry, returns the number of commands sent.
+        :type payload: bytes
+        :rtype: int
+        """
+        self.__wait_for_window(len(payload))
+        room, room_bytes = self.__window_room()
+        return self.__write_batch(payload, room, room_bytes, self.send_batch_delay)
+
+    def __write_batch(self, payload: bytes, room: int, room_bytes: int, delay: float) -> int:
+        """
+        Private function.\n
+        Pack payload and up to room - 1 more queued commands (room_bytes in total) into one write.\n
+        Waits up to delay for more commands.
+        :type payload: bytes
+        :rtype: int
+        """
+        room_bytes = min(room_bytes, self.send_batch_bytes)
+        batch = [payload]
+        batch_bytes = len(payload)
+        deadline = time.monotonic() + delay
+        while len(batch) < room:
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    data_to_send = self.send_q.get(True, remaining)
+                else:
+                    data_to_send = self.send_q.get(False)
+            except queue.Empty:
+                break
+            next_payload = self.__encode(data_to_send)
+            if next_payload is None or batch_bytes + len(next_payload) > room_bytes:
+                self.send_carry = data_to_send
+                break
+            batch.append(next_payload)
+            batch_bytes += len(next_payload)
+
+        self.__track([len(part) for part in batch])
+        self.__write_stream(b"".join(batch))
+        return len(batch)
+
+    def __write_stream(self, payload: bytes):
+        """
+        Private function.\n
+        Write encoded commands to USB, WIFI or Bluetooth
+        :type payload: bytes
+        """
+        if not self.connected:
+            return
+        if self.type == "USB":
+            try:
+                if self.debug:
+                    self.trace(f'Info: Send [{payload}] [{self.name}]')
+                self.connection_usb.write(payload)
+            except:
+                print(f'ERROR: Connection Organiser send() [{self.name}]')
+                self.stats.count("send_errors")
+                self.__connection_lost()
+        #
+        #
+        #
+        elif self.type == "WIFI":
+            try:
+                if self.debug:
+                    self.trace(f'Info: Send [{payload}] [{self.name}]')
+                self.connection_wifi.sendall(payload)
+            except:
+                print(f'ERROR: Connection Organiser [send()] [{self.name}]')
+                self.stats.count("send_errors")
+                self.__connection_lost()
+        #
+        #
+        #
+        elif self.type == "SIM":
+            try:
+                if self.debug:
+                    self.trace(f'Info: Send [{payload}] [{self.name}]')
+                self.connection_sim.sendall(payload)
+            except:
+                print(f'ERROR: Connection Organiser [send()] [{self.name}]')
+                self.stats.count("send_errors")
+                self.__connection_lost()
+        #
+        #
+        #
+        elif self.type == "BLUETOOTH":
+            try:
+                if self.debug:
+                    self.trace(f'Info: Send [{payload}] [{self.name}]')
+
+            except:
+                print(f'ERROR: Connection Organiser send() [{self.name}]')
+                self.__connection_lost()
+
+    def __reset_window(self):
+        """
+        Private function.\n
+        Forget all outstanding acks and wake up everybody waiting on the send window
+        """
+        with self.send_window_cond:
+            self.in_flight.clear()
+            self.in_flight_bytes = 0
+            self.send_window_cond.notify_all()
+
+    def __window_room(self) -> (int, int):
+        """
+        Private function.\n
+        Free commands and bytes of the send window, acks older than ack_timeout are counted as lost first
+        :rtype: (int, int)
+        """
+        with self.send_window_cond:
+            self.__expire_acks()
+            return self.send_window - len(self.in_flight), self.send_window_bytes - self.in_flight_bytes
+
+    def __expire_acks(self):
+        """
+        Private function.\n
+        Drop commands from the send window whose ack did not arrive within ack_timeout, hold send_window_cond
+        """
+        deadline = time.monotonic() - self.ack_timeout
+        while self.in_flight and self.in_flight[0][1] <= deadline:
+            lost_size, _ = self.in_flight.popleft()
+            self.in_flight_bytes -= lost_size
+            self.stats.ack_timeouts += 1
+            if self.debug:
+                self.trace(f'ERROR: Ack timeout, {len(self.in_flight)} still in flight [{self.name}]')
+
+    def __wait_for_window(self, size: int):
+        """
+        Private function.\n
+        Block until a command of size bytes fits into the send window.\n
+        Acks that did not arrive within ack_timeout are counted as lost and leave the window.
+        :type size: int
+        """
+        self.send_worker_phase = 2
+        with self.send_window_cond:
+            while self.connected and self.in_flight:
+                if (len(self.in_flight) < self.send_window and
+                        self.in_flight_bytes + size <= self.send_window_bytes):
+                    return
+                remaining = self.in_flight[0][1] + self.ack_timeout - time.monotonic()
+                if remaining <= 0:
+                    self.__expire_acks()
+                    continue
+                self.send_window_cond.wait(remaining)
+
+    def __track(self, sizes: list):
+        """
+        Private function.\n
+        Add written commands to the send window, one entry per expected ack.\n
+        Call it before writing, the ack may arrive before the write call returns.
+        :type sizes: list
+        """
+        now = time.monotonic()
+        with self.send_window_cond:
+            for size in sizes:
+                self.in_flight.append((size, now))
+                self.in_flight_bytes += size
+            self.stats.commands_sent += len(sizes)
+            self.stats.bytes_out += sum(sizes)
+            if len(self.in_flight) > self.stats.in_flight_max:
+                self.stats.in_flight_max = len(self.in_flight)
+
+    def __acknowledge(self, count: int = 1):
+        """
+        Private function.\n
+        Release the oldest commands of the send window, one per received ">"
+        :type count: int
+        """
+        now = time.monotonic()
+        with self.send_window_cond:
+            for _ in range(count):
+                # Acks without a command in flight (e.g. the startup ">") are ignored
+                if not self.in_flight:
+                    break
+                size, sent = self.in_flight.popleft()
+                self.in_flight_bytes -= size
+                self.stats.acks += 1
+                self.stats.ack_rtt.record(int((now - sent) * 1e9))
+            self.send_window_cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Block until every queued command is written and acknowledged by the device.\n
+        Use it as a barrier when send_window > 1 and the next step relies on the device state.\n
+        Returns False on timeout or lost connection.
+        :type timeout: float
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.send_window_cond:
+            while self.connected:
+                if self.send_q.unfinished_tasks == 0 and not self.in_flight:
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.send_window_cond.wait(remaining)
+        return False
+
     def __send_to_device(self, data_list_to_send: list):
         """
         Private function.\n
@@ -371,168 +954,406 @@ class ConnectionOrganiser:
         """
 
         type_of_data, data_to_send = data_list_to_send[0], data_list_to_send[1]
-        if isinstance(data_to_send, str):
-            data_to_send = data_to_send.replace("\n", "")
 
         if self.connected:
             # region USB WIFI BLE
-            # lock for supported type
-            if (isinstance(data_to_send, str) and
-                    (
-                            self.type == "USB" or
-                            self.type == "WIFI" or
-                            self.type == "BLUETOOTH"
-                    )):
-                if self.type == "USB":
-                    try:
-                        if self.debug:
-                            print(f'Info: Send [{data_to_send}] [{self.name}]')
-                        self.connection_usb.write((data_to_send + self.send_attach).encode())
-                    except:
-                        print(f'ERROR: Connection Organiser send() [{self.name}]')
-                        self.connected = False
-                        self.disconnect()
-                #
-                #
-                #
-                elif self.type == "WIFI":
-                    try:
-                        if self.debug:
-                            print(f'Info: Send [{data_to_send}] [{self.name}]')
-                        self.connection_wifi.send((data_to_send + self.send_attach).encode())
-                    except:
-                        print(f'ERROR: Connection Organiser [send()] [{self.name}]')
-                        self.connected = False
-                        self.disconnect()
-                #
-                #
-                #
-                elif self.type == "BLUETOOTH":
-                    try:
-                        if self.debug:
-                            print(f'Info: Send [{data_to_send}] [{self.name}]')
-
-                    except:
-                        print(f'ERROR: Connection Organiser send() [{self.name}]')
-                        self.connected = False
-                        self.disconnect()
+            payload = self.__encode(data_list_to_send)
+            if payload is not None:
+                self.__wait_for_window(len(payload))
+                self.__track([len(payload)])
+                self.__write_stream(payload)
             # endregion
 
             # region OPC-UA
             if self.type == "OPC":
+                # [["node_id", value], ...] from send_many()
+                if isinstance(data_to_send, list) and data_to_send and isinstance(data_to_send[0], (list, tuple)):
+                    self.__send_many_to_device(data_to_send, type_of_data)
+                    return
+
                 try:
                     node_id, data_to_send = data_to_send[0], data_to_send[1]
                 except:
                     if self.debug:
-                        print(f'ERROR: Send param invalid: node_id [{self.name}]')
-                    # Unlock sender
-                    self.event_send_block.set()
+                        self.trace(f'ERROR: Send param invalid: node_id [{self.name}]')
                     return
                     #
 
                 # Catch Node from OPC-UA Server
 
                 try:
-                    client_node = self.connection_opc_client.get_node(node_id)
+                    client_node = self.opc_node(node_id)
+                    variant_type = self.opc_variant_type(node_id) if type_of_data == "auto" else None
                 except:
                     print(f'ERROR: Connection Organiser send() [{self.name}]')
-                    self.connected = False
-                    self.disconnect()
+                    self.__connection_lost()
                     return
 
-                client_node_dv = None
-
                 # Generate OPC send data
-                # TODO Add missing data types
-                if type_of_data == "byte":
-                    client_node_dv = ua.DataValue(ua.Variant(data_to_send, ua.VariantType.Byte))
+                client_node_dv = self.__opc_data_value(data_to_send, type_of_data, variant_type)
 
                 # If data is available send it
                 if client_node_dv:
                     try:
-                        client_node.set_value(client_node_dv)
+                        self.stats.count("opc_calls")
+                        with self.stats.timer.section("opc_write"):
+                            client_node.set_value(client_node_dv)
                     except Exception as e:
                         print(
                             f'ERROR [{e}]: Connection Organiser send() [{self.name}]\n'
                         )
-                        self.connected = False
-                        self.disconnect()
+                        self.stats.count("opc_errors")
+                        self.__connection_lost()
                         return
                     if self.debug:
-                        print(f'Set Value of Node [{client_node}]: {data_to_send}')
+                        self.trace(f'Set Value of Node [{client_node}]: {data_to_send}')
                 else:
                     if self.debug:
-                        print(f'ERROR: Send param invalid: type_of_data [{self.name}]')
-
-                # Unlock sender
-                self.event_send_block.set()
+                        self.trace(f'ERROR: Send param invalid: type_of_data [{self.name}]')
             # endregion
 
-    def receive_worker(self):
-        # print(f'Start Receive Worker [{self.name}]')
-        while self.connected:
-            receive_char = ""
-            if self.connected:
-                self.rec_worker_phase = 1
-                if self.type == "USB":
+    def opc_nodes_for(self, node_ids: list) -> list:
+        """
+        OPC-UA only: Nodes of node_ids, in order.\n
+        Every node is resolved once per session, new nodes are registered together with one
+        RegisterNodes service call (opc_register_nodes) and used through the server handle afterwards.
+        The cache belongs to the OPCSession and is dropped when its last device disconnects.
+        :type node_ids: list
+        :rtype: list
+        """
+        opc_nodes = self.opc_nodes
+        missing = [node_id for node_id in dict.fromkeys(node_ids) if node_id not in opc_nodes]
+        if missing:
+            with self.opc_nodes_lock:
+                missing = [node_id for node_id in missing if node_id not in opc_nodes]
+                client_nodes = [self.connection_opc_client.get_node(node_id) for node_id in missing]
+                if self.opc_register_nodes and client_nodes:
                     try:
-                        while not receive_char.endswith("\n"):
-                            receive_char = self.connection_usb.readline().decode()
-                        receive_char = receive_char.replace("\r", "")
-                        if self.debug:
-                            if receive_char:
-                                print(f'Info: Get in Receive [{receive_char}] [{self.name}]')
+                        self.connection_opc_client.register_nodes(client_nodes)
                     except Exception as e:
+                        # Server without RegisterNodes, keep the plain nodes
                         if self.debug:
-                            print(f'ERROR [{e}]: Connection Organiser [receive()] [{self.name}]')
-                        self.connected = False
-                        self.disconnect()
-                #
-                #
-                #
-                elif self.type == "WIFI":
-                    try:
-                        while not receive_char.endswith("\n"):
-                            receive_char += self.connection_wifi.recv(1024).decode()
+                            self.trace(f'ERROR [{e}]: Connection Organiser register_nodes() [{self.name}]')
+                opc_nodes.update(zip(missing, client_nodes))
+        return [opc_nodes[node_id] for node_id in node_ids]
 
-                        receive_char = receive_char.replace("\r", "")
-                        if self.debug:
-                            print(f'Info: Get in Receive [{receive_char}] [{self.name}]')
+    def opc_node(self, node_id: str) -> opcua.Node:
+        """
+        OPC-UA only: cached Node of node_id, see opc_nodes_for()
+        :type node_id: str
+        :rtype: opcua.Node
+        """
+        client_node = self.opc_nodes.get(node_id)
+        if client_node is None:
+            client_node = self.opc_nodes_for([node_id])[0]
+        return client_node
 
-                    except Exception as e:
-                        pass
-                        if self.debug:
-                            print(f'ERROR [{e}]: Connection Organiser receive() [{self.name}]')
-                        self.connected = False
-                        self.disconnect()
-                #
-                #
-                #
-                elif self.type == "BLUETOOTH":
-                    try:
-                        pass
-                    except:
-                        self.connected = False
-                        self.disconnect()
-
-                if receive_char:
-                    self.rec_worker_phase = 2
-                    if receive_char.count('>') > 0:
-                        self.event_send_block.set()
-                        if self.debug:
-                            print(f'Event send block = Clear [{self.name}]')
-                        # print("ADD")
-                    # receive_char = receive_char.replace(">", "")
-                    if receive_char:
-                        for part in receive_char.split("\n"):
-                            if part:
-                                if self.debug:
-                                    print(f'ADD to receive_q: {part} [{self.name}]')
-                                self.receive_q.put(part)
+    def opc_variant_type(self, node_id: str) -> (ua.VariantType, None):
+        """
+        OPC-UA only: VariantType of the DataType of node_id, read once per session.\n
+        None if the node has no usable DataType.
+        :type node_id: str
+        :rtype: ua.VariantType
+        """
+        if node_id not in self.opc_variant_types:
+            try:
+                variant_type = self.opc_node(node_id).get_data_type_as_variant_type()
+            except ua.UaError as e:
+                if self.debug:
+                    self.trace(f'ERROR [{e}]: Connection Organiser DataType of [{node_id}] [{self.name}]')
+                variant_type = None
+            self.opc_variant_types[node_id] = variant_type
+        return self.opc_variant_types[node_id]
+
+    def clear_opc_nodes(self):
+        """
+        OPC-UA only: unregister and forget all cached nodes of the session, for every device sharing it
+        """
+        if self.opc_session:
+            try:
+                self.opc_session.clear_nodes()
+            except Exception as e:
+                if self.debug:
+                    self.trace(f'ERROR [{e}]: Connection Organiser unregister_nodes() [{self.name}]')
+
+    @staticmethod
+    def __opc_data_value(value, type_of_data: str, variant_type: ua.VariantType = None) -> (ua.DataValue, None):
+        """
+        Private function.\n
+        Generate OPC send data, None for unsupported type_of_data.\n
+        type_of_data "auto" uses variant_type, the DataType of the node.
+        :type type_of_data: str
+        :type variant_type: ua.VariantType
+        :rtype: ua.DataValue
+        """
+        if type_of_data != "auto":
+            variant_type = OPC_VARIANT_TYPES.get(type_of_data)
+        if variant_type is None:
+            return None
+        return ua.DataValue(ua.Variant(value, variant_type))
+
+    def __send_many_to_device(self, data_to_send: list, type_of_data: str):
+        """
+        Private function.\n
+        Write all [node_id, value] pairs with one OPC-UA Write service call
+        :type data_to_send: list
+        :type type_of_data: str
+        """
+        client_nodes = []
+        client_node_dvs = []
+        try:
+            client_nodes = self.opc_nodes_for([node_id for node_id, _ in data_to_send])
+            for node_id, value in data_to_send:
+                variant_type = self.opc_variant_type(node_id) if type_of_data == "auto" else None
+                client_node_dv = self.__opc_data_value(value, type_of_data, variant_type)
+                if not client_node_dv:
+                    if self.debug:
+                        self.trace(f'ERROR: Send param invalid: type_of_data [{self.name}, {node_id}]')
+                    return
+                client_node_dvs.append(client_node_dv)
+
+            self.stats.count("opc_calls")
+            with self.stats.timer.section("opc_write"):
+                self.connection_opc_client.set_values(client_nodes, client_node_dvs)
+        except Exception as e:
+            print(f'ERROR [{e}]: Connection Organiser send_many() [{self.name}]')
+            self.stats.count("opc_errors")
+            self.__connection_lost()
+            return
+        if self.debug:
+            self.trace(f'Set Value of {len(client_nodes)} Nodes [{self.name}]')
+
+    def receive_worker(self):
+        """
+        Thread to read from USB, WIFI, Bluetooth and SIM.\n
+        Data goes straight into the FrameReader buffer, every complete frame is handled once:
+        acks release the send window, text lines and binary input reports (kind, pin, value) go to handle_message().
+        """
+        # print(f'Start Receive Worker [{self.name}]')
+        connection_count = self.connection_count
+        while self.connected and connection_count == self.connection_count:
+            if self.receive_step() is None:
+                break
 
         self.rec_worker_phase = 3
         print(f'END Receive Worker [{self.name}]')
 
+    def receive_step(self) -> (int, None):
+        """
+        Read once into the FrameReader and handle every complete frame.\n
+        Blocks on USB (up to the port timeout) and Wi-Fi until data arrives, unless called by
+        the DevicePool when the device is readable.\n
+        Returns the number of bytes received, None if the connection was lost.
+        :rtype: int
+        """
+        reader = self.frame_reader
+        self.rec_worker_phase = 1
+        received = 0
+        try:
+            if self.type == "USB":
+                received = reader.read_from(self.__usb_read_into)
+            #
+            #
+            #
+            elif self.type == "WIFI":
+                received = reader.read_from(self.__wifi_read_into)
+            #
+            #
+            #
+            elif self.type == "BLUETOOTH":
+                pass
+            #
+            #
+            #
+            elif self.type == "SIM":
+                received = reader.read_from(self.__sim_read_into)
+        except Exception as e:
+            if self.debug:
+                self.trace(f'ERROR [{e}]: Connection Organiser [receive()] [{self.name}]')
+            # A worker of an older connection must not take down the new one
+            if reader is self.frame_reader:
+                self.__connection_lost()
+            return None
+
+        if received:
+            self.rec_worker_phase = 2
+            self.ready_event.set()
+            self.stats.bytes_in += received
+            acks = 0
+            for frame in reader.frames():
+                message = wire_protocol.decode(frame, reader.binary)
+                if message == ">":
+                    acks += 1
+                    continue
+                self.stats.messages_in += 1
+                self.handle_message(message)
+            if acks:
+                self.__acknowledge(acks)
+                if self.debug:
+                    self.trace(f'Ack received, in flight: {len(self.in_flight)} [{self.name}]')
+        return received
+
+    def __usb_read_into(self, view: memoryview) -> int:
+        return self.connection_usb.readinto(view[:max(1, self.connection_usb.in_waiting)])
+
+    def __wifi_read_into(self, view: memoryview) -> int:
+        count = self.connection_wifi.recv_into(view)
+        if not count:
+            raise ConnectionError("Connection closed by device")
+        return count
+
+    def __sim_read_into(self, view: memoryview) -> int:
+        count = self.connection_sim.recv_into(view)
+        if not count:
+            raise ConnectionError("Simulated board removed")
+        return count
+
+    def fileno(self) -> (int, None):
+        """
+        File descriptor of the USB, Wi-Fi or SIM connection for selectors, None if there is none
+        :rtype: int
+        """
+        try:
+            if self.type == "USB":
+                return self.connection_usb.fileno()
+            if self.type == "WIFI":
+                return self.connection_wifi.fileno()
+            if self.type == "SIM":
+                return self.connection_sim.fileno()
+        except Exception:
+            pass
+        return None
+
+    def handle_message(self, message: (str, tuple)):
+        """
+        Called by the receive worker for every received line or binary report, puts it into the receive_q.\n
+        Subclasses can take messages out before.
+        :type message: (str, tuple)
+        """
+        if self.debug:
+            self.trace(f'ADD to receive_q: {message} [{self.name}]')
+        self.receive_q.put(message)
+        self.stats.high_water("receive_q_max", self.receive_q.qsize())
+
+    def metrics(self) -> dict:
+        """
+        Runtime metrics of this device: counters (commands, bytes, acks, errors, reconnects, OPC calls),
+        queue depths with their high-water marks, commands_per_s since creation and the ack_rtt/opc_read/opc_write
+        latency reports in ns, see metrics.DeviceMetrics.\n
+        metrics.MetricsServer serves them of many devices for Prometheus.
+        :rtype: dict
+        """
+        metrics = self.stats.snapshot()
+        if self.frame_reader is not None:
+            metrics["parse_errors"] += self.frame_reader.crc_errors + self.frame_reader.overflows
+        metrics["name"] = self.name
+        metrics["type"] = self.type
+        metrics["connected"] = self.connected
+        metrics["send_q"] = self.send_q.qsize()
+        metrics["receive_q"] = self.receive_q.qsize()
+        metrics["in_flight"] = len(self.in_flight)
+        return metrics
+
+    def start_debug_monitor(self, viewer: str = None) -> DebugMonitor:
+        """
+        Start the DebugMonitor of this device (debug=True does on init) and the viewer
+        ("" headless, "tk" or "terminal", default debug_viewer). Debug output goes into its trace from now on.
+        :type viewer: str
+        :rtype: DebugMonitor
+        """
+        if self.debug_monitor is None:
+            self.debug_monitor = DebugMonitor(self, self.debug_interval, self.debug_trace_size)
+        self.debug = True
+        viewer = self.debug_viewer if viewer is None else viewer
+        if viewer == "tk":
+            TkViewer(self.debug_monitor)
+        elif viewer == "terminal":
+            TerminalViewer(self.debug_monitor)
+        return self.debug_monitor
+
+    def stop_debug_monitor(self):
+        """
+        Drop the DebugMonitor, debug output is printed again. disconnect() only pauses its sampler
+        """
+        if self.debug_monitor is not None:
+            self.debug_monitor.close()
+            self.debug_monitor = None
+
+    def trace(self, message: str):
+        """
+        Debug output: into the trace of the DebugMonitor, printed without one.\n
+        Callers check self.debug first, the message is not even formatted without debug.
+        :type message: str
+        """
+        monitor = self.debug_monitor
+        if monitor is None:
+            print(message)
+        else:
+            monitor.trace(message)
+
+    def wait_ready(self) -> bool:
+        """
+        Wait until the firmware answers instead of a fixed delay after connect.\n
+        Ready is the first data from the device: the ">" of its startup or the ack of an empty line probe.
+        Probes go out every probe_interval for up to ready_timeout. A board that resets on connect
+        (USB with DTR) is not probed during boot_time, nothing is sent into its bootloader,
+        it is ready as soon as its startup ">" arrives.\n
+        Returns False if the device stays silent.
+        :rtype: bool
+        """
+        start = time.monotonic()
+        boot_time = float(self.boot_time) if self.type == "USB" and not self.disable_dsrdtr else 0.0
+        deadline = start + boot_time + float(self.ready_timeout)
+        while self.connected:
+            if time.monotonic() - start >= boot_time:
+                # A lost probe must not block the send window
+                self.__reset_window()
+                self.send("")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.ready_event.wait(min(float(self.probe_interval), remaining)):
+                # Let the ack of the last probe arrive before real commands use the window
+                self.flush(float(self.probe_interval))
+                self.__reset_window()
+                if self.debug:
+                    self.trace(f'Info: Device ready after {time.monotonic() - start:.3f} s [{self.name}]')
+                return True
+        print(f'ERROR: Device not ready within {boot_time + float(self.ready_timeout)} s [{self.name}]')
+        return False
+
+    def negotiate_protocol(self) -> bool:
+        """
+        Switch the device to the binary wire protocol with "M110 S1".\n
+        Stays on text commands if the firmware does not answer with "bin:1" within protocol_timeout.
+        :rtype: bool
+        """
+        self.binary_active = False
+        if not self.connected:
+            return False
+        self.send("M110 S1")
+        deadline = time.monotonic() + float(self.protocol_timeout)
+        skipped = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                line = self.receive_q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            self.receive_q.task_done()
+            if line == "bin:1":
+                self.binary_active = True
+                break
+            skipped.append(line)
+        # Give back everything that arrived in between (e.g. input reports)
+        for line in skipped:
+            self.receive_q.put(line)
+        if self.debug:
+            self.trace(f'Info: Protocol [{"binary" if self.binary_active else "text"}] [{self.name}]')
+        return self.binary_active
+
     def request_from_device(self, node_id: str):
         """
         OPC function to read a Node
@@ -544,41 +1365,67 @@ class ConnectionOrganiser:
 
         if self.type == "OPC":
             try:
-                client_node = self.connection_opc_client.get_node(node_id)
-                client_node_value = client_node.get_value()
+                client_node = self.opc_node(node_id)
+                self.stats.count("opc_calls")
+                with self.stats.timer.section("opc_read"):
+                    client_node_value = client_node.get_value()
                 if self.debug:
-                    print(f'Value of Node [{client_node}]: {client_node_value}')
+                    self.trace(f'Value of Node [{client_node}]: {client_node_value}')
                 return client_node_value
             except Exception as e:
                 print(f'ERROR [{e}]: Connection Organiser request_from_device() [{self.name}, {node_id}]')
-                self.connected = False
-                self.disconnect()
+                self.stats.count("opc_errors")
+                self.__connection_lost()
+                return
+
+    def request_many(self, node_ids: list) -> list:
+        """
+        OPC function to read many Nodes with one Read service call.\n
+        Returns the values in order of node_ids
+        :type node_ids: list
+        :rtype: list
+        """
+
+        if not self.connected:
+            return
+
+        if self.type == "OPC":
+            try:
+                client_nodes = self.opc_nodes_for(node_ids)
+                self.stats.count("opc_calls")
+                with self.stats.timer.section("opc_read"):
+                    client_node_values = self.connection_opc_client.get_values(client_nodes)
+                if self.debug:
+                    self.trace(f'Value of {len(client_nodes)} Nodes: {client_node_values}')
+                return client_node_values
+            except Exception as e:
+                print(f'ERROR [{e}]: Connection Organiser request_many() [{self.name}, {len(node_ids)} nodes]')
+                self.stats.count("opc_errors")
+                self.__connection_lost()
                 return
 
     # If firmware is defined run a check
     def check_firmware(self):
         # TODO Update firmware feedback for opc
         if self.firmware:
-            self.event_send_block.set()
             self.send("M100")
-            time.sleep(0.1)
-            # print(flag1 [{self.name}]')
-            get_firmware = self.receive_q.get()
-            self.receive_q.task_done()
-            # print(flag2 [{self.name}]')
-            while get_firmware:
+            deadline = time.monotonic() + float(self.firmware_timeout)
+            while self.connected:
+                try:
+                    get_firmware = self.receive_q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                self.receive_q.task_done()
                 if get_firmware == self.firmware:
                     if self.debug:
-                        print(f'Info: Connection [Firmware: {get_firmware}]')
-                        print(f'Settings: Connected [{self.name}]')
+                        self.trace(f'Info: Connection [Firmware: {get_firmware}]')
+                        self.trace(f'Settings: Connected [{self.name}]')
                     return
                 else:
                     if self.debug:
-                        print(f'ERROR: Connection Firmware is: {get_firmware}, but need to be: {self.firmware}')
-                get_firmware = self.receive_q.get()
-                self.receive_q.task_done()
+                        self.trace(f'ERROR: Connection Firmware is: {get_firmware}, but need to be: {self.firmware}')
             if self.debug:
-                print(f'ERROR: Connection Firmware could not retrieved')
+                self.trace(f'ERROR: Connection Firmware could not retrieved')
             self.disconnect()
 
 
@@ -789,131 +1636,17 @@ class ConfigWindow:
         #
         #
         #
-        # TODO if save -> write to settings
         if self.do_save:
-            #
-            #
-            with open(self.watched.settings_file_path, "w") as f:
-                f.write(f'type:{self.watched.type}\n')
+            save_settings(self.watched)
 
-                # Write USB
-                f.write(
-                    f'type:{self.watched.type}\n'
-                    f'usb_port:{self.watched.usb_port}\n'
-                    f'usb_baud:{self.watched.usb_baud}\n'
-                    f'wifi_host:{self.watched.wifi_host}\n'
-                    f'wifi_port:{self.watched.wifi_port}\n'
-                    f'opc_client_address:{self.watched.opc_client_address}'
-                    )
 
-
-class Debug:
+class Debug(TkViewer):
     def __init__(self, obj):
+        """
+        Tk debug window of obj, reads the DebugMonitor of obj (started if there is none)
+        """
         self.watched = obj
-        self.debug_thread = threading.Thread(target=self.debugger, daemon=True)
-        self.debug_thread.start()
-
-    def debugger(self):
-        self.root_debugger = tk.Tk()
-        self.root_debugger.geometry('360x300')
-        self.root_debugger.title(f'DEBUGGER: {self.watched.program_name}:{self.watched.name}')
-        self.root_debugger.resizable(False, False)
-
-        self.label_name = tk.Label(self.root_debugger, width=0, height=0,
-                                   text=f'{self.watched.program_name}:{self.watched.name}', font=('Helvetica bold', 10))
-        self.label_name.grid(column=0, row=0, columnspan=10, sticky="nsew")
-
-        self.label_status = tk.Label(self.root_debugger, width=10, height=1,
-                                     text="Status:", font=('Helvetica bold', 15))
-        self.label_status.grid(column=0, row=1)
-
-        self.label_status_phase = tk.Label(self.root_debugger, width=10, height=1,
-                                           text="Phase", font=('Helvetica bold', 10))
-        self.label_status_phase.grid(column=1, row=2)
-
-        self.label_status_running = tk.Label(self.root_debugger, width=10, height=1,
-                                             text="Running", font=('Helvetica bold', 10))
-        self.label_status_running.grid(column=2, row=2)
-        #
-        #
-        #
-        self.label_status_send = tk.Label(self.root_debugger, width=10, height=1,
-                                          text="Send Worker", font=('Helvetica bold', 15))
-        self.label_status_send.grid(column=0, row=3)
-
-        self.label_status_send_phase = tk.Label(self.root_debugger, width=10, height=1, bg="gray80")
-        self.label_status_send_phase.grid(column=1, row=3)
-
-        self.label_status_send_run = tk.Label(self.root_debugger, width=10, height=1, bg="gray80")
-        self.label_status_send_run.grid(column=2, row=3)
-        #
-        #
-        #
-        self.label_status_rec = tk.Label(self.root_debugger, width=10, height=1,
-                                         text="Rec Worker", font=('Helvetica bold', 15))
-        self.label_status_rec.grid(column=0, row=4)
-
-        self.label_status_rec_phase = tk.Label(self.root_debugger, width=10, height=1, bg="gray80")
-        self.label_status_rec_phase.grid(column=1, row=4)
-
-        self.label_status_rec_run = tk.Label(self.root_debugger, width=10, height=1, bg="gray80")
-        self.label_status_rec_run.grid(column=2, row=4)
-        #
-        #
-        #
-        self.label_send_q = tk.Label(self.root_debugger, height=1,
-                                     text="Send Queue length: 0", font=('Helvetica bold', 15))
-        self.label_send_q.grid(column=0, row=5, columnspan=10)
-        self.label_rec_q = tk.Label(self.root_debugger, height=1,
-                                    text="Receive Queue length: ", font=('Helvetica bold', 15))
-        self.label_rec_q.grid(column=0, row=6, columnspan=10)
-        #
-        #
-        #
-        while self.root_debugger:
-            try:
-                if self.watched.send_thread.is_alive():
-                    self.label_status_send_run.configure(bg="green")
-                else:
-                    self.label_status_send_run.configure(bg="yellow")
-            except:
-                try:
-                    self.label_status_send_run.configure(bg="red")
-                except:
-                    pass
-            try:
-                if self.watched.receive_thread.is_alive():
-                    self.label_status_rec_run.configure(bg="green")
-                else:
-                    self.label_status_rec_run.configure(bg="yellow")
-            except:
-                try:
-                    self.label_status_rec_run.configure(bg="red")
-                except:
-                    pass
-
-            try:
-                if self.watched.send_worker_phase == 1:
-                    self.label_status_send_phase.configure(bg="green")
-                if self.watched.send_worker_phase == 2:
-                    self.label_status_send_phase.configure(bg="blue")
-                if self.watched.send_worker_phase == 3:
-                    self.label_status_send_phase.configure(bg="red")
-                if self.watched.rec_worker_phase == 1:
-                    self.label_status_rec_phase.configure(bg="green")
-                if self.watched.rec_worker_phase == 2:
-                    self.label_status_rec_phase.configure(bg="blue")
-                if self.watched.rec_worker_phase == 3:
-                    self.label_status_rec_phase.configure(bg="red")
-                self.label_send_q.configure(text=f'Send Queue length: {self.watched.send_q.qsize()}')
-                self.label_rec_q.configure(text=f'Receive Queue length: {self.watched.receive_q.qsize()}')
-            except:
-                pass
-
-            try:
-                self.root_debugger.update()
-            except:
-                pass
+        super().__init__(obj.debug_monitor or obj.start_debug_monitor(viewer=""))
 
 
 if __name__ == "__main__":
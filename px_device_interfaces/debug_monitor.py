@@ -0,0 +1,235 @@
+import collections
+import sys
+import threading
+import time
+
+# Worker phases of ConnectionOrganiser: 1 running, 2 working, 3 ended
+PHASE_COLORS = {1: "green", 2: "blue", 3: "red"}
+
+
+class DebugMonitor:
+    def __init__(self, device, interval: float = 0.1, trace_size: int = 4096, history: int = 600):
+        """
+        Headless debug monitor of a ConnectionOrganiser.\n
+        Debug events of the device (device.trace()) go into a bounded ring buffer instead of stdout,
+        a sampler thread reads worker phases, thread state and queue sizes every interval seconds.
+        Both cost no more than a deque append, debugging does not change the timing of the device.\n
+        Viewers (TkViewer, TerminalViewer) only read from the monitor.\n
+        The device stops the sampler on disconnect() and starts it again on connect(), the trace stays readable.
+        :type interval: float
+        :type trace_size: int
+        :type history: int
+        """
+        self.device = device
+        self.interval = float(interval)
+        self.events = collections.deque(maxlen=int(trace_size))  # (time.monotonic_ns(), message)
+        self.samples = collections.deque(maxlen=int(history))  # dicts of sample()
+        self.event_count: int = 0  # Events ever traced, also counts the ones that fell out of the buffer
+        self.stop_event = threading.Event()
+        self.stop_event.set()
+        self.thread: (threading.Thread, None) = None
+        self.start()
+
+    def trace(self, message: str):
+        """
+        Record one debug event, called from any thread
+        :type message: str
+        """
+        self.events.append((time.monotonic_ns(), message))
+        self.event_count += 1
+
+    def recent(self, count: int = None) -> list:
+        """
+        Latest count events (all without count), oldest first
+        :type count: int
+        :rtype: list
+        """
+        events = list(self.events)
+        return events if count is None else events[-count:]
+
+    def since(self, event_count: int) -> list:
+        """
+        Events traced after event_count was read, for viewers that poll
+        :type event_count: int
+        :rtype: list
+        """
+        new = self.event_count - event_count
+        if new <= 0:
+            return []
+        return list(self.events)[-new:]
+
+    def sample(self) -> dict:
+        """
+        Current worker and queue state of the device
+        :rtype: dict
+        """
+        device = self.device
+
+        def alive(name: str) -> (bool, None):
+            thread = getattr(device, name, None)
+            return None if thread is None else thread.is_alive()
+
+        send_q = getattr(device, "send_q", None)
+        receive_q = getattr(device, "receive_q", None)
+        return {
+            "time_ns": time.monotonic_ns(),
+            "connected": device.connected,
+            "send_worker_phase": getattr(device, "send_worker_phase", 0),
+            "rec_worker_phase": getattr(device, "rec_worker_phase", 0),
+            "send_thread_alive": alive("send_thread"),
+            "receive_thread_alive": alive("receive_thread"),
+            "send_q": send_q.qsize() if send_q is not None else 0,
+            "receive_q": receive_q.qsize() if receive_q is not None else 0,
+            "in_flight": len(device.in_flight),
+        }
+
+    def latest(self) -> dict:
+        """
+        Newest sample, taken now if there is none yet
+        :rtype: dict
+        """
+        try:
+            return self.samples[-1]
+        except IndexError:
+            return self.sample()
+
+    def start(self):
+        """
+        Start the sampler thread, nothing happens while it runs
+        """
+        if not self.stop_event.is_set():
+            return
+        # Own event per thread, a closed thread may still be inside its wait()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.__worker, args=(self.stop_event,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """
+        Stop the sampler thread, trace() and the buffers keep working
+        """
+        self.stop_event.set()
+
+    @property
+    def running(self) -> bool:
+        return not self.stop_event.is_set()
+
+    def __worker(self, stop_event: threading.Event):
+        """
+        Private function.\n
+        Sampler thread, sleeps between samples
+        """
+        while not stop_event.is_set():
+            try:
+                self.samples.append(self.sample())
+            except Exception as e:
+                self.trace(f'ERROR [{e}]: DebugMonitor sample()')
+            stop_event.wait(self.interval)
+
+
+def format_sample(sample: dict) -> str:
+    return (f'connected={sample["connected"]} '
+            f'send(phase={sample["send_worker_phase"]}, alive={sample["send_thread_alive"]}) '
+            f'rec(phase={sample["rec_worker_phase"]}, alive={sample["receive_thread_alive"]}) '
+            f'send_q={sample["send_q"]} receive_q={sample["receive_q"]} in_flight={sample["in_flight"]}')
+
+
+class TerminalViewer:
+    def __init__(self, monitor: DebugMonitor, interval: float = 1.0, stream=None):
+        """
+        Prints the new trace events and the latest sample of monitor every interval seconds
+        :type monitor: DebugMonitor
+        :type interval: float
+        """
+        self.monitor = monitor
+        self.interval = float(interval)
+        self.stream = stream or sys.stderr
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.__worker, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+
+    def __worker(self):
+        seen = self.monitor.event_count
+        name = self.monitor.device.name
+        while not self.stop_event.wait(self.interval):
+            events = self.monitor.since(seen)
+            seen = self.monitor.event_count
+            lines = [f'{time_ns / 1e9:.6f} {message}' for time_ns, message in events]
+            lines.append(f'[{name}] {format_sample(self.monitor.latest())}')
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+
+
+class TkViewer:
+    def __init__(self, monitor: DebugMonitor, refresh_ms: int = 200, lines: int = 200):
+        """
+        Tk window with worker state, queue sizes and the latest trace events of monitor.\n
+        Refreshes with after(refresh_ms) in its own thread, no busy loop.
+        :type monitor: DebugMonitor
+        :type refresh_ms: int
+        :type lines: int
+        """
+        self.monitor = monitor
+        self.refresh_ms = int(refresh_ms)
+        self.lines = int(lines)
+        self.root_debugger = None
+        self.debug_thread = threading.Thread(target=self.debugger, daemon=True)
+        self.debug_thread.start()
+
+    def debugger(self):
+        import tkinter as tk
+
+        device = self.monitor.device
+        self.root_debugger = tk.Tk()
+        self.root_debugger.geometry('480x420')
+        self.root_debugger.title(f'DEBUGGER: {device.program_name}:{device.name}')
+
+        self.label_name = tk.Label(self.root_debugger, text=f'{device.program_name}:{device.name}',
+                                   font=('Helvetica bold', 10))
+        self.label_name.grid(column=0, row=0, columnspan=3, sticky="nsew")
+
+        tk.Label(self.root_debugger, width=10, text="Phase", font=('Helvetica bold', 10)).grid(column=1, row=1)
+        tk.Label(self.root_debugger, width=10, text="Running", font=('Helvetica bold', 10)).grid(column=2, row=1)
+        tk.Label(self.root_debugger, width=10, text="Send Worker", font=('Helvetica bold', 15)).grid(column=0, row=2)
+        tk.Label(self.root_debugger, width=10, text="Rec Worker", font=('Helvetica bold', 15)).grid(column=0, row=3)
+        self.label_status_send_phase = tk.Label(self.root_debugger, width=10, bg="gray80")
+        self.label_status_send_phase.grid(column=1, row=2)
+        self.label_status_send_run = tk.Label(self.root_debugger, width=10, bg="gray80")
+        self.label_status_send_run.grid(column=2, row=2)
+        self.label_status_rec_phase = tk.Label(self.root_debugger, width=10, bg="gray80")
+        self.label_status_rec_phase.grid(column=1, row=3)
+        self.label_status_rec_run = tk.Label(self.root_debugger, width=10, bg="gray80")
+        self.label_status_rec_run.grid(column=2, row=3)
+
+        self.label_queues = tk.Label(self.root_debugger, font=('Helvetica bold', 12))
+        self.label_queues.grid(column=0, row=4, columnspan=3)
+        self.text_trace = tk.Text(self.root_debugger, height=16, width=64, font=('Courier', 8))
+        self.text_trace.grid(column=0, row=5, columnspan=3, sticky="nsew")
+        self.root_debugger.grid_rowconfigure(5, weight=1)
+        self.root_debugger.grid_columnconfigure(0, weight=1)
+
+        self.seen = self.monitor.event_count
+        self.refresh()
+        self.root_debugger.mainloop()
+
+    def refresh(self):
+        sample = self.monitor.latest()
+        self.label_status_send_phase.configure(bg=PHASE_COLORS.get(sample["send_worker_phase"], "gray80"))
+        self.label_status_rec_phase.configure(bg=PHASE_COLORS.get(sample["rec_worker_phase"], "gray80"))
+        for label, alive in ((self.label_status_send_run, sample["send_thread_alive"]),
+                             (self.label_status_rec_run, sample["receive_thread_alive"])):
+            label.configure(bg="red" if alive is None else "green" if alive else "yellow")
+        self.label_queues.configure(text=f'Send Queue: {sample["send_q"]}   Receive Queue: {sample["receive_q"]}   '
+                                         f'In flight: {sample["in_flight"]}')
+
+        events = self.monitor.since(self.seen)
+        self.seen = self.monitor.event_count
+        if events:
+            self.text_trace.insert("end", "".join(f'{message}\n' for _, message in events[-self.lines:]))
+            # Keep the last lines only
+            self.text_trace.delete("1.0", f'end-{self.lines + 1}l')
+            self.text_trace.see("end")
+        self.root_debugger.after(self.refresh_ms, self.refresh)
@@ -0,0 +1,178 @@
+import selectors
+import socket
+import threading
+import time
+
+
+class DevicePool:
+    def __init__(self, devices: list = (), debug: bool = False):
+        """
+        Runs the send and receive work of many USB/Wi-Fi ConnectionOrganisers in one thread.\n
+        All connections are watched by one selectors loop instead of two threads per device.
+        Devices take turns: every round each device writes at most one batch (limited by its send window),
+        so a busy device cannot starve the others.\n
+        Set the pool before connecting: ConnectionOrganiser(..., pool=pool) or pool.add(device).
+        Devices without a file descriptor (OPC-UA, Bluetooth, serial ports on Windows) keep their own threads.\n
+        Callbacks of the devices (handle_message, GPIOlib.on_change) run in the pool thread and must not block.
+        :type devices: list
+        :type debug: bool
+        """
+        self.debug = debug
+        self.devices: list = []
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.thread: (threading.Thread, None) = None
+        self.running = False
+        self.sleeping = False  # Loop waits in select(), send() has to wake it up
+        # Written by wake() to interrupt select()
+        self.wakeup_receive, self.wakeup_send = socket.socketpair()
+        self.wakeup_receive.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_receive, selectors.EVENT_READ, None)
+        for device in devices:
+            self.add(device)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def add(self, device):
+        """
+        Run device in this pool from its next connect()
+        """
+        device.pool = self
+
+    def attach(self, device) -> bool:
+        """
+        Called by ConnectionOrganiser.connect(): watch the connection of device.\n
+        Returns False if device can not run in the pool, it starts its own threads then.
+        :rtype: bool
+        """
+        fileno = device.fileno()
+        if fileno is None:
+            return False
+        with self.lock:
+            try:
+                self.selector.register(fileno, selectors.EVENT_READ, device)
+            except (ValueError, OSError) as e:
+                if self.debug:
+                    print(f'ERROR [{e}]: DevicePool attach() [{device.name}]')
+                return False
+            self.devices.append(device)
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self.__worker, daemon=True)
+                self.thread.start()
+        if self.debug:
+            print(f'Info: DevicePool attach [{device.name}], {len(self.devices)} devices')
+        self.wake()
+        return True
+
+    def detach(self, device):
+        """
+        Stop watching device, called by ConnectionOrganiser.disconnect() before the connection is closed
+        """
+        with self.lock:
+            if device not in self.devices:
+                return
+            self.devices.remove(device)
+            for key in list(self.selector.get_map().values()):
+                if key.data is device:
+                    self.selector.unregister(key.fileobj)
+        if self.debug:
+            print(f'Info: DevicePool detach [{device.name}], {len(self.devices)} devices')
+        self.wake()
+
+    def wake(self):
+        """
+        Interrupt select() so new send requests go out right away
+        """
+        if self.sleeping:
+            try:
+                self.wakeup_send.send(b"\0")
+            except (BlockingIOError, OSError):
+                # Buffer full, the loop is woken up already
+                pass
+
+    def close(self):
+        """
+        Disconnect every device and stop the pool thread
+        """
+        for device in list(self.devices):
+            device.disconnect()
+        self.running = False
+        self.sleeping = True
+        self.wake()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(2)
+
+    def __timeout(self, devices: list) -> (float, None):
+        """
+        Private function.\n
+        select() timeout: until the first ack timeout of a blocked send window
+        """
+        timeouts = [timeout for timeout in (device.send_timeout() for device in devices) if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def __worker(self):
+        """
+        Private function.\n
+        Pool thread: receive from every readable device, then one send step per device
+        """
+        first = 0
+        while self.running:
+            with self.lock:
+                devices = list(self.devices)
+            if not devices:
+                with self.lock:
+                    if not self.devices:
+                        self.running = False
+                        break
+                continue
+
+            # Round robin, a different device goes first every round
+            first = (first + 1) % len(devices)
+            devices = devices[first:] + devices[:first]
+            sent = False
+            for device in devices:
+                if device.send_step():
+                    sent = True
+
+            if sent:
+                timeout = 0
+            else:
+                # Sleep in select(), send() wakes the loop up from now on
+                self.sleeping = True
+                if any(device.send_carry or not device.send_q.empty() for device in devices):
+                    timeout = self.__timeout(devices)
+                    if timeout is None:
+                        timeout = 0
+                else:
+                    timeout = None
+
+            try:
+                events = self.selector.select(timeout)
+            except (ValueError, OSError) as e:
+                # A device was closed while selecting, it is detached on the next round
+                if self.debug:
+                    print(f'ERROR [{e}]: DevicePool select()')
+                time.sleep(0.01)
+                events = []
+            self.sleeping = False
+
+            for key, _ in events:
+                device = key.data
+                if device is None:
+                    try:
+                        while self.wakeup_receive.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                if device.connected:
+                    device.receive_step()
+
+            for device in devices:
+                if not device.connected:
+                    self.detach(device)
+        if self.debug:
+            print("END DevicePool")
@@ -0,0 +1,203 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .timer import Timer
+
+# Always counted, see DeviceMetrics
+COUNTERS = (
+    "commands_sent",
+    "bytes_out",
+    "bytes_in",
+    "messages_in",
+    "acks",
+    "ack_timeouts",
+    "send_errors",
+    "parse_errors",
+    "connects",
+    "reconnects",
+    "connections_lost",
+    "opc_calls",
+    "opc_errors",
+)
+HIGH_WATER_MARKS = ("send_q_max", "receive_q_max", "in_flight_max")
+# Timer sections (ns)
+LATENCIES = ("ack_rtt", "opc_read", "opc_write")
+
+HELP = {
+    "commands_sent": "Commands written to the device",
+    "bytes_out": "Bytes written to the device",
+    "bytes_in": "Bytes received from the device",
+    "messages_in": "Lines and binary reports received, acks not included",
+    "acks": "Acks received for commands in flight",
+    "ack_timeouts": "Commands dropped from the send window after ack_timeout",
+    "send_errors": "Failed transport writes",
+    "parse_errors": "Broken input reports, CRC errors and receive buffer overflows",
+    "connects": "Successful connects",
+    "reconnects": "Successful automatic reconnects",
+    "connections_lost": "Connections closed because of a transport error",
+    "opc_calls": "OPC-UA service calls",
+    "opc_errors": "Failed OPC-UA service calls",
+    "send_q_max": "High-water mark of the send queue",
+    "receive_q_max": "High-water mark of the receive queue",
+    "in_flight_max": "High-water mark of commands waiting for their ack",
+    "send_q": "Requests in the send queue",
+    "receive_q": "Messages in the receive queue",
+    "in_flight": "Commands waiting for their ack",
+    "connected": "1 while connected",
+    "ack_rtt": "Time from writing a command until its ack",
+    "opc_read": "Duration of OPC-UA read calls",
+    "opc_write": "Duration of OPC-UA write calls",
+}
+
+
+class DeviceMetrics:
+    def __init__(self):
+        """
+        Counters, high-water marks and latency histograms of one ConnectionOrganiser.\n
+        The hot path counters are updated inline without an extra lock: commands_sent, bytes_out, acks,
+        ack_timeouts and in_flight_max under the send_window_cond of the organiser,
+        bytes_in and messages_in by the receive worker only.
+        Counters written from several threads (OPC calls, errors, connects) go through count(),
+        the send_q_max and receive_q_max high-water marks through high_water().
+        AsyncConnectionOrganiser updates all of them from its event loop. Latencies are Timer sections in ns.
+        """
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        for name in COUNTERS + HIGH_WATER_MARKS:
+            setattr(self, name, 0)
+        self.timer = Timer("metrics")
+        self.ack_rtt = self.timer.get_section("ack_rtt")
+        self.opc_read = self.timer.get_section("opc_read")
+        self.opc_write = self.timer.get_section("opc_write")
+
+    def count(self, name: str, amount: int = 1):
+        """
+        Add amount to counter name, safe from any thread
+        :type name: str
+        :type amount: int
+        """
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def high_water(self, name: str, value: int):
+        """
+        Raise high-water mark name to value, safe from any thread. Lock free unless value is a new maximum
+        :type name: str
+        :type value: int
+        """
+        if value > getattr(self, name):
+            with self.lock:
+                if value > getattr(self, name):
+                    setattr(self, name, value)
+
+    def reset(self):
+        self.__init__()
+
+    def snapshot(self) -> dict:
+        """
+        Counters, high-water marks and latency reports as dict
+        :rtype: dict
+        """
+        uptime = time.monotonic() - self.started
+        snapshot = {name: getattr(self, name) for name in COUNTERS + HIGH_WATER_MARKS}
+        snapshot["uptime_s"] = uptime
+        snapshot["commands_per_s"] = self.commands_sent / uptime if uptime > 0 else 0.0
+        snapshot["latency"] = self.timer.report()
+        return snapshot
+
+
+def prometheus_text(devices: list, prefix: str = "px_device") -> str:
+    """
+    Prometheus text exposition (format 0.0.4) of the metrics() of every device.\n
+    Counters end with _total, latencies are histograms in seconds with the buckets of the Timer histogram.
+    :type devices: list
+    :type prefix: str
+    :rtype: str
+    """
+    samples = []
+    for device in devices:
+        samples.append((device.name, device.metrics(), device.stats.timer))
+
+    lines = []
+
+    def family(name: str, kind: str, rows: list):
+        metric = f'{prefix}_{name}'
+        lines.append(f'# HELP {metric} {HELP[name.replace("_total", "").replace("_seconds", "")]}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for suffix, labels, value in rows:
+            label_text = ",".join(f'{key}="{escape(str(label))}"' for key, label in labels)
+            lines.append(f'{metric}{suffix}{{{label_text}}} {value}')
+
+    for name in COUNTERS:
+        family(f'{name}_total', "counter", [("", [("device", device)], metrics[name])
+                                            for device, metrics, _ in samples])
+    for name in HIGH_WATER_MARKS + ("send_q", "receive_q", "in_flight", "connected"):
+        family(name, "gauge", [("", [("device", device)], int(metrics[name]))
+                               for device, metrics, _ in samples])
+    for name in LATENCIES:
+        rows = []
+        for device, _, timer in samples:
+            section = timer.get_section(name)
+            with section.lock:
+                buckets = section.histogram.buckets()
+                count, total = section.count, section.total
+            seen = 0
+            for upper_ns, bucket_count in buckets:
+                seen += bucket_count
+                rows.append(("_bucket", [("device", device), ("le", f'{upper_ns / 1e9:.9g}')], seen))
+            rows.append(("_bucket", [("device", device), ("le", "+Inf")], count))
+            rows.append(("_sum", [("device", device)], f'{total / 1e9:.9g}'))
+            rows.append(("_count", [("device", device)], count))
+        family(f'{name}_seconds', "histogram", rows)
+    return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsServer:
+    def __init__(self, devices: list = (), host: str = "127.0.0.1", port: int = 9108):
+        """
+        Serves prometheus_text() of devices on http://host:port/metrics from a daemon thread.\n
+        Binds to localhost by default, port 0 picks a free port (see self.port).
+        :type devices: list
+        :type host: str
+        :type port: int
+        """
+        self.devices: list = list(devices)
+        metrics_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = prometheus_text(list(metrics_server.devices)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def add(self, device):
+        if device not in self.devices:
+            self.devices.append(device)
+
+    def remove(self, device):
+        if device in self.devices:
+            self.devices.remove(device)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
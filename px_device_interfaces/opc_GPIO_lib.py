@@ -1,5 +1,6 @@
 import time
 import os
+from opcua import ua
 
 # PX libs
 
@@ -7,6 +8,30 @@ from . import connection_organiser_with_opc as conorg
 from . import timer
 
 
+def monitored_item_request(node_id: ua.NodeId, client_handle: int,
+                           sampling_interval: float) -> ua.MonitoredItemCreateRequest:
+    """
+    Request of a Value data change item for Subscription.create_monitored_items(), built from public ua types
+    because subscribe_data_change() has no per item sampling interval
+    :type client_handle: int
+    :type sampling_interval: float      # ms
+    :rtype: ua.MonitoredItemCreateRequest
+    """
+    item = ua.ReadValueId()
+    item.NodeId = node_id
+    item.AttributeId = ua.AttributeIds.Value
+    parameters = ua.MonitoringParameters()
+    parameters.ClientHandle = client_handle
+    parameters.SamplingInterval = sampling_interval
+    parameters.QueueSize = 0
+    parameters.DiscardOldest = True
+    request = ua.MonitoredItemCreateRequest()
+    request.ItemToMonitor = item
+    request.MonitoringMode = ua.MonitoringMode.Reporting
+    request.RequestedParameters = parameters
+    return request
+
+
 class GPIOlib(conorg.ConnectionOrganiser):
     def __init__(self, device_name: str, firmware: str = None, opc_node_addr: str = "ns=3;", **kwargs):
         """
@@ -25,11 +50,18 @@ class GPIOlib(conorg.ConnectionOrganiser):
         self.input_data: dict = {}
         self.output_data: dict = {}
         self.inout_label: dict = {}
+        # Subscription mode: output modules are mirrored into output_data by data change notifications
+        self.use_subscription = False
+        self.publishing_interval: float = 100  # ms
+        self.sampling_interval: (float, None) = None  # ms, None == publishing_interval
+        self.subscription = None
+        self.subscription_nodes: dict = {}  # NodeId -> module
         self.name = device_name
         self.program_name_GPIOlib = "GPIO_Lib"
         self.configure_io_file_path = "sys_files/" + self.program_name_GPIOlib + "/" + self.name + ".data"
         super().__init__(device_name=device_name, firmware=firmware, **kwargs)
         self.configure_io()
+        self.subscribe_outputs()
         self.root = self.connection_opc_client.get_root_node() or None
 
     def open_config_window(self):
@@ -38,6 +70,83 @@ class GPIOlib(conorg.ConnectionOrganiser):
         """
         super().open_config_window()
         self.configure_io()
+        self.subscribe_outputs()
+
+    def connect(self):
+        super().connect()
+        self.subscribe_outputs()
+
+    def disconnect(self):
+        self.unsubscribe_outputs()
+        super().disconnect()
+
+    def connection_lost(self):
+        # The subscription died with the session, connect() creates a new one
+        self.subscription = None
+        self.subscription_nodes = {}
+        super().connection_lost()
+
+    def resync(self):
+        """
+        Write the whole input_data image to the SPS again after a reconnect
+        """
+        self.send_many([[self.node_id(module), value] for module, value in self.input_data.items()], "byte")
+
+    def node_id(self, module: str) -> str:
+        """
+        OPC-UA node id of a module array
+        :type module: str
+        :rtype: str
+        """
+        return f'{self.opc_node_addr}s="{module}"."Array"'
+
+    def subscribe_outputs(self) -> bool:
+        """
+        Mirror every output module (opcArrayOut/opcArrayInOut) into output_data with one OPC-UA subscription.\n
+        read()/read_all()/get() answer from output_data afterwards, without a network round trip.\n
+        Only active with use_subscription, publishing_interval and sampling_interval are in ms.
+        :rtype: bool
+        """
+        if not self.connected or not self.use_subscription or not self.output_data:
+            return False
+        self.unsubscribe_outputs()
+        publishing_interval = float(self.publishing_interval)
+        sampling_interval = float(self.sampling_interval or publishing_interval)
+        try:
+            self.subscription = self.connection_opc_client.create_subscription(
+                publishing_interval, SubscriptionHandler(self))
+            requests = []
+            # Fresh subscription: client handles 1..n are unique, as create_monitored_items() requires
+            for client_handle, module in enumerate(self.output_data.keys(), 1):
+                client_node = self.connection_opc_client.get_node(self.node_id(module))
+                self.subscription_nodes[client_node.nodeid] = module
+                requests.append(monitored_item_request(client_node.nodeid, client_handle, sampling_interval))
+            results = self.subscription.create_monitored_items(requests)
+        except Exception as e:
+            print(f'ERROR [{e}]: GPIO_Lib subscribe_outputs() [{self.name}]')
+            self.unsubscribe_outputs()
+            return False
+
+        for request, result in zip(requests, results):
+            if isinstance(result, ua.StatusCode):
+                print(f'ERROR [{result}]: GPIO_Lib subscribe_outputs() '
+                      f'[{self.name}, {request.ItemToMonitor.NodeId.to_string()}]')
+        if self.debug:
+            self.trace(f'Info: Subscribed {len(requests)} modules [{self.name}]')
+        return True
+
+    def unsubscribe_outputs(self):
+        """
+        End the subscription mode, read()/get() poll the device again
+        """
+        subscription, self.subscription = self.subscription, None
+        self.subscription_nodes = {}
+        if subscription:
+            try:
+                subscription.delete()
+            except Exception as e:
+                if self.debug:
+                    self.trace(f'ERROR [{e}]: GPIO_Lib unsubscribe_outputs() [{self.name}]')
 
     # TODO open_io_config_window
     @staticmethod
@@ -58,7 +167,7 @@ class GPIOlib(conorg.ConnectionOrganiser):
             with open(self.configure_io_file_path, "w") as file:
                 file.write(
                     "# Syntax Atmega\n"
-                    "# >{input/output/input_pullup/servo{number}} {pin number on Arduino} {Custom Name}\n"
+                    "# >{input/output/output_analog/input_pullup/servo{number}} {pin number on Arduino} {Custom Name} [{deadband}[:{interval ms}]]\n"
                     "#\n"
                     "# Syntax SPS\n"
                     "# >{opcArrayIn/opcArrayIn} {amount off pin in this channel} {Custom name}\n"
@@ -77,13 +186,13 @@ class GPIOlib(conorg.ConnectionOrganiser):
                 while configure_io_line:
                     configure_io_line = configure_io_line.replace("\n", "")
                     if self.debug:
-                        print(f'Config Line: {configure_io_line}')
+                        self.trace(f'Config Line: {configure_io_line}')
                     if configure_io_line.startswith(">"):
                         configure_io_line = configure_io_line.replace(">", "")
                         try:
                             use, pin_num, name = configure_io_line.split(" ")
                             if self.debug:
-                                print(f'USE: {use}, PIN_NUM: {pin_num}, NAME: {name}')
+                                self.trace(f'USE: {use}, PIN_NUM: {pin_num}, NAME: {name}')
                         except ValueError:
                             use = None
                             pin_num = None
@@ -151,15 +260,13 @@ class GPIOlib(conorg.ConnectionOrganiser):
 
     def write_all(self):
         """
-        Write all OPC registers to SPS
+        Write all OPC registers to SPS with one Write service call
         """
         if not self.connected:
             return
 
         if not self.auto_io:
-            for module in self.input_data.keys():
-                value = self.input_data[module]
-                self.send([f'ns=3;s="{module}"."Array"', value], "byte")
+            self.send_many([[self.node_id(module), value] for module, value in self.input_data.items()], "byte")
 
     def write(self, module: str, value: list | None = None, force: bool = False):
         """
@@ -181,10 +288,10 @@ class GPIOlib(conorg.ConnectionOrganiser):
         if value:
             self.input_data[module] = value
             if self.auto_io or force:
-                self.send([f'ns=3;s="{module}"."Array"', value], "byte")
+                self.send([self.node_id(module), value], "byte")
         else:
             if self.debug:
-                print(f"ERROR: No value set [{self.name}]")
+                self.trace(f"ERROR: No value set [{self.name}]")
 
     def set(self, module: str, pin: int, value: int, force: bool = False):
         """
@@ -225,7 +332,7 @@ class GPIOlib(conorg.ConnectionOrganiser):
 
         module = self.__check_label(module, "in")
         if module:
-            data = self.request_from_device(f'ns=3;s="{module}"."Array"')
+            data = self.request_from_device(self.node_id(module))
             if data:
                 if not pin is None:
                     return data[pin]
@@ -233,14 +340,19 @@ class GPIOlib(conorg.ConnectionOrganiser):
 
     def read_all(self):
         """
-        Read all OPC registers from SPS
+        Read all OPC registers from SPS with one Read service call
         """
         if not self.connected:
             return
 
+        # Subscription keeps output_data current
+        if self.subscription:
+            return
+
         if not self.auto_io:
-            for module in self.output_data.keys():
-                data = self.request_from_device(f'ns=3;s="{module}"."Array"')
+            modules = list(self.output_data.keys())
+            values = self.request_many([self.node_id(module) for module in modules])
+            for module, data in zip(modules, values or []):
                 if data:
                     self.output_data[module] = data
 
@@ -256,9 +368,9 @@ class GPIOlib(conorg.ConnectionOrganiser):
             return
 
         module = self.__check_label(module, "out")
-        if module:
+        if module and not self.subscription:
             if self.auto_io or force:
-                data = self.request_from_device(f'ns=3;s="{module}"."Array"')
+                data = self.request_from_device(self.node_id(module))
                 if data:
                     self.output_data[module] = data
         return self.output_data.get(module, None)
@@ -289,3 +401,23 @@ class GPIOlib(conorg.ConnectionOrganiser):
         module = self.__check_label(module, "out")
         self.read(module, force=force)
         return int(self.output_data.get(module, [None for _ in range(16)])[pin])
+
+
+class SubscriptionHandler:
+    def __init__(self, gpio: GPIOlib):
+        """
+        Receives the data change notifications of GPIOlib.subscribe_outputs() and writes them to output_data
+        :type gpio: GPIOlib
+        """
+        self.gpio = gpio
+
+    def datachange_notification(self, node, val, data):
+        module = self.gpio.subscription_nodes.get(node.nodeid)
+        if module is not None and val is not None:
+            self.gpio.output_data[module] = list(val)
+            if self.gpio.debug:
+                self.gpio.trace(f'Info: Data change [{module}]: {val} [{self.gpio.name}]')
+
+    def status_change_notification(self, status):
+        if self.gpio.debug:
+            self.gpio.trace(f'Info: Subscription status [{status}] [{self.gpio.name}]')
@@ -0,0 +1,92 @@
+import threading
+
+import opcua
+
+
+class OPCSession:
+    # Process-wide shared sessions: opc_client_address -> OPCSession
+    sessions: dict = {}
+    sessions_lock = threading.Lock()
+
+    def __init__(self, address: str, session_timeout: int = 30000):
+        """
+        One opcua.Client session, shared by every ConnectionOrganiser with the same opc_client_address.\n
+        Use acquire()/release(), the session is opened by the first user and closed by the last.\n
+        The registered node cache lives here as well, registered handles belong to the session.
+        :type address: str
+        :type session_timeout: int
+        """
+        self.address = address
+        self.client = opcua.Client(address)
+        self.client.session_timeout = session_timeout
+        self.users: int = 0
+        self.shared = False
+        self.nodes: dict = {}  # node_id -> registered Node
+        self.variant_types: dict = {}  # node_id -> VariantType of its DataType
+        self.lock = threading.Lock()  # Guards nodes and variant_types
+
+    def __repr__(self):
+        return f'OPCSession({self.address!r}, users={self.users})'
+
+    @classmethod
+    def acquire(cls, address: str, shared: bool = True) -> "OPCSession":
+        """
+        Session for address, connects it for the first user.\n
+        shared=False always opens a new session for the caller alone.
+        Raises the connect error of opcua.Client.
+        :type address: str
+        :type shared: bool
+        :rtype: OPCSession
+        """
+        if not shared:
+            session = cls(address)
+            session.client.connect()
+            session.users = 1
+            return session
+
+        with cls.sessions_lock:
+            session = cls.sessions.get(address)
+            if session is None:
+                session = cls(address)
+                session.shared = True
+                session.client.connect()
+                cls.sessions[address] = session
+            session.users += 1
+            return session
+
+    def release(self):
+        """
+        Drop one user, the last one unregisters the cached nodes and closes the session.\n
+        Errors while closing are raised after the session is removed from the pool.
+        """
+        with self.sessions_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            if self.shared and self.sessions.get(self.address) is self:
+                del self.sessions[self.address]
+        try:
+            self.clear_nodes()
+        finally:
+            self.client.disconnect()
+
+    def discard(self):
+        """
+        Take a broken session out of the pool, the next acquire() opens a new one.\n
+        Current users keep it until they release() it.
+        """
+        with self.sessions_lock:
+            if self.shared and self.sessions.get(self.address) is self:
+                del self.sessions[self.address]
+
+    def clear_nodes(self):
+        """
+        Unregister and forget all cached nodes of the session
+        """
+        with self.lock:
+            registered = [client_node for client_node in self.nodes.values()
+                          if getattr(client_node, "basenodeid", None) is not None]
+            self.nodes.clear()
+            self.variant_types.clear()
+        if registered:
+            self.client.unregister_nodes(registered)
@@ -0,0 +1,60 @@
+import threading
+from array import array
+
+try:
+    import numpy
+except ImportError:  # optional, history() falls back to array
+    numpy = None
+
+
+class PinHistory:
+    def __init__(self, size: int = 1024):
+        """
+        Fixed size ring buffer of (time.monotonic_ns(), value) samples of one pin.\n
+        Memory is allocated once: 12 bytes per sample.
+        :type size: int
+        """
+        size = int(size)
+        if size < 1:
+            raise ValueError(f'history size must be at least 1, not {size}')
+        self.size = size
+        self.times = array("q", bytes(array("q").itemsize * size))
+        self.values = array("i", bytes(array("i").itemsize * size))
+        self.index: int = 0  # Next slot to write
+        self.count: int = 0  # Samples stored, up to size
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp: int, value: int):
+        with self.lock:
+            self.times[self.index] = timestamp
+            self.values[self.index] = value
+            self.index = (self.index + 1) % self.size
+            if self.count < self.size:
+                self.count += 1
+
+    def clear(self):
+        with self.lock:
+            self.index = self.count = 0
+
+    def samples(self) -> tuple:
+        """
+        (times, values) oldest first.\n
+        With NumPy: int64/int32 arrays, views on the buffer (no copy) as long as it did not wrap around yet,
+        those views see later overwrites. Without NumPy: copies as array("q")/array("i").
+        :rtype: tuple
+        """
+        with self.lock:
+            count, index = self.count, self.index
+            if numpy is not None:
+                times = numpy.frombuffer(self.times, dtype=numpy.int64)
+                values = numpy.frombuffer(self.values, dtype=numpy.int32)
+                if count < self.size:
+                    return times[:count], values[:count]
+                return numpy.concatenate((times[index:], times[:index])), \
+                    numpy.concatenate((values[index:], values[:index]))
+            if count < self.size:
+                return self.times[:count], self.values[:count]
+            return self.times[index:] + self.times[:index], self.values[index:] + self.values[:index]
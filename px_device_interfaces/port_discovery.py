@@ -0,0 +1,186 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+import serial.tools.list_ports
+
+from . import wire_protocol
+
+
+def serial_ports() -> list:
+    """
+    Device names of all serial ports of this system (COM3, /dev/ttyACM0, ...)
+    :rtype: list
+    """
+    return [port.device for port in serial.tools.list_ports.comports()]
+
+
+def is_report(message: str) -> bool:
+    """
+    True for a text input report (d:13:1, a:3:512) of a board that is still configured
+    :type message: str
+    :rtype: bool
+    """
+    kind, separator, _ = message.partition(":")
+    return bool(separator) and kind in wire_protocol.REPORT_KIND.values()
+
+
+def probe_port(port: str, baud: int = 115200, disable_dsrdtr: bool = True, boot_time: float = 2.2,
+               ready_timeout: float = 1, probe_interval: float = 0.05, firmware_timeout: float = 2,
+               firmwares: set = None) -> (str, None):
+    """
+    Open port, wait for the firmware like ConnectionOrganiser.wait_ready() and ask it for its name with "M100".\n
+    The port is opened exclusive: a port in use (locked by a connection of this or another process) is busy
+    and never written to. Input reports of a board that did not reset are skipped,
+    with firmwares only one of these names counts as answer.\n
+    Returns the firmware name or None if the port is busy, can not be opened or nothing answers.
+    :type port: str
+    :type baud: int
+    :type disable_dsrdtr: bool
+    :type boot_time: float
+    :type ready_timeout: float
+    :type probe_interval: float
+    :type firmware_timeout: float
+    :type firmwares: set
+    :rtype: (str, None)
+    """
+    connection = serial.Serial()
+    connection.port = port
+    connection.exclusive = True
+    connection.baudrate = int(baud)
+    connection.timeout = float(probe_interval)
+    connection.write_timeout = float(probe_interval)
+    if disable_dsrdtr:
+        connection.dsrdtr = None
+        connection.setRTS(False)
+        connection.setDTR(False)
+    reader = wire_protocol.FrameReader(256)
+
+    def messages(until: float):
+        # Text lines from the port until the deadline, the probe never switches to binary frames
+        while time.monotonic() < until:
+            data = connection.read(max(1, connection.in_waiting))
+            if data:
+                reader.feed(data)
+                for frame in reader.frames():
+                    message = wire_protocol.decode(frame, reader.binary)
+                    if isinstance(message, str):
+                        yield message
+                return
+
+    try:
+        connection.open()
+        start = time.monotonic()
+        boot_time = float(boot_time) if not disable_dsrdtr else 0.0
+        deadline = start + boot_time + float(ready_timeout)
+        ready = False
+        while not ready and time.monotonic() < deadline:
+            if time.monotonic() - start >= boot_time:
+                connection.write(b"\n")
+            for _ in messages(min(deadline, time.monotonic() + float(probe_interval))):
+                ready = True
+        if not ready:
+            return None
+
+        connection.reset_input_buffer()
+        connection.write(b"M100\n")
+        deadline = time.monotonic() + float(firmware_timeout)
+        while time.monotonic() < deadline:
+            for message in messages(deadline):
+                if message == ">" or is_report(message):
+                    continue
+                if firmwares is None or message in firmwares:
+                    return message
+        return None
+    except (serial.SerialException, OSError, ValueError):
+        return None
+    finally:
+        try:
+            connection.close()
+        except (serial.SerialException, OSError):
+            pass
+
+
+def discover_ports(ports: list = None, baud: int = 115200, max_workers: int = None, **probe_options) -> dict:
+    """
+    Probe all ports at the same time (one thread per port) with probe_port().\n
+    The whole scan takes about as long as one probe.
+    ports=None scans every serial port of the system, probe_options are passed to probe_port().
+    :type ports: list
+    :type baud: int
+    :type max_workers: int
+    :rtype: dict    # port -> firmware name, only ports that answered
+    """
+    ports = serial_ports() if ports is None else list(ports)
+    if not ports:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(ports)) as executor:
+        firmwares = executor.map(lambda port: probe_port(port, baud, **probe_options), ports)
+        return {port: firmware for port, firmware in zip(ports, firmwares) if firmware is not None}
+
+
+def locate(devices: list, ports: list = None, save: bool = True) -> dict:
+    """
+    Find the serial port of every device that is not connected by its firmware name.\n
+    All ports are probed at once (discover_ports()) at the usb_baud of the devices, ports of connected devices
+    and ports in use elsewhere (see probe_port()) are skipped. A device keeps its usb_port if the right firmware
+    answers there, otherwise it gets the first free port that answered with its firmware. Found devices are switched to type USB and, with save,
+    written to their settings file.\n
+    Devices without firmware can not be located.
+    :type devices: list
+    :type ports: list
+    :type save: bool
+    :rtype: dict    # device name -> port, only located devices
+    """
+    wanted = []
+    for device in devices:
+        if device.connected:
+            continue
+        if not device.firmware:
+            print(f'ERROR: No firmware set, port can not be located [{device.name}]')
+            continue
+        wanted.append(device)
+    if not wanted:
+        return {}
+
+    busy = {device.usb_port for device in devices if device.connected and device.type == "USB"}
+    ports = [port for port in (serial_ports() if ports is None else ports) if port not in busy]
+
+    # One scan per baud rate (and DTR handling), ports that answered are not probed again.
+    # The probe options come from the devices of the group, the most patient value of each.
+    groups: dict = {}
+    for device in wanted:
+        key = (int(device.usb_baud or 115200), device.disable_dsrdtr)
+        groups.setdefault(key, []).append(device)
+    found: dict = {}
+    for (baud, disable_dsrdtr), group in groups.items():
+        found.update(discover_ports(
+            [port for port in ports if port not in found], baud,
+            disable_dsrdtr=disable_dsrdtr,
+            boot_time=max(float(device.boot_time) for device in group),
+            ready_timeout=max(float(device.ready_timeout) for device in group),
+            probe_interval=min(float(device.probe_interval) for device in group),
+            firmware_timeout=max(float(device.firmware_timeout) for device in group),
+            firmwares={device.firmware for device in group}))
+        if any(device.debug for device in group):
+            print(f'Info: Ports at {baud} baud: {found}')
+
+    located: dict = {}
+    claimed = set()
+    for device in sorted(wanted, key=lambda device: found.get(device.usb_port) != device.firmware):
+        candidates = [port for port, firmware in found.items() if firmware == device.firmware and port not in claimed]
+        if not candidates:
+            print(f'ERROR: No port with firmware {device.firmware} found [{device.name}]')
+            continue
+        port = device.usb_port if device.usb_port in candidates else candidates[0]
+        claimed.add(port)
+        located[device.name] = port
+        device.type = "USB"
+        device.usb_port = port
+        if not device.usb_baud:
+            device.usb_baud = 115200
+        if save:
+            device.save_settings()
+        if device.debug:
+            print(f'Info: Located on {port} [{device.name}]')
+    return located
@@ -0,0 +1,528 @@
+import heapq
+import random
+import re
+import selectors
+import socket
+import threading
+import time
+from array import array
+
+from . import wire_protocol
+
+# Serial frame of the firmware: start bit, 8 data bits, stop bit
+BITS_PER_BYTE = 10
+MAX_BUF = 64  # Text command buffer of the firmware
+ANALOG_TOLERANCE = 10  # Default deadband of analog inputs
+
+_NUMBER = re.compile(rb"\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+
+
+def parse_number(line: bytes, code: int, default: float) -> float:
+    """
+    parsenumber() of the firmware: value of the first space separated word of line that starts with code.\n
+    Like atof() a word without digits counts as 0.
+    :type line: bytes
+    :type code: int
+    :type default: float
+    :rtype: float
+    """
+    for word in line.split(b" "):
+        if word[:1] == bytes((code,)):
+            match = _NUMBER.match(word, 1)
+            return float(match.group(0)) if match else 0.0
+    return default
+
+
+class SimulatedBoard:
+    def __init__(self, simulator, connection: socket.socket, firmware: str = "GPIO_lib_mega", io_pins: int = None,
+                 latency: float = 0, jitter: float = 0, baud: int = 0):
+        """
+        Emulation of arduino_GPIO_lib.ino on the device end of a socket pair, driven by the Simulator loop.\n
+        Text commands (M0-M7, M100, M110, M999, P1-P7), binary frames, ">" acks and d:/a: input reports
+        behave like the firmware. Pin levels are not real: set_input() sets what digitalRead/analogRead see.\n
+        Every reply is delayed by latency plus a random 0..jitter (s). With baud each byte takes 10 bit times
+        on the line in both directions, like a UART, order is always kept.
+        :type firmware: str
+        :type io_pins: int
+        :type latency: float
+        :type jitter: float
+        :type baud: int
+        """
+        self.simulator = simulator
+        self.connection = connection
+        self.firmware = firmware or "GPIO_lib_mega"
+        self.io_pins = wire_protocol.board_io_pins(self.firmware, io_pins)
+        self.latency = float(latency or 0)
+        self.jitter = float(jitter or 0)
+        self.byte_time = BITS_PER_BYTE / float(baud) if baud and float(baud) > 0 else 0.0
+        self.start = time.monotonic()
+
+        # Firmware state
+        self.buffer = bytearray()  # Text command being received
+        self.frame = bytearray()  # Binary frame being received
+        self.lcd_line: (bytearray, None) = None  # P6 A1 is reading its text line
+        self.binary = False
+        self.use_update = True
+        self.pin_modes = array("i", bytes(array("i").itemsize * self.io_pins))  # 0 none, 1 digital, 2 analog
+        self.reported = array("i", bytes(array("i").itemsize * self.io_pins))  # Last reported input value
+        self.inputs = array("i", bytes(array("i").itemsize * self.io_pins))  # set_input() values
+        self.outputs = array("i", bytes(array("i").itemsize * self.io_pins))  # P2/P4/P7 values
+        self.analog_deadband = array("i", [ANALOG_TOLERANCE] * self.io_pins)
+        self.report_interval = array("i", bytes(array("i").itemsize * self.io_pins))  # ms
+        self.last_report = array("q", bytes(array("q").itemsize * self.io_pins))  # ms
+        self.servos: dict = {}  # servo index -> pin
+        self.servo_values: dict = {}  # servo index -> value
+        self.lcd_text = ""
+        self.commands: int = 0
+
+        # Line timing
+        self.rx_free: float = 0  # Time the receive line is free again
+        self.tx_free: float = 0
+        self.scan_at: (float, None) = None  # Input scan is scheduled
+        self.pending = bytearray()  # Written to the socket as soon as it takes more
+        self.closed = False
+
+    def __repr__(self):
+        return f'SimulatedBoard({self.firmware!r}, io_pins={self.io_pins})'
+
+    def millis(self, now: float) -> int:
+        return int((now - self.start) * 1000)
+
+    # ------------------------- #
+    # Called by the test / user #
+    # ------------------------- #
+
+    def set_input(self, pin: int, value: int):
+        """
+        Value of an input pin as the firmware reports it: digital 0/1 (1 == pin LOW), analog 0-1023.\n
+        Configured inputs are reported like the firmware loop does (deadband and interval of M7).
+        :type pin: int
+        :type value: int
+        """
+        with self.simulator.lock:
+            self.inputs[pin] = value
+            self.schedule_scan(time.monotonic())
+        self.simulator.wake()
+
+    def output(self, pin: int) -> int:
+        """
+        Last value written to pin with P2/P4/P7
+        :type pin: int
+        :rtype: int
+        """
+        return self.outputs[pin]
+
+    # ----------------------- #
+    # Called by the Simulator #
+    # ----------------------- #
+
+    def receive(self, data: bytes, now: float):
+        """
+        Bytes from the host: processed once they went through the line
+        """
+        if self.byte_time:
+            self.rx_free = max(now, self.rx_free) + len(data) * self.byte_time
+            self.simulator.schedule(self.rx_free, self.feed, data)
+        else:
+            self.feed(data, now)
+
+    def emit(self, data: bytes, now: float):
+        """
+        Reply to the host after latency, jitter and the transmit time
+        """
+        if not data:
+            return
+        due = now + self.latency
+        if self.jitter:
+            due += random.uniform(0, self.jitter)
+        if self.byte_time:
+            due = max(due, self.tx_free) + len(data) * self.byte_time
+        elif due < self.tx_free:
+            due = self.tx_free
+        self.tx_free = due
+        if due > now:
+            self.simulator.schedule(due, self.transmit, data)
+        else:
+            self.transmit(data, now)
+
+    def transmit(self, data: bytes, now: float = None):
+        if self.closed:
+            return
+        if self.pending:
+            self.pending += data
+            return
+        try:
+            sent = self.connection.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.simulator.remove(self)
+            return
+        if sent < len(data):
+            self.pending += data[sent:]
+            self.simulator.want_write(self, True)
+
+    def write_pending(self):
+        try:
+            sent = self.connection.send(self.pending)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.simulator.remove(self)
+            return
+        del self.pending[:sent]
+        if not self.pending:
+            self.simulator.want_write(self, False)
+
+    def schedule_scan(self, at: float):
+        if self.scan_at is None or at < self.scan_at:
+            self.scan_at = at
+            self.simulator.schedule(at, self.scan)
+
+    def scan(self, now: float):
+        """
+        Input loop of the firmware: report every configured pin that changed
+        """
+        if self.scan_at is None or self.scan_at > now:
+            return
+        self.scan_at = None
+        if not self.use_update:
+            return
+        millis = self.millis(now)
+        out = bytearray()
+        retry = None
+        for pin in range(self.io_pins):
+            mode = self.pin_modes[pin]
+            if not mode:
+                continue
+            value = self.inputs[pin]
+            if mode == 1:
+                value = 1 if value else 0
+                changed = value != self.reported[pin]
+            else:
+                changed = abs(value - self.reported[pin]) > self.analog_deadband[pin]
+            if not changed:
+                continue
+            due = self.last_report[pin] + self.report_interval[pin]
+            if millis < due:
+                retry = due if retry is None else min(retry, due)
+                continue
+            self.reported[pin] = value
+            self.last_report[pin] = millis
+            out += self.report("d" if mode == 1 else "a", pin, value)
+        self.emit(bytes(out), now)
+        if retry is not None:
+            self.schedule_scan(self.start + retry / 1000)
+
+    # ------------------- #
+    # Firmware emulation  #
+    # ------------------- #
+
+    def ack(self) -> bytes:
+        return wire_protocol.ACK if self.binary else b">\r\n"
+
+    def report(self, kind: str, pin: int, value: int) -> bytes:
+        if self.binary:
+            opcode = wire_protocol.OP_DIGITAL_REPORT if kind == "d" else wire_protocol.OP_ANALOG_REPORT
+            return wire_protocol.encode(opcode, pin, value)
+        return f'{kind}:{pin}:{value}\r\n'.encode()
+
+    def feed(self, data: bytes, now: float):
+        """
+        Serial.read() loop of the firmware
+        """
+        out = bytearray()
+        for byte in data:
+            if self.lcd_line is not None:
+                # P6 A1 takes the next line as LCD text, then acks the command
+                if byte == 0x0A:
+                    self.lcd_text = self.lcd_line.decode("ascii", "replace")
+                    self.lcd_line = None
+                    out += self.ack()
+                else:
+                    self.lcd_line.append(byte)
+                continue
+            if self.frame or (self.binary and not self.buffer and byte & wire_protocol.FRAME_FLAG):
+                self.frame.append(byte)
+                if len(self.frame) == wire_protocol.frame_size(self.frame[0]):
+                    out += self.process_frame(bytes(self.frame), now)
+                    self.frame.clear()
+                    out += self.ack()
+                continue
+            if len(self.buffer) < MAX_BUF - 1:
+                self.buffer.append(byte)
+            if byte in b"\n\r;":
+                self.commands += 1
+                out += self.process_command(bytes(self.buffer), now)
+                self.buffer.clear()
+                if self.lcd_line is None:
+                    out += self.ack()
+        self.emit(bytes(out), now)
+
+    def process_frame(self, frame: bytes, now: float) -> bytes:
+        self.commands += 1
+        if wire_protocol.crc8(frame[:-1]) != frame[-1]:
+            return b"ERROR: crc\r\n"
+        opcode = (frame[0] >> 3) & 0x0F
+        pin = frame[1]
+        value = int.from_bytes(frame[2:-1], "little")
+        return self.pin_command(opcode, pin, value, value & 0xFFFF, value >> 16, now)
+
+    def process_command(self, line: bytes, now: float) -> bytes:
+        out = bytearray()
+        number = lambda code, default=-1: int(parse_number(line, code, default))
+        command = number(ord("M"))
+        pin = number(ord("N"))
+        if command in (0, 1, 3):  # M0 falls through to M1 in the firmware
+            self.set_input_mode(pin, 1, now)
+        elif command == 2:
+            self.set_input_mode(pin, 0, now)
+        elif command == 4:
+            self.set_input_mode(pin, 2, now)
+        elif command == 5:
+            if pin > 0:
+                self.servos[number(ord("A"))] = pin
+        elif command == 7:
+            if 0 <= pin < self.io_pins:
+                deadband, interval = number(ord("D")), number(ord("T"))
+                if deadband >= 0:
+                    self.analog_deadband[pin] = deadband
+                if interval >= 0:
+                    self.report_interval[pin] = interval
+        elif command == 100:
+            out += f'{self.firmware}\r\n'.encode()
+        elif command == 110:
+            self.binary = number(ord("S"), 0) == 1
+            out += b"bin:1\r\n" if self.binary else b"bin:0\r\n"
+        elif command == 999:
+            out += b"#RESET#\r\n"
+
+        command = number(ord("P"))
+        if command == 6:
+            if number(ord("A")) == 1:
+                out += self.ack()
+                self.lcd_line = bytearray()
+            elif number(ord("A")) == 3:
+                self.lcd_text = ""
+        elif command == 7:
+            out += self.pin_command(wire_protocol.OP_DIGITAL_WRITE_MANY, number(ord("B")), 0,
+                                    int(parse_number(line, ord("K"), 0)) & 0xFFFF,
+                                    int(parse_number(line, ord("V"), 0)) & 0xFFFF, now)
+        elif 1 <= command <= 5:
+            out += self.pin_command(command, pin, number(ord("V")), 0, 0, now)
+        return bytes(out)
+
+    def set_input_mode(self, pin: int, mode: int, now: float):
+        if 0 < pin < self.io_pins:
+            self.pin_modes[pin] = mode
+            if mode:
+                self.schedule_scan(now)
+
+    def pin_command(self, opcode: int, pin: int, value: int, mask: int, bits: int, now: float) -> bytes:
+        """
+        P1-P5, P7 and the binary opcodes, returns the reply
+        """
+        if opcode == wire_protocol.OP_DIGITAL_WRITE_MANY:
+            for bit in range(16):
+                if mask & 1 << bit and 0 < pin * 16 + bit < self.io_pins:
+                    self.outputs[pin * 16 + bit] = bits >> bit & 1
+            return b""
+        if opcode == wire_protocol.OP_SERVO_WRITE:
+            self.servo_values[pin] = value
+            return b""
+        if not 0 < pin < self.io_pins:
+            return b""
+        if opcode == wire_protocol.OP_DIGITAL_READ:
+            level = 0 if self.inputs[pin] else 1  # Reports are 1 for LOW
+            if self.binary:
+                return wire_protocol.encode(wire_protocol.OP_DIGITAL_REPORT, pin, level)
+            return f'{level}\r\n'.encode()
+        if opcode == wire_protocol.OP_ANALOG_READ:
+            if self.binary:
+                return wire_protocol.encode(wire_protocol.OP_ANALOG_REPORT, pin, self.inputs[pin])
+            return f'{self.inputs[pin]}\r\n'.encode()
+        if opcode == wire_protocol.OP_DIGITAL_WRITE:
+            self.outputs[pin] = 0 if value == 0 else 1
+        elif opcode == wire_protocol.OP_ANALOG_WRITE:
+            self.outputs[pin] = value
+        return b""
+
+
+class Simulator:
+    # Shared loop of all "SIM" ConnectionOrganisers
+    default: ("Simulator", None) = None
+    default_lock = threading.Lock()
+
+    def __init__(self, debug: bool = False):
+        """
+        Runs any number of SimulatedBoards in one thread.\n
+        Each board sits on one end of a socket pair, the host end behaves like a Wi-Fi connection
+        (blocking recv/sendall, fileno for DevicePool). Timed work (latency, baud rate, report intervals)
+        goes through one heap, idle boards cost nothing.\n
+        Every board uses two file descriptors, raise the open file limit for thousands of boards.
+        :type debug: bool
+        """
+        self.debug = debug
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.RLock()  # Guards the boards and the heap
+        self.timers: list = []  # (time, sequence, callback, data)
+        self.sequence: int = 0
+        self.boards: list = []
+        self.running = True
+        self.wakeup_receive, self.wakeup_send = socket.socketpair()
+        self.wakeup_receive.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_receive, selectors.EVENT_READ, None)
+        self.thread = threading.Thread(target=self.__worker, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.boards)
+
+    @classmethod
+    def shared(cls) -> "Simulator":
+        """
+        Process-wide Simulator, started by the first user
+        :rtype: Simulator
+        """
+        with cls.default_lock:
+            if cls.default is None or not cls.default.running:
+                cls.default = cls()
+            return cls.default
+
+    def open(self, firmware: str = "GPIO_lib_mega", io_pins: int = None,
+             latency: float = 0, jitter: float = 0, baud: int = 0) -> (socket.socket, SimulatedBoard):
+        """
+        Power up a new board, returns the host end of its connection and the board.\n
+        The board greets with ">" like the firmware after a reset.
+        :rtype: (socket.socket, SimulatedBoard)
+        """
+        host, device = socket.socketpair()
+        return host, self.attach(device, firmware, io_pins, latency, jitter, baud)
+
+    def attach(self, connection, firmware: str = "GPIO_lib_mega", io_pins: int = None,
+               latency: float = 0, jitter: float = 0, baud: int = 0) -> SimulatedBoard:
+        """
+        Run a board on an existing device end, e.g. an accepted TCP connection or a pty master.\n
+        connection needs send(), recv(), fileno(), setblocking() and close() like a socket.
+        :rtype: SimulatedBoard
+        """
+        connection.setblocking(False)
+        board = SimulatedBoard(self, connection, firmware, io_pins, latency, jitter, baud)
+        with self.lock:
+            self.boards.append(board)
+            self.selector.register(connection, selectors.EVENT_READ, board)
+            board.emit(board.ack(), time.monotonic())
+        self.wake()
+        return board
+
+    def remove(self, board: SimulatedBoard):
+        with self.lock:
+            if board.closed:
+                return
+            board.closed = True
+            self.boards.remove(board)
+            try:
+                self.selector.unregister(board.connection)
+            except (KeyError, ValueError):
+                pass
+            board.connection.close()
+        if self.debug:
+            print(f'Info: Simulator removed {board}, {len(self.boards)} boards')
+
+    def close(self):
+        """
+        Stop the loop and power off every board
+        """
+        for board in list(self.boards):
+            self.remove(board)
+        self.running = False
+        self.wake()
+        if self.thread is not threading.current_thread():
+            self.thread.join(2)
+
+    def schedule(self, at: float, callback, data=None):
+        """
+        Run callback(data, now) or callback(now) in the loop thread at monotonic time at
+        """
+        with self.lock:
+            self.sequence += 1
+            heapq.heappush(self.timers, (at, self.sequence, callback, data))
+
+    def want_write(self, board: SimulatedBoard, write: bool):
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if write else selectors.EVENT_READ
+        try:
+            self.selector.modify(board.connection, events, board)
+        except (KeyError, ValueError):
+            pass
+
+    def wake(self):
+        if threading.current_thread() is self.thread:
+            return
+        try:
+            self.wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def __run_timers(self) -> (float, None):
+        """
+        Private function.\n
+        Run every due timer, returns the select() timeout until the next one
+        """
+        with self.lock:
+            while self.timers:
+                now = time.monotonic()
+                at, _, callback, data = self.timers[0]
+                if at > now:
+                    return at - now
+                heapq.heappop(self.timers)
+                if data is None:
+                    callback(now)
+                else:
+                    callback(data, now)
+        return None
+
+    def __worker(self):
+        """
+        Private function.\n
+        Simulator thread: timers, then every readable or writable board
+        """
+        while self.running:
+            timeout = self.__run_timers()
+            try:
+                events = self.selector.select(timeout)
+            except (ValueError, OSError) as e:
+                if self.debug:
+                    print(f'ERROR [{e}]: Simulator select()')
+                time.sleep(0.01)
+                continue
+            now = time.monotonic()
+            for key, mask in events:
+                board = key.data
+                if board is None:
+                    try:
+                        while self.wakeup_receive.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                with self.lock:
+                    if board.closed:
+                        continue
+                    if mask & selectors.EVENT_WRITE:
+                        board.write_pending()
+                    if mask & selectors.EVENT_READ:
+                        try:
+                            data = board.connection.recv(4096)
+                        except BlockingIOError:
+                            continue
+                        except OSError:
+                            data = b""
+                        if data:
+                            board.receive(data, now)
+                        else:
+                            # Host closed the connection: board is unplugged
+                            self.remove(board)
+        self.selector.close()
+        if self.debug:
+            print("END Simulator")
@@ -1,18 +1,257 @@
+import functools
+import threading
 import time
+from array import array
+
+
+class Histogram:
+    def __init__(self, sub_bucket_bits: int = 5):
+        """
+        HDR style log-linear histogram of non negative integers (ns).\n
+        Values below 2 ** (sub_bucket_bits + 1) are exact, above every power of two is split into
+        2 ** sub_bucket_bits buckets: relative error below 2 ** -sub_bucket_bits (3 % for 5 bits).
+        Memory grows with the largest value only, recording is a few integer operations.
+        :type sub_bucket_bits: int
+        """
+        self.sub_bucket_bits = int(sub_bucket_bits)
+        self.sub_buckets = 1 << self.sub_bucket_bits
+        self.counts = array("q")
+        self.count: int = 0
+
+    def __len__(self):
+        return self.count
+
+    def index(self, value: int) -> int:
+        """
+        Bucket of value
+        :rtype: int
+        """
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        if shift <= 0:
+            return value
+        return (shift + 1 << self.sub_bucket_bits) + (value >> shift) - self.sub_buckets
+
+    def value_at(self, index: int) -> int:
+        """
+        Highest value of bucket index
+        :rtype: int
+        """
+        if index < self.sub_buckets << 1:
+            return index
+        shift = (index >> self.sub_bucket_bits) - 1
+        sub_bucket = (index & self.sub_buckets - 1) + self.sub_buckets
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        """
+        Add count times value (int >= 0), index() inlined for hot loops
+        """
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        index = value if shift <= 0 else (shift + 1 << self.sub_bucket_bits) + (value >> shift) - self.sub_buckets
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend(bytes(array("q").itemsize * (index + 1 - len(counts))))
+        counts[index] += count
+        self.count += count
+
+    def percentile(self, percent: float) -> int:
+        """
+        Value that percent % of the recorded values are below or equal to, 0 without values
+        :type percent: float
+        :rtype: int
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.value_at(index)
+        return self.value_at(len(self.counts) - 1)
+
+    def merge(self, other: "Histogram"):
+        """
+        Add the values of other, both need the same sub_bucket_bits
+        :type other: Histogram
+        """
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("histograms need the same sub_bucket_bits to merge")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend(bytes(array("q").itemsize * (len(other.counts) - len(self.counts))))
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+
+    def buckets(self) -> list:
+        """
+        [(highest value of the bucket, count), ...] of every used bucket
+        :rtype: list
+        """
+        return [(self.value_at(index), count) for index, count in enumerate(self.counts) if count]
+
+    def clear(self):
+        self.counts = array("q")
+        self.count = 0
+
+
+class Section:
+    __slots__ = ("count", "total", "min", "max", "histogram", "lock")
+
+    def __init__(self, sub_bucket_bits: int = 5):
+        """
+        Accumulator of one named Timer section: count, total, min, max (ns) and a Histogram
+        """
+        self.count: int = 0
+        self.total: int = 0
+        self.min: int = 0
+        self.max: int = 0
+        self.histogram = Histogram(sub_bucket_bits)
+        self.lock = threading.Lock()
+
+    def record(self, duration: int):
+        with self.lock:
+            if duration < self.min or not self.count:
+                self.min = duration
+            if duration > self.max:
+                self.max = duration
+            self.count += 1
+            self.total += duration
+            self.histogram.record(duration)
+
+    def report(self, percentiles: tuple = (50, 90, 99, 99.9)) -> dict:
+        with self.lock:
+            report = {
+                "count": self.count,
+                "total_ns": self.total,
+                "min_ns": self.min,
+                "max_ns": self.max,
+                "mean_ns": self.total / self.count if self.count else 0.0,
+            }
+            for percent in percentiles:
+                # Bucket bounds may lie outside of the recorded range
+                report[f'p{percent:g}_ns'] = min(max(self.histogram.percentile(percent), self.min), self.max)
+        return report
+
+
+class Span:
+    __slots__ = ("section", "start_ns")
+
+    def __init__(self, section: Section):
+        """
+        One measurement of a section, see Timer.section()
+        """
+        self.section = section
+        self.start_ns: int = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.section.record(time.perf_counter_ns() - self.start_ns)
+        return False
 
 
 class Timer:
-    def __init__(self):
+    def __init__(self, name: str = "total", sub_bucket_bits: int = 5):
+        """
+        Time code with time.perf_counter_ns() into named sections.\n
+        start()/stop() measure and print one run like before. Without printing:\n
+        with timer: ...                       -> section name\n
+        with timer.section("send"): ...       -> section "send", sections can nest\n
+        @timer / @timer.timed("name")         -> every call of the function\n
+        timer.record("name", ns)              -> a duration measured elsewhere\n
+        Every section keeps count, min, max, mean and a Histogram, report() returns them as dict.
+        :type name: str
+        :type sub_bucket_bits: int
+        """
+        self.name = name
+        self.sub_bucket_bits = sub_bucket_bits
         self.total: float = 0
         self.start_tm: int = 0
+        self.sections: dict = {}  # name -> Section
+        self.sections_lock = threading.Lock()
+        self.local = threading.local()  # Start times of nested "with timer:" per thread
 
     def start(self):
-        self.start_tm = time.time()
+        self.start_tm = time.perf_counter_ns()
 
     def stop(self, operations=0) -> float:
         if not self.start_tm == 0:
-            self.total = time.time() - self.start_tm
+            duration = time.perf_counter_ns() - self.start_tm
+            self.get_section(self.name).record(duration)
+            self.total = duration / 1e9
             print(f"Total time: {self.total:.10f}")
             if operations > 0:
                 print(f"Time per operation: {self.total / operations}")
             return self.total
+
+    def get_section(self, name: str) -> Section:
+        """
+        Accumulator of section name, created on first use
+        :rtype: Section
+        """
+        section = self.sections.get(name)
+        if section is None:
+            with self.sections_lock:
+                section = self.sections.setdefault(name, Section(self.sub_bucket_bits))
+        return section
+
+    def section(self, name: str) -> Span:
+        """
+        Context manager timing its block into section name
+        :rtype: Span
+        """
+        return Span(self.get_section(name))
+
+    def record(self, name: str, duration_ns: int):
+        self.get_section(name).record(duration_ns)
+
+    def timed(self, name: str = None):
+        """
+        Decorator timing every call into section name (default: qualified name of the function)
+        """
+        def decorator(function):
+            section = self.get_section(name or function.__qualname__)
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start_ns = time.perf_counter_ns()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    section.record(time.perf_counter_ns() - start_ns)
+            return wrapper
+        return decorator
+
+    def __call__(self, function):
+        return self.timed()(function)
+
+    def __enter__(self):
+        starts = getattr(self.local, "starts", None)
+        if starts is None:
+            starts = self.local.starts = []
+        starts.append(time.perf_counter_ns())
+        return self
+
+    def __exit__(self, *exc_info):
+        self.get_section(self.name).record(time.perf_counter_ns() - self.local.starts.pop())
+        return False
+
+    def report(self, percentiles: tuple = (50, 90, 99, 99.9)) -> dict:
+        """
+        {section: {count, total_ns, min_ns, max_ns, mean_ns, p50_ns, ...}}
+        :type percentiles: tuple
+        :rtype: dict
+        """
+        with self.sections_lock:
+            sections = list(self.sections.items())
+        return {name: section.report(percentiles) for name, section in sections}
+
+    def reset(self):
+        with self.sections_lock:
+            self.sections = {}
+        self.total = 0
+        self.start_tm = 0
@@ -0,0 +1,222 @@
+# Binary wire protocol of GPIO_Lib
+#
+# Opt-in alternative to the text commands (P2 N13 V1 / d:13:1), negotiated with "M110 S1".
+# Text lines (bytes < 0x80) stay valid in both directions, binary frames start with a byte >= 0x80.
+#
+# Frame: [header][pin][value (length bytes, little endian)][crc8]
+#   header = 0x80 | opcode << 3 | length     opcode 0-15, length 0-7
+#   crc8   = CRC-8 (poly 0x07) over header, pin and value
+# The ack is the single byte 0x80 (opcode 0, no pin, no crc).
+#
+# FrameReader splits the received stream (text lines and frames) for both protocols. It decodes binary frames only
+# after the "bin:1" answer of "M110 S1" (until "bin:0"), in text mode bytes >= 0x80 are part of the text line.
+
+OP_ACK = 0
+OP_DIGITAL_READ = 1
+OP_DIGITAL_WRITE = 2
+OP_ANALOG_READ = 3
+OP_ANALOG_WRITE = 4
+OP_SERVO_WRITE = 5
+OP_DIGITAL_WRITE_MANY = 6  # pin: bank of 16 pins, value: mask | bits << 16
+OP_DIGITAL_REPORT = 8
+OP_ANALOG_REPORT = 9
+
+FRAME_FLAG = 0x80
+ACK = bytes([FRAME_FLAG])
+
+# Value length of every opcode
+VALUE_LENGTH = {
+    OP_DIGITAL_READ: 0,
+    OP_DIGITAL_WRITE: 1,
+    OP_ANALOG_READ: 0,
+    OP_ANALOG_WRITE: 2,
+    OP_SERVO_WRITE: 1,
+    OP_DIGITAL_WRITE_MANY: 4,
+    OP_DIGITAL_REPORT: 1,
+    OP_ANALOG_REPORT: 2,
+}
+
+# io_pins of the firmware settings.h for every board
+BOARD_IO_PINS = {
+    "GPIO_lib_mega": 70,
+    "GPIO_lib_uno": 20,
+}
+DEFAULT_IO_PINS = 70
+
+
+def board_io_pins(firmware: str = None, io_pins: int = None) -> int:
+    """
+    Pin count of the board, io_pins overrides the count from the firmware name
+    :type firmware: str
+    :type io_pins: int
+    :rtype: int
+    """
+    return int(io_pins or BOARD_IO_PINS.get(firmware, DEFAULT_IO_PINS))
+
+
+# Input reports are handed to the receive queue as (kind, pin, value), kind like the text protocol
+REPORT_KIND = {
+    OP_DIGITAL_REPORT: "d",
+    OP_ANALOG_REPORT: "a",
+}
+
+
+def _crc8_table() -> list:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data) -> int:
+    """
+    CRC-8 (poly 0x07, init 0) as used by the firmware
+    :type data: bytes
+    :rtype: int
+    """
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode(opcode: int, pin: int, value: int = 0) -> bytes:
+    """
+    Build a binary frame.\n
+    The value length is taken from VALUE_LENGTH.
+    :type opcode: int
+    :type pin: int
+    :type value: int
+    :rtype: bytes
+    """
+    length = VALUE_LENGTH[opcode]
+    body = bytes([FRAME_FLAG | opcode << 3 | length, pin]) + int(value).to_bytes(length, "little")
+    return body + bytes([crc8(body)])
+
+
+def frame_size(header: int) -> int:
+    """
+    Complete size of a frame starting with header
+    :type header: int
+    :rtype: int
+    """
+    if header == FRAME_FLAG:
+        return 1
+    return 3 + (header & 0x07)
+
+
+def decode(frame, binary: bool = True) -> (str, tuple):
+    """
+    Turn a frame from FrameReader into a message:\n
+    ">" for an ack, str for a text line, (kind, pin, value) for a binary input report.\n
+    Pass FrameReader.binary, in text mode every frame is a text line.
+    :type frame: memoryview
+    :type binary: bool
+    :rtype: (str, tuple)
+    """
+    header = frame[0]
+    if binary and header & FRAME_FLAG:
+        if len(frame) == 1:
+            return ">"
+        opcode = (header >> 3) & 0x0F
+        return REPORT_KIND.get(opcode, opcode), frame[1], int.from_bytes(frame[2:-1], "little")
+    return str(frame, "utf-8", "replace")
+
+
+class FrameReader:
+    def __init__(self, size: int = 4096, binary: bool = False):
+        """
+        Receive buffer for the WiFi/USB stream.\n
+        Data is read straight into a preallocated bytearray (recv_into/readinto) and complete text lines or
+        binary frames are handed out as memoryview slices of that buffer, nothing gets copied or concatenated.\n
+        Only an incomplete frame at the end of the buffer is moved to the front before the next read.\n
+        binary: decode binary frames, switched by the "bin:1"/"bin:0" lines of the firmware in the stream itself.
+        :type size: int
+        :type binary: bool
+        """
+        self.binary = binary
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start: int = 0  # First byte not handed out yet
+        self.end: int = 0  # End of received data
+        self.crc_errors: int = 0
+        self.overflows: int = 0
+
+    def free(self) -> memoryview:
+        """
+        Writable view on the free part of the buffer
+        :rtype: memoryview
+        """
+        if self.end == len(self.buffer):
+            pending = self.end - self.start
+            if pending == len(self.buffer):
+                # A line without end that fills the whole buffer is garbage
+                self.overflows += 1
+                pending = 0
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def read_from(self, read_into) -> int:
+        """
+        Fill the buffer with read_into(view) -> count, like socket.recv_into or Serial.readinto
+        :rtype: int
+        """
+        count = read_into(self.free())
+        self.end += count
+        return count
+
+    def feed(self, data: bytes) -> int:
+        """
+        Copy data that was already read (asyncio streams) into the buffer.\n
+        Read at most len(free()) bytes before, the rest is dropped.
+        :type data: bytes
+        :rtype: int
+        """
+        view = self.free()
+        count = min(len(data), len(view))
+        view[:count] = data[:count]
+        self.end += count
+        return count
+
+    def frames(self):
+        """
+        Yield every complete frame as memoryview: text lines without line ending, binary frames complete.\n
+        Frames with a wrong CRC are skipped.
+        The views are only valid until the next read_from().
+        """
+        buffer = self.buffer
+        while self.start < self.end:
+            pos = self.start
+            if self.binary and buffer[pos] & FRAME_FLAG:
+                header = buffer[pos]
+                size = frame_size(header)
+                if pos + size > self.end:
+                    return
+                self.start = pos + size
+                if size > 1 and crc8(self.view[pos:pos + size - 1]) != buffer[pos + size - 1]:
+                    self.crc_errors += 1
+                    continue
+                yield self.view[pos:pos + size]
+            else:
+                line_end = buffer.find(b"\n", pos, self.end)
+                if line_end < 0:
+                    return
+                self.start = line_end + 1
+                stop = line_end
+                if stop > pos and buffer[stop - 1] == 0x0D:
+                    stop -= 1
+                if stop > pos:
+                    if stop - pos == 5 and buffer[pos:pos + 4] == b"bin:":
+                        # Answer of M110, the firmware switches right after this line
+                        self.binary = buffer[pos + 4] == 0x31
+                    yield self.view[pos:stop]
+        # Everything handed out, start over at the front
+        self.start = self.end = 0
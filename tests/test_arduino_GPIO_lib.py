@@ -0,0 +1,57 @@
+import os
+import time
+
+from px_device_interfaces import ArduinoGPIOlib
+
+
+def write_file(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(text)
+
+
+def test_resync_replays_by_configured_type(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_file("sys_files/Connection_Organiser/sim.data", "type:SIM\n")
+    write_file("sys_files/GPIO_Lib/sim.data", ">output 13 led\n>output_analog 9 fan\n")
+
+    gpio = ArduinoGPIOlib("sim", firmware="GPIO_lib_mega", init_connect=True)
+    try:
+        assert gpio.configured
+        gpio.digital_write("led", True)
+        # An analog value of 1 must not come back as a digital write
+        gpio.analog_write("fan", 1)
+
+        sent = []
+        gpio.send = lambda data, type_of_data="str": sent.append(data)
+        gpio.resync()
+        del gpio.send
+        assert "P4 N9 V1" in sent
+        assert "P2 N13 V1" in sent
+        assert len(sent) == 2
+    finally:
+        gpio.disconnect()
+
+
+def test_polling_history_keeps_plain_reports(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_file("sys_files/Connection_Organiser/sim.data", "type:SIM\n")
+    write_file("sys_files/GPIO_Lib/sim.data", ">input_pullup 22 button\n")
+
+    gpio = ArduinoGPIOlib("sim", firmware="GPIO_lib_mega", init_connect=True)
+    try:
+        gpio.flush(5)
+        time.sleep(0.2)
+        gpio.update_input()
+        gpio.enable_history(22)
+
+        sent_ns = time.monotonic_ns()
+        gpio.sim_board.set_input(22, 1)
+        report = gpio.receive_q.get(timeout=2)
+        # Direct consumers of the receive_q still get the plain report
+        assert isinstance(report, (str, tuple))
+        times, values = gpio.history(22)
+        assert list(values) == [1]
+        assert times[0] >= sent_ns
+    finally:
+        gpio.disconnect()
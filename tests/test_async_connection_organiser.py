@@ -0,0 +1,32 @@
+import asyncio
+import os
+
+from px_device_interfaces import AsyncConnectionOrganiser
+
+
+def write_settings(name: str, settings: str):
+    path = f'sys_files/Connection_Organiser/{name}.data'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(settings)
+
+
+def test_reconnect_reads_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_settings("sim", "type:SIM\n")
+
+    async def run():
+        device = AsyncConnectionOrganiser("sim", firmware="GPIO_lib_mega")
+        await device.connect()
+        assert device.connected
+        await device.disconnect()
+
+        await device.connect()
+        assert device.connected
+        await device.send("M100")
+        # Ends with the sentinel of the last disconnect() if the old queue was kept
+        assert await asyncio.wait_for(device.receive(), 2) == "GPIO_lib_mega"
+        await device.disconnect()
+        assert await device.receive() is None
+
+    asyncio.run(run())
@@ -0,0 +1,21 @@
+from px_device_interfaces import ConnectionOrganiser
+from px_device_interfaces.connection_organiser_with_opc import save_settings
+
+
+def test_save_settings_keeps_other_keys(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    settings_dir = tmp_path / "sys_files" / "Connection_Organiser"
+    settings_dir.mkdir(parents=True)
+    settings_file = settings_dir / "dev.data"
+    settings_file.write_text("type:USB\nusb_port:COM3\nsend_window:8\nprotocol:binary\nauto_reconnect:1\n")
+
+    device = ConnectionOrganiser("dev")
+    device.usb_port = "/dev/ttyACM1"
+    save_settings(device)
+
+    lines = settings_file.read_text().splitlines()
+    assert "usb_port:/dev/ttyACM1" in lines
+    assert "usb_port:COM3" not in lines
+    for line in ("type:USB", "send_window:8", "protocol:binary", "auto_reconnect:1", "wifi_host:"):
+        assert line in lines
+    assert len(lines) == len(set(line.split(":", 1)[0] for line in lines))